@@ -5,8 +5,10 @@ import numpy as np
 from labonchip.Methods.Devices.Arduino import Arduino
 from labonchip.Methods.Devices.Picoscope import Picoscope
 from labonchip.Methods.Devices.ITC4001 import ITC4001
+from labonchip.Methods.Devices.SyringePump import SyringePump
 from labonchip.Methods.HelperFunctions import folder_analysis, plot_analysis, dilution, \
     sweeps_number
+from labonchip.Methods.Settling import LifetimeProbe, settle_laser, wait_equilibrated
 
 if __name__ == "__main__":
     # Measurement Info Dictionary
@@ -44,12 +46,9 @@ if __name__ == "__main__":
     water = 1           # Syringe Pump address
     intralipid = 2      # Syringe Pump address
     pump = SyringePump()
-    pump.send_command(water, 'DIA 26.59')  # Set Syringe Diameter for 60ml syringe
-    pump.send_command(intralipid, 'DIA 26.59')
-
-    # Clear dispensed volume
-    pump.send_command(water, 'CLD INF')
-    pump.send_command(intralipid, 'CLD INF')
+    # Set Syringe Diameter for 60ml syringe and clear dispensed volume, both pumps at once
+    pump.send_commands([(water, 'DIA 26.59'), (intralipid, 'DIA 26.59'),
+                        (water, 'CLD INF'), (intralipid, 'CLD INF')])
 
     # Flush 2 ml/min for 1 min
     print("Flushing water...")
@@ -59,6 +58,10 @@ if __name__ == "__main__":
     pump.send_command(water, 'STP')
     print("Flush finished!")
 
+    # Quick lifetime readings to follow the new mixture onto the chip
+    probe = LifetimeProbe(scope, blocks=5)
+    transit_times = []
+
     # Set Flow Rate to desired dilution (ml/min)
     for conc_out in np.linspace(start=0, stop=conc_stock, endpoint=True, num=21):
         # Update concentration to save to data files
@@ -69,20 +72,27 @@ if __name__ == "__main__":
         print('Concentration is {conc:.2f}, flow rate of water {dilute:.2f} and IL {intra:.2f} ml/min'
               .format(conc=conc_out, dilute=vol_dilute, intra=vol_stock))
 
-        # Send rates to pumps
-        pump.send_command(water, 'RAT {:.2f} MM'.format(vol_dilute))
-        pump.send_command(intralipid, 'RAT {:.2f} MM'.format(vol_stock))
-        pump.send_command(water, 'RUN')
-        pump.send_command(intralipid, 'RUN')
-
-        # 1 Min flush
-        time.sleep(55)
+        # Send rates to pumps and start them, the rates are read back to check them
+        log['pump_time'] = pump.set_rates({water: vol_dilute, intralipid: vol_stock})
+
+        # Wait for the new mixture to reach the chip and the lifetime to plateau (was a fixed 55 s flush).
+        # Steps too small to see are given 1.5 times the transit measured so far.
+        laserDriver.set_ld_current(0.5)
+        laserDriver.turn_ld_on()
+        max_transit = 1.5 * np.median(transit_times) if transit_times else 55
+        flow = wait_equilibrated(probe, tolerance=0.02, max_transit=max_transit, max_wait=120)
+        if np.isfinite(flow['transit_time']):
+            transit_times.append(flow['transit_time'])
+        log['transit_time'] = flow['transit_time']
+        log['equilibration_time'] = flow['equilibration_time']
+        print('Equilibrated in {:.0f} s (transit {:.0f} s)'.format(flow['equilibration_time'], flow['transit_time']))
         # Sweep over various pump powers
         for current in [0.5, 0.4, 0.3, 0.2, 0.1]:
             log["current"] = current  # Laser drive current(A)
             laserDriver.set_ld_current(log["current"])
             laserDriver.turn_ld_on()
-            time.sleep(5)  # Wait for laser driver to fire up
+            # Wait for laser driver to fire up
+            log['settle_time'] = settle_laser(laserDriver, scope, on=True, reference=log.get('optical power'))[1]
             log['optical power'] = laserDriver.get_optical_power()
 
             # Capture and fit single sweeps
@@ -94,8 +104,7 @@ if __name__ == "__main__":
         # sweeps_number(sweeps=250, log=log, arduino=arduino, scope=scope, laserDriver=laserDriver)
         # sweeps_time(mins=5, log=log, arduino=arduino, scope=scope, laserDriver=laserDriver)
 
-        pump.send_command(water, 'STP')
-        pump.send_command(intralipid, 'STP')
+        pump.send_commands([(water, 'STP'), (intralipid, 'STP')])
 
     # Stop and close all instruments
     scope.closeScope()
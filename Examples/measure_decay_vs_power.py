@@ -5,7 +5,8 @@ import matplotlib.pyplot as plt
 import numpy as np
 from picoscope import ps5000a
 
-from labonchip.Methods.HelperFunctions import sweeps_number, text_when_done
+from labonchip.Methods.HelperFunctions import record_background, sweeps_number, text_when_done
+from labonchip.Methods.Settling import settle_laser
 
 
 class Picoscope:
@@ -44,6 +45,12 @@ class Picoscope:
         # print("Sampling Done")
         return self.ps.getDataV("A")
 
+    def measure_blocks(self, blocks):
+        """Capture `blocks` consecutive blocks, yielding the data of each one as soon as it arrives."""
+        for _ in range(blocks):
+            self.armMeasure()
+            yield self.measure()
+
     def closeScope(self):
         self.ps.close()
 
@@ -78,6 +85,8 @@ def measure():
     # How long to capture the decay for (ms) [same as picoscope]
     pulse_duration = 100E-3
     decay_time = 100E-3
+    # Laser-off background sweeps recorded after each setpoint (0 to just wait)
+    background_sweeps = 20
 
     # Measurement Info Dictionary
     log = dict(measurementID=str(datetime.now().timestamp()),
@@ -118,7 +127,7 @@ def measure():
         log["current"] = current  # Laser drive current(A)
         laserDriver.set_ld_current(current)
         laserDriver.turn_ld_on()
-        time.sleep(3)
+        log['settle_time'] = settle_laser(laserDriver, scope, on=True, reference=log.get('optical power'))[1]
         log['optical power'] = laserDriver.get_optical_power()
 
         # Save plot of the decay
@@ -128,7 +137,12 @@ def measure():
 
         sweeps_number(2500, log, scope, laserDriver, dataf=dataf, arduino=arduino, thermocouple=False)
         laserDriver.turn_ld_off()
-        time.sleep(1)
+
+        # Record the laser-off background of this setpoint instead of idling
+        if background_sweeps:
+            record_background(background_sweeps, log, scope, dataf=dataf)
+        else:
+            settle_laser(laserDriver, on=False, reference=log['optical power'])
 
     # Stop and close all instruments
     scope.closeScope()
@@ -1,10 +1,12 @@
-import time
 from datetime import datetime
 
 import matplotlib.pyplot as plt
 import numpy as np
 
-from labonchip.Methods.HelperFunctions import folder_analysis, sweeps_number, text_when_done
+from labonchip.Methods.Environment import EnvironmentLogger
+from labonchip.Methods.HelperFunctions import folder_analysis, record_background, sweeps_number, text_when_done
+from labonchip.Methods.Settling import settle_laser
+from labonchip.Methods.Statistics import GroupedRollingStats
 
 
 def plot(folder, data_folder='../Data/', save=True):
@@ -16,16 +18,18 @@ def plot(folder, data_folder='../Data/', save=True):
     # Create column for time since start of measurement
     df['delta'] = (df['datetime'] - df['datetime'][0]).fillna(0).astype('timedelta64[us]') / (1E6 * 60)
 
+    # Rolling averages per current, built in a single pass over the sweeps
+    rolling = GroupedRollingStats(keys=['current'], columns=['tau', 'A'], window=20)
+    rolling.update_frame(df)
+
     # Plot in time since beginning of experiment
     from collections import OrderedDict
     fig, (ax1, ax2) = plt.subplots(2, 1, sharex=True)
-    for key, group in df.groupby(['current']):
+    for key, group in df.groupby('current'):
         ax1.plot(group['delta'], group['tau'], 'o', alpha=0.05, label=key)
-        rolling = group['tau'].rolling(window=20).mean()
-        ax1.plot(group['delta'], rolling, '-', label='rolling average', color='black')
+        ax1.plot(group['delta'], rolling.history(key, 'tau')['mean'], '-', label='rolling average', color='black')
         ax2.plot(group['delta'], group['A'], 'o', alpha=0.05, label=key)
-        rolling = group['A'].rolling(window=20).mean()
-        ax2.plot(group['delta'], rolling, '-', label='rolling average', color='black')
+        ax2.plot(group['delta'], rolling.history(key, 'A')['mean'], '-', label='rolling average', color='black')
     handles, labels = plt.gca().get_legend_handles_labels()
     by_label = OrderedDict(zip(labels, handles))
     plt.legend(by_label.values(), by_label.keys(), ncol=2)
@@ -115,15 +119,29 @@ def measure():
 
     # How long to capture the decay for (ms) [same as picoscope]
     decay_time = 120
+    # Laser-off background sweeps recorded after each setpoint (0 to just wait)
+    background_sweeps = 20
 
     # Setup devices
     laserDriver = ITC4001()
-    laserDriver.setup_980nm_ld()
-    laserDriver.set_ld_shape('PULS')
+    with laserDriver.batch(verify=True):
+        laserDriver.setup_980nm_ld()
+        laserDriver.set_ld_shape('PULS')
     arduino = Arduino()
     scope = Picoscope()
     scope.openScope()
 
+    # Live rolling lifetime statistics for every setpoint
+    tracker = GroupedRollingStats(keys=['current', 'pulse_width'], columns=['tau', 'A'], window=20)
+
+    # Sensors and laser power are logged as their own time series, joined to the sweeps in analysis
+    arduino.start()
+    laserDriver.start_monitor(interval=0.5)
+    environment = EnvironmentLogger('../Data/' + str(log['measurementID']) + '/environment.csv',
+                                    sources={'arduino': arduino.latest, 'laser': laserDriver.latest},
+                                    interval=1.0)
+    environment.start()
+
     # Update Experimental Log
     log['tempC'] = arduino.tempC
     log['humidity'] = arduino.humidity
@@ -134,16 +152,20 @@ def measure():
     for current in np.arange(0.1, 0.6, step=0.1)[::-1]:
         print("Measuring at {0:3f}A power:".format(current))
         log["current"] = current  # Laser drive current(A)
-        laserDriver.set_ld_current(current)
 
         # Sweep over pulse times (ms)
         for pulse_duration in [1, 5, 10, 20, 30, 40, 50, 70, 100][::-1]:
             print("Pulse width: {0:.2f}".format(pulse_duration))
             log['pulse_width'] = pulse_duration
-            laserDriver.set_qcw(period=(pulse_duration+decay_time)*1e-3, width=pulse_duration*1e-3)
 
-            laserDriver.turn_ld_on()
-            time.sleep(3)
+            # New setpoint and laser on in one message, checked in the same round trip
+            # (settings that did not change are not re-sent)
+            with laserDriver.batch(verify=True):
+                laserDriver.set_ld_current(current)
+                laserDriver.set_qcw(period=(pulse_duration+decay_time)*1e-3, width=pulse_duration*1e-3)
+                laserDriver.turn_ld_on()
+            # Wait for the laser power and the signal to settle rather than a fixed time
+            log['settle_time'] = settle_laser(laserDriver, scope, on=True, reference=log.get('optical power'))[1]
             log['optical power'] = laserDriver.get_optical_power()
 
             # Save plot of the decay
@@ -153,15 +175,27 @@ def measure():
             plt.close(fig)  # close the figure
 
             sweeps_number(sweeps=100, log=log, arduino=arduino, scope=scope, laserDriver=laserDriver,
-                          thermocouple=False)
+                          thermocouple=False, tracker=tracker, environment=environment)
             laserDriver.turn_ld_off()
-            time.sleep(1)
+
+            # Record the laser-off background of this setpoint instead of idling
+            if background_sweeps:
+                record_background(background_sweeps, log, scope)
+            else:
+                settle_laser(laserDriver, on=False, reference=log['optical power'])
 
     # Stop and close all instruments
+    environment.stop()
+    laserDriver.stop_monitor()
     scope.closeScope()
     arduino.close()
     print('Finished measurement.')
 
+    # End of run summary from the live rolling statistics
+    summary = tracker.summary()
+    summary.to_csv('../Data/' + str(log['measurementID']) + '/live_summary.csv')
+    print(summary[['current', 'pulse_width', 'tau_mean', 'tau_std', 'tau_median']])
+
     return log['measurementID']
 
 
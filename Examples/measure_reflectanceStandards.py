@@ -9,6 +9,7 @@ from labonchip.Methods.Devices.Arduino import Arduino
 from labonchip.Methods.Devices.Picoscope import Picoscope
 from labonchip.Methods.Devices.ITC4001 import ITC4001
 from labonchip.Methods.HelperFunctions import folder_analysis, plot_analysis, copy_data
+from labonchip.Methods.Settling import settle_laser
 
 
 def sweeps_number(sweeps, log, arduino, scope, laserDriver):
@@ -82,7 +83,8 @@ if __name__ == "__main__":
             log["current"] = current  # Laser drive current(A)
             laserDriver.set_ld_current(log["current"])
             laserDriver.turn_ld_on()
-            time.sleep(5)  # Wait for laser driver to fire up
+            # Wait for laser driver to fire up
+            log['settle_time'] = settle_laser(laserDriver, scope, on=True, reference=log.get('optical power'))[1]
             log['optical power'] = laserDriver.get_optical_power()
 
             if current == 0.5:
@@ -91,7 +93,7 @@ if __name__ == "__main__":
             # Capture and fit single sweeps
             sweeps_number(sweeps=500, log=log, arduino=arduino, scope=scope, laserDriver=laserDriver)
             laserDriver.turn_ld_off()
-            time.sleep(1)
+            settle_laser(laserDriver, on=False, reference=log['optical power'])
         try:
             winsound.Beep(500, 1000)
         except:
@@ -1,11 +1,10 @@
-import time
-
 import matplotlib.pyplot as plt
 
 from labonchip.Methods.Devices.Arduino import Arduino
 from labonchip.Methods.Devices.ITC4001 import ITC4001
 from labonchip.Methods.Devices.Picoscope import Picoscope
 from labonchip.Methods.HelperFunctions import folder_analysis, plot_analysis, sweeps_number
+from labonchip.Methods.Settling import settle_laser
 
 if __name__ == "__main__":
     # Measurement Info Dictionary
@@ -41,7 +40,8 @@ if __name__ == "__main__":
 
     # Begin laser pulse
     laserDriver.turn_ld_on()
-    time.sleep(5)  # Wait for laser driver to fire up
+    # Wait for laser driver to fire up
+    log['settle_time'] = settle_laser(laserDriver, scope, on=True)[1]
     log['optical power'] = laserDriver.get_optical_power()
 
     # Save plot of the decay
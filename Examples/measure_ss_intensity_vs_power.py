@@ -9,6 +9,8 @@ from tqdm import tqdm
 
 from labonchip.Methods.Devices.Arduino import Arduino
 from labonchip.Methods.Devices.ITC4001 import ITC4001
+from labonchip.Methods.Settling import settle_laser
+from labonchip.Methods.Statistics import StreamingStats
 
 
 class Picoscope:
@@ -47,6 +49,12 @@ class Picoscope:
         # print("Sampling Done")
         return self.ps.getDataV("A")
 
+    def measure_blocks(self, blocks):
+        """Capture `blocks` consecutive blocks, yielding the data of each one as soon as it arrives."""
+        for _ in range(blocks):
+            self.armMeasure()
+            yield self.measure()
+
     def closeScope(self):
         self.ps.close()
 
@@ -74,22 +82,31 @@ class Picoscope:
         return fig
 
 
-def measure(log, dataf='../Data/'):
+def measure(log, dataf='../Data/', blocks=40, save_raw=False, hist_range=(-4.0, 6.0), bins=200):
+    """
+    Capture `blocks` scope blocks and reduce them as they arrive to mean, std, min/max and a histogram.
+    Only the summary is saved (folder/summary) unless save_raw is True.
+    The default histogram range covers channel A (5 V range with -1 V offset).
+    """
     import os
 
     # Make directory to store files
     directory = dataf + str(log['measurementID'])
     if not os.path.exists(directory):
         os.makedirs(directory + "/raw")
+        os.makedirs(directory + "/summary")
         os.makedirs(directory + "/Plots")
 
-    # Collect data from picoscope (detector)
+    # Collect data from picoscope (detector), reducing each block as it arrives
     log['datetime'] = datetime.now()
-    scope.armMeasure()
-    data = scope.measure()
-    data = pd.Series(data)
-
-    # Save a plot
+    stats = StreamingStats(bins=bins, hist_range=hist_range)
+    raw = []
+    for data in scope.measure_blocks(blocks):
+        stats.update(data)
+        if save_raw:
+            raw.append(np.asarray(data))
+
+    # Save a plot of the last block
     y = data
     x = scope.get_time()
     fig, ax = plt.subplots()
@@ -97,14 +114,44 @@ def measure(log, dataf='../Data/'):
     ax.grid(True, which="major")
     ax.set_ylabel('Intensity (A.U.)')
     ax.set_xlabel("Time (ms)")
-    fig.savefig(directory + '/Plots/current_{0:.3f}.png'.format(current))
+    fig.savefig(directory + '/Plots/current_{0:.3f}.png'.format(log['current']))
     plt.close(fig)  # close the figure
 
-    # Save data as h5 file
-    storeRaw = pd.HDFStore(directory + "/raw/" + str(log['datetime'].timestamp()) + ".h5")
-    storeRaw.put('log/', pd.DataFrame(log, index=[0]))
-    storeRaw.put('data/', data)
-    storeRaw.close()
+    # Save summary (and optionally the raw data) as h5 files
+    log['blocks'] = blocks
+    fname = str(log['datetime'].timestamp()) + ".h5"
+    storeSummary = pd.HDFStore(directory + "/summary/" + fname)
+    storeSummary.put('log/', pd.DataFrame(dict(log, **stats.summary()), index=[0]))
+    if stats.hist is not None:
+        storeSummary.put('hist/', pd.Series(stats.hist, index=(stats.edges[1:] + stats.edges[:-1]) / 2))
+    storeSummary.close()
+
+    if save_raw:
+        storeRaw = pd.HDFStore(directory + "/raw/" + fname)
+        storeRaw.put('log/', pd.DataFrame(log, index=[0]))
+        storeRaw.put('data/', pd.Series(np.concatenate(raw)))
+        storeRaw.close()
+
+
+def summary_analysis(folder, savename='analysis', dir='../Data'):
+    """Collect the summaries saved by measure inside: folder/summary"""
+    import glob as gb
+
+    directory = dir + str(folder)
+    files = gb.glob(directory + "/summary/*.h5")
+    df = pd.concat([pd.read_hdf(file, 'log') for file in files], ignore_index=True)
+
+    # Sort rows in measurement dataframe by datetime
+    df = df.sort_values('datetime').reset_index(drop=True)
+
+    # Save dataframe
+    df.to_csv(directory + "/" + savename + ".csv")
+
+    store = pd.HDFStore(directory + "/" + savename + ".h5")
+    store['df'] = df  # save it
+    store.close()
+
+    return df
 
 
 def analysis(file):
@@ -175,8 +222,9 @@ if __name__ == "__main__":
     laserDriver = ITC4001()
     laserDriver.set_ld_shape('DC')
     arduino = Arduino()
+    # 20 s per current, captured as 40 blocks of 0.5 s that are reduced as they arrive
     scope = Picoscope()
-    scope.openScope(obsDuration=20)
+    scope.openScope(obsDuration=0.5)
 
     log['fs'] = scope.res[0]
     log['sample_no'] = scope.res[1]
@@ -186,13 +234,14 @@ if __name__ == "__main__":
         log["current"] = current  # Laser drive current(A)
         laserDriver.set_ld_current(current)
         laserDriver.turn_ld_on()
+        log['settle_time'] = settle_laser(laserDriver, on=True, reference=log.get('optical power'))[1]
         arduino.update()
         log['tempC'] = arduino.tempC
         log['humidity'] = arduino.humidity
         log['optical power'] = laserDriver.get_optical_power()
-        measure(log, dataf='E:/Data/')
+        measure(log, dataf='E:/Data/', blocks=40)
         laserDriver.turn_ld_off()
-        time.sleep(1)
+        settle_laser(laserDriver, on=False, reference=log['optical power'])
 
     # Stop and close all instruments
     scope.closeScope()
@@ -201,7 +250,7 @@ if __name__ == "__main__":
 
     # Analyse Data
     print("Analysing data files...")
-    df = folder_analysis(log['measurementID'], dir='E:/Data/')
+    df = summary_analysis(log['measurementID'], dir='E:/Data/')
     print("Done! Now plotting...")
     plot_analysis(df, folder=log['measurementID'], dir='E:/Data/')
     print("Finito!")
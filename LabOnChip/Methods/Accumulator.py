@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+
+
+class ResultsAccumulator:
+    """
+    Collect per-sweep analysis results into typed columnar chunks.
+
+    Rows are buffered as python lists per column and converted into a typed DataFrame
+    chunk every `chunk_rows` rows, so the results take the memory of their typed columns
+    rather than of python objects. Calling `to_frame` joins the chunks and sorts by `sort_by`
+    exactly once, so accumulating N rows costs O(N) instead of the O(N^2) of repeated
+    `df.append`. The final table is built in memory: the chunks are released as it is.
+    """
+
+    def __init__(self, chunk_rows=10000, sort_by='datetime'):
+        self.chunk_rows = chunk_rows
+        self.sort_by = sort_by
+
+        # Row buffer (column name -> list of values)
+        self._buffer = {}
+        self._buffer_rows = 0
+
+        # Typed chunks
+        self._chunks = []
+
+        self.rows = 0
+
+    def __len__(self):
+        return self.rows
+
+    def append(self, record):
+        """Add a result: a dict (one row) or a DataFrame (any number of rows)."""
+        if isinstance(record, pd.DataFrame):
+            columns = {key: list(record[key].values) for key in record.columns}
+            n = len(record)
+        else:
+            columns = {key: [value] for key, value in record.items()}
+            n = 1
+        if n == 0:
+            return
+
+        # Pad columns not seen before, then columns missing from this record
+        for key in columns:
+            if key not in self._buffer:
+                self._buffer[key] = [None] * self._buffer_rows
+        for key, values in self._buffer.items():
+            values.extend(columns.get(key, [None] * n))
+
+        self._buffer_rows += n
+        self.rows += n
+        if self._buffer_rows >= self.chunk_rows:
+            self._flush_buffer()
+
+    def extend(self, records):
+        """Add an iterable of results."""
+        for record in records:
+            self.append(record)
+
+    def _flush_buffer(self):
+        """Convert the row buffer into a typed DataFrame chunk."""
+        if self._buffer_rows == 0:
+            return
+        chunk = pd.DataFrame({key: _typed_column(values) for key, values in self._buffer.items()})
+        self._buffer = {}
+        self._buffer_rows = 0
+        self._chunks.append(chunk)
+
+    def to_frame(self):
+        """Return all results as a single DataFrame sorted by `sort_by`, emptying the accumulator."""
+        self._flush_buffer()
+        if not self._chunks:
+            return pd.DataFrame([])
+        df = pd.concat(self._chunks, axis=0, ignore_index=True, sort=False)
+        self._chunks = []
+        self.rows = 0
+
+        # Single stable sort at the end
+        if self.sort_by is not None and self.sort_by in df.columns:
+            df = df.sort_values(self.sort_by, kind='mergesort').reset_index(drop=True)
+        return df
+
+
+def _typed_column(values):
+    """Convert a list of python/numpy scalars into the narrowest sensible typed array."""
+    column = pd.Series(values)
+    if column.dtype == object:
+        # Mixed None and numbers: let pandas infer (float with NaN, datetime with NaT, ...)
+        column = column.infer_objects()
+        if column.dtype == object and all(v is None or isinstance(v, (int, float, np.number)) for v in values):
+            column = pd.to_numeric(column)
+    return column.values
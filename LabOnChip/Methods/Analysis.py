@@ -0,0 +1,731 @@
+import concurrent.futures as cf
+import os
+
+import numpy as np
+import pandas as pd
+import photonics.photodiode as fl
+from tqdm import tqdm
+
+from labonchip.Methods.Fitting import MODELS, bootstrap_model_batch, fast_decay, fit_decay_batch, fit_model_batch, \
+    fit_quality, guess_decay, model_fn, noise_std, noise_variance, prescreen, shot_noise_variance
+from labonchip.Methods.FrequencyDomain import phase_lifetime
+
+BACKENDS = ('serial', 'thread', 'process')
+
+# Goodness of fit columns added to the results (see Fitting.fit_quality)
+QUALITY = ('rms', 'chi2_red', 'r2', 'resid_acf1')
+
+# Setpoint columns a background is recorded for
+BACKGROUND_KEYS = ('current', 'pulse_width')
+
+# Per-worker state, filled in by _init_worker (one copy per process, shared by threads)
+_worker = {}
+
+
+def load_sweep(file):
+    """Load the log dataframe and the data array of a single sweep (h5) file."""
+    store = pd.HDFStore(file, mode='r')
+    try:
+        df_file = store['log']
+        y = np.array(store['data'])
+    finally:
+        store.close()
+    return df_file, y
+
+
+def time_axis(fs, samples, pump=0.0):
+    """Time axis in ms for a sweep, shifted so the decay starts at t=0."""
+    x = np.arange(samples) * fs * 1E3
+    return fl.shift_time(x, dt=pump)
+
+
+def sort_files(files):
+    """Sort sweep files into acquisition order (files are named by their timestamp)."""
+    def key(file):
+        name = os.path.splitext(os.path.basename(file))[0]
+        try:
+            return 0, float(name), name
+        except ValueError:
+            return 1, 0.0, name
+    return sorted(files, key=key)
+
+
+def load_sweeps(files):
+    """Load a list of sweep files into one log dataframe and a (sweeps, samples) data array."""
+    logs, data = [], []
+    for file in files:
+        try:
+            df_file, y = load_sweep(file)
+        except Exception as e:
+            print("Skipping {}: {}".format(file, e))
+            continue
+        df_file['file'] = file
+        logs.append(df_file)
+        data.append(y)
+    if not logs:
+        return pd.DataFrame([]), np.empty((0, 0))
+    return pd.concat(logs, ignore_index=True), np.vstack(data)
+
+
+def decay_window(fs, samples, pump=0.0, reject_start=0.0, reject_end=0.0):
+    """
+    Time axis of the fitted part of a sweep and the samples it keeps, built once per run.
+
+    The kept samples are found by passing sample numbers through fl.reject_time, so the window
+    is exactly the one the single sweep analysis uses. They are returned as a slice when they
+    are contiguous (the usual case), so Y[:, keep] is a view of a batch of sweeps rather than a
+    copy; otherwise as an index array. The time axis is read-only as it is shared between batches.
+    """
+    x = time_axis(fs, samples, pump=pump)
+    x_fit, keep = fl.reject_time(x, np.arange(samples), reject_start=reject_start, reject_end=reject_end)
+    x_fit = np.array(x_fit, dtype=float)
+    x_fit.flags.writeable = False
+    return x_fit, index_slice(keep)
+
+
+def detect_window(x, Y, reference=None, pump=None, tolerance=0.1, levels=(0.1, 0.7), smooth=None):
+    """
+    Find the end of the pump pulse and the start of the clean decay from a batch of sweeps of a run.
+
+    The sweeps are averaged first. The pump turns off at the falling edge of the reference
+    (e.g. the drive recorded on scope channel B) if given, else at the steepest fall of the
+    smoothed mean sweep, taken at the last sample before it within the noise of the peak (the
+    first sample for a capture that starts after the pump). The clean
+    decay starts where the instantaneous decay rate, -d ln(y - c)/dt over blocks of `smooth`
+    samples, settles within `tolerance` of its median over the part of the decay between
+    `levels` of its amplitude. x is the unshifted time axis (ms). Returns dict(pump, reject_start),
+    both in ms, reject_start counted from the end of the pump as for decay_window.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.mean(np.atleast_2d(Y), axis=0)
+    n = len(y)
+    dx = x[1] - x[0]
+    smooth = max(n // 200, 2) if smooth is None else smooth
+
+    # Work on a positive going decay above the baseline of the tail
+    c = np.mean(y[-max(n // 5, 1):])
+    y = y - c
+    y = y * np.sign(y[np.argmax(np.abs(y))])
+    ys = np.convolve(y, np.ones(smooth) / smooth, mode='same')
+
+    if pump is not None:
+        i_pump = int(np.clip(np.searchsorted(x, x[0] + pump), 0, n - 1))
+    elif reference is not None:
+        r = np.mean(np.atleast_2d(reference), axis=0)
+        high = r > (r.max() + r.min()) / 2
+        falling = np.flatnonzero(high[:-1] & ~high[1:])
+        i_pump = int(falling[0]) + 1 if falling.size else 0
+    else:
+        edge = smooth // 2
+        i_fall = edge + 1 + int(np.argmin(np.diff(ys[edge:n - edge]))) if n > 2 * edge + 1 else 0
+        # The pump turns off at the last sample before the steepest fall still within the noise
+        # (of the tail) of the peak, so a flat or clipped plateau ends at its falling edge
+        noise = np.std(y[-max(n // 5, 2):])
+        peak = ys[:i_fall + 1].max()
+        plateau = np.flatnonzero(y[:i_fall + 1] >= peak - 3 * noise)
+        i_pump = int(plateau[-1]) if plateau.size else i_fall
+    if i_pump <= smooth:
+        # Within the smoothing of the first sample: the capture starts with the decay
+        i_pump = 0
+
+    # Instantaneous decay rate over blocks after the pump
+    decay = y[i_pump:]
+    blocks = len(decay) // smooth
+    v = decay[:blocks * smooth].reshape(blocks, smooth).mean(axis=1)
+    t = (np.arange(blocks) + 0.5) * smooth * dx
+    amplitude = v.max() if blocks else 0.0
+    reject_start = 0.0
+    if blocks > 2 and amplitude > 0:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rate = -np.diff(np.log(v)) / (smooth * dx)
+        above = np.flatnonzero(v[1:] >= levels[0] * amplitude)
+        clean = (v[1:] >= levels[0] * amplitude) & (v[1:] <= levels[1] * amplitude) & np.isfinite(rate)
+        if above.size and clean.any():
+            reference_rate = np.median(rate[clean])
+            ok = np.abs(rate - reference_rate) <= tolerance * abs(reference_rate)
+            last = above[-1]
+            # First block from which the rate stays settled until the decay reaches the noise
+            bad = np.flatnonzero(~ok[:last + 1])
+            start = bad[-1] + 1 if bad.size else 0
+            reject_start = t[start] - 0.5 * smooth * dx if start <= last else 0.0
+    return {'pump': float(x[i_pump] - x[0]), 'reject_start': float(reject_start)}
+
+
+def resolve_window(files, settings, sweeps=100):
+    """
+    Replace pump='auto' and reject_start='auto' in the analysis settings by the values detected
+    (see detect_window) on the run's first sweeps. The detected values are printed and returned in the settings.
+    """
+    auto = [key for key in ('pump', 'reject_start') if settings[key] == 'auto']
+    if not auto:
+        return settings
+    log, Y = load_sweeps(sort_files(files)[:sweeps])
+    if not len(Y):
+        return dict(settings, **{key: 0.0 for key in auto})
+    x = np.arange(Y.shape[1]) * log['fs'].values[0] * 1E3
+    detected = detect_window(x, Y, pump=None if settings['pump'] == 'auto' else settings['pump'])
+    print("Detected window (ms): {}".format({key: round(detected[key], 4) for key in auto}))
+    return dict(settings, **{key: detected[key] for key in auto})
+
+
+def index_slice(index):
+    """Slice equivalent to an array of sample indices if they are contiguous, else the array itself."""
+    index = np.asarray(index, dtype=int)
+    if len(index) == 0:
+        return slice(0, 0)
+    if np.all(np.diff(index) == 1):
+        return slice(int(index[0]), int(index[-1]) + 1)
+    return index
+
+
+def select_rows(mask):
+    """Row selection for a boolean mask: a full slice (a view, not a copy) when every row is selected."""
+    return slice(None) if mask.all() else mask
+
+
+def fit_file(file, pump=0.0, reject_start=0.0, reject_end=0.0, x=None, window=None):
+    """
+    Fit a single exp. decay to a sweep file and return its log dataframe with the fit appended.
+    Pass the run's fit window, (x_fit, keep) from decay_window, to avoid rebuilding the time axis
+    and rejection mask for every sweep, or a precomputed (shifted) time axis, x.
+    """
+    df_file, y = load_sweep(file)
+
+    if window is not None and len(window[0]) and len(y) == df_file['sample_no'][0]:
+        # Precomputed window: the rejection is a view of the sweep
+        x, keep = window
+        y = y[keep]
+    else:
+        # Create time axis in ms unless one was given for this run
+        if x is None or len(x) != len(y):
+            x = time_axis(df_file['fs'][0], df_file['sample_no'][0], pump=pump)
+
+        # Reject data while pump is on
+        x, y = fl.reject_time(x, y, reject_start=reject_start, reject_end=reject_end)
+
+    # Fit a single exp. decay function
+    popt, perr = fl.fit_decay(x, y, p0=[max(y), 10, min(y)], print_out=False)
+
+    # Append lifetime to individual measurement dataframe
+    df_file['A'] = popt[0]
+    df_file['tau'] = popt[1]
+    df_file['c'] = popt[2]
+
+    df_file['A_err'] = perr[0]
+    df_file['tau_err'] = perr[1]
+    df_file['c_err'] = perr[2]
+
+    return df_file
+
+
+def load_background(file):
+    """
+    Averaged laser-off background sweeps of a run (background.h5, see HelperFunctions.record_background),
+    as (log with one row per setpoint, (setpoints, samples) array).
+    """
+    store = pd.HDFStore(file, mode='r')
+    try:
+        bg_log = store['log']
+        B = np.array(store['data'], dtype=float)
+    finally:
+        store.close()
+    return bg_log, B
+
+
+def background_index(log, bg_log, keys=BACKGROUND_KEYS):
+    """Row of the background recorded at each sweep's setpoint (the `keys` columns), -1 where there is none."""
+    keys = [key for key in keys if key in log.columns and key in bg_log.columns]
+    if not keys:
+        # Only a single background without setpoint information can apply to every sweep
+        return np.zeros(len(log), dtype=int) if len(bg_log) == 1 else np.full(len(log), -1)
+    lookup = {tuple(row): i for i, row in enumerate(np.round(bg_log[keys].values.astype(float), 9))}
+    rows = np.round(log[keys].values.astype(float), 9)
+    return np.array([lookup.get(tuple(row), -1) for row in rows], dtype=int)
+
+
+def subtract_background(log, Y, background):
+    """
+    Subtract the averaged background of each sweep's setpoint from a batch of sweeps (rows of Y)
+    in one broadcast operation. Returns (Y with the background removed, mask of the sweeps it was removed from).
+    """
+    bg_log, B = background
+    index = background_index(log, bg_log)
+    subtracted = index >= 0
+    if B.shape[1] != Y.shape[1] or not subtracted.any():
+        return Y, np.zeros(len(Y), dtype=bool)
+    return Y - np.where(subtracted[:, None], B[index], 0.0), subtracted
+
+
+def fit_sweeps(x, Y, model='mono', sigma=None, full_output=False):
+    """
+    Fit a registered decay model (see Fitting.MODELS) to every sweep (row of Y).
+    sigma, the noise estimate per sweep or per sample, gives a weighted fit with absolute errors.
+    full_output also returns the goodness of fit of every sweep (see Fitting.fit_quality).
+    """
+    absolute_sigma = sigma is not None
+    if model == 'mono':
+        return fit_decay_batch(x, Y, sigma=sigma, absolute_sigma=absolute_sigma, full_output=full_output)
+    return fit_model_batch(x, Y, model=model, sigma=sigma, absolute_sigma=absolute_sigma, full_output=full_output)
+
+
+def _fast_quality(x, Y, popt, sigma=None):
+    """Goodness of fit of fast estimates, from the residuals of the mono model they give."""
+    r = Y - model_fn('mono', x, popt)
+    if sigma is not None:
+        sw = 1 / np.broadcast_to(sigma if np.ndim(sigma) == 2 else np.reshape(sigma, (-1, 1)), Y.shape)
+        r = r * sw
+    else:
+        sw = None
+    return fit_quality(Y, r, np.einsum('nk,nk->n', r, r), 3, sw, ~np.isfinite(popt).all(axis=1))
+
+
+def adc_quantum(log):
+    """ADC step (V) of each sweep from its logged channel range and bit resolution, or None if not logged."""
+    if 'v_range' not in log.columns or 'bit_res' not in log.columns:
+        return None
+    quantum = 2 * log['v_range'].values.astype(float) / 2 ** log['bit_res'].values.astype(float)
+    # Averaging K sweeps averages the quantisation noise down too
+    if 'n_avg' in log.columns:
+        quantum = quantum / np.sqrt(log['n_avg'].values.astype(float))
+    return quantum
+
+
+def channel_limits(log):
+    """Lowest and highest voltage the scope channel can record for each sweep, or None if not logged."""
+    if 'v_range' not in log.columns:
+        return None
+    v_range = log['v_range'].values.astype(float)
+    v_offset = log['v_offset'].values.astype(float) if 'v_offset' in log.columns else 0.0
+    return -v_range - v_offset, v_range - v_offset
+
+
+def noise_sigma(log, Y, window, settings):
+    """
+    Noise standard deviation used to weight the fit of each sweep: per sweep for weights='tail'
+    or 'pretrigger', per sample for weights='shot' (see Fitting.noise_variance, shot_noise_variance).
+    Returns (sigma, baseline noise std per sweep).
+    """
+    x_fit, keep = window
+    weights = settings['weights']
+    if weights not in ('tail', 'pretrigger', 'shot'):
+        raise ValueError("Unknown weights '{}', use 'tail', 'pretrigger' or 'shot'".format(weights))
+    source = 'pretrigger' if weights == 'pretrigger' else 'tail'
+    var = noise_variance(Y, source=source, fraction=settings['noise_fraction'],
+                         pretrigger=settings['pretrigger'], quantum=adc_quantum(log))
+    if weights != 'shot':
+        return np.sqrt(var), np.sqrt(var)
+
+    # Signal dependent noise: scale from an unweighted fit, then weight with the fitted model
+    Y_fit = Y[:, keep]
+    popt, _ = fit_sweeps(x_fit, Y_fit, model=settings['model'])
+    f = model_fn(settings['model'], x_fit, popt)
+    var_t = shot_noise_variance(Y_fit, np.where(np.isfinite(f), f, Y_fit), np.nan_to_num(popt[:, -1]), var)
+    return np.sqrt(var_t), np.sqrt(var)
+
+
+# Analysis options understood by analyse_sweeps / analyse_files and their defaults
+SETTINGS = dict(pump=0.0, reject_start=0.0, reject_end=0.0, model='mono', bootstrap=0, boot_block=None,
+                weights=None, noise_fraction=0.2, pretrigger=0, prescreen=False, min_snr=3.0, fit_snr=0.0,
+                background=None, harmonics=0)
+
+
+def analysis_settings(**kwargs):
+    """Complete analysis options with their defaults, rejecting unknown ones."""
+    unknown = set(kwargs) - set(SETTINGS)
+    if unknown:
+        raise TypeError("Unknown analysis options: {}".format(sorted(unknown)))
+    settings = dict(SETTINGS, **kwargs)
+    for key in ('pump', 'reject_start'):
+        if isinstance(settings[key], str) and settings[key] != 'auto':
+            raise ValueError("{} must be a time (ms) or 'auto'".format(key))
+    if settings['model'] not in MODELS:
+        raise ValueError("Unknown model '{}', use one of {}".format(settings['model'], list(MODELS)))
+    return settings
+
+
+def qcw_lifetimes(log, Y, n_harmonics, subtracted=None):
+    """
+    Append the phase and modulation lifetimes (ms) of sweeps (rows of Y) captured under QCW
+    excitation to their log, as tau_phase_<n> and tau_mod_<n> for harmonics n = 1..n_harmonics
+    (see FrequencyDomain.phase_lifetime), with no fitting.
+
+    The pulse train is read from the log's 'period' and 'pulse_width' columns, and 'pulse_delay'
+    if recorded (the start of the first pulse after the first sample), all in ms. The modulation
+    lifetime needs the baseline removed, so it is only given for background subtracted sweeps.
+    """
+    missing = [key for key in ('period', 'pulse_width') if key not in log.columns]
+    if missing:
+        raise ValueError("QCW lifetimes need {} (ms) in the sweep log".format(missing))
+    delay = log['pulse_delay'] if 'pulse_delay' in log.columns else pd.Series(0.0, index=log.index)
+    subtracted = np.zeros(len(Y), dtype=bool) if subtracted is None else subtracted
+
+    tau_phase = np.full((len(Y), n_harmonics), np.nan)
+    tau_mod = np.full((len(Y), n_harmonics), np.nan)
+    setpoints = pd.DataFrame({'fs': log['fs'].values, 'period': log['period'].values,
+                              'width': log['pulse_width'].values, 'delay': delay.values})
+    for (fs, period, width, delay), rows in setpoints.groupby(['fs', 'period', 'width', 'delay']).indices.items():
+        tau_phase[rows], tau_mod[rows] = phase_lifetime(Y[rows], fs, period * 1E-3, width=width * 1E-3,
+                                                        delay=delay * 1E-3, n_harmonics=n_harmonics)
+    tau_mod[~subtracted] = np.nan
+
+    for n in range(n_harmonics):
+        log['tau_phase_{:d}'.format(n + 1)] = tau_phase[:, n]
+        log['tau_mod_{:d}'.format(n + 1)] = tau_mod[:, n]
+    return log
+
+
+def analyse_sweeps(log, Y, window, settings, background=None):
+    """
+    Fit a batch of sweeps (rows of Y) over the fit window, (x_fit, keep) from decay_window,
+    and append the results to their log dataframe, one row per sweep.
+
+    With settings['weights'] set the fit is weighted by the noise estimated from the sweep's
+    tail ('tail') or its pre-trigger samples ('pretrigger'), which assume constant noise, or by
+    a signal dependent model on top of the tail noise ('shot'); errors are then absolute and
+    the estimated baseline noise is added as noise_std.
+
+    With settings['bootstrap'] = n, n residual bootstrap resamples per sweep are refitted and
+    the 95% confidence interval of each parameter is added as <param>_lo and <param>_hi
+    (boot_block sets the residual block length, chosen from the residual autocorrelation by default).
+
+    The goodness of fit of every sweep (rms, chi2_red, r2 and resid_acf1, see Fitting.fit_quality)
+    comes from the fitter's final residuals, so poor fits can be filtered without the waveforms.
+
+    With settings['prescreen'] every sweep is first checked by Fitting.prescreen: hopeless sweeps
+    (clipped, SNR below min_snr, not monotonic, no 1/e crossing) are not fitted, sweeps with SNR
+    below fit_snr get the fast (rapid lifetime determination) estimate of the mono model instead
+    of a fit, and the rest are fitted. The columns 'route' and 'reject_reason' record the outcome.
+
+    background, (log, array) from load_background, is subtracted from every sweep with a
+    background recorded at its setpoint ('background' column True); their fast estimates then
+    take the baseline as zero.
+
+    With settings['harmonics'] = n, sweeps captured under QCW excitation also get the phase and
+    modulation lifetimes of harmonics 1..n (see qcw_lifetimes) from the whole sweep.
+    """
+    model = MODELS[settings['model']]
+    x_fit, keep = window
+    n_params = len(model.params)
+
+    subtracted = np.zeros(len(Y), dtype=bool)
+    if background is not None:
+        Y, subtracted = subtract_background(log, Y, background)
+        log['background'] = subtracted
+
+    if settings['harmonics']:
+        qcw_lifetimes(log, Y, settings['harmonics'], subtracted)
+
+    sigma, noise = None, None
+    if settings['weights']:
+        sigma, noise = noise_sigma(log, Y, window, settings)
+        log['noise_std'] = noise
+    Y = Y[:, keep]
+
+    route = np.full(len(Y), 'fit', dtype=object)
+    if settings['prescreen']:
+        route, reason = prescreen(x_fit, Y, limits=channel_limits(log), noise=noise, min_snr=settings['min_snr'],
+                                  fit_snr=settings['fit_snr'])
+        if model.name != 'mono':
+            # The fast estimator only gives the mono model parameters
+            route[route == 'fast'] = 'fit'
+        log['route'] = route
+        log['reject_reason'] = reason
+
+    popt = np.full((len(Y), n_params), np.nan)
+    perr = np.full((len(Y), n_params), np.nan)
+    quality = {name: np.full(len(Y), np.nan) for name in QUALITY}
+    fit = select_rows(route == 'fit')
+    if np.any(route == 'fit'):
+        fit_sigma = sigma if sigma is None or np.ndim(sigma) == 0 else sigma[fit]
+        popt[fit], perr[fit], fitted = fit_sweeps(x_fit, Y[fit], model=model.name, sigma=fit_sigma,
+                                                        full_output=True)
+        for name in QUALITY:
+            quality[name][fit] = fitted[name]
+    fast = route == 'fast'
+    if fast.any():
+        popt[fast] = fast_decay(x_fit, Y[fast], c=np.where(subtracted[fast], 0.0, np.nan))
+        fast_quality = _fast_quality(x_fit, Y[fast], popt[fast], None if sigma is None else sigma[fast])
+        for name in QUALITY:
+            quality[name][fast] = fast_quality[name]
+
+    # Window used, so detected values are kept with the results
+    for key in ('pump', 'reject_start', 'reject_end'):
+        log[key] = settings[key]
+
+    # Append fit parameters and goodness of fit to the measurement dataframe
+    for j, param in enumerate(model.params):
+        log[param] = popt[:, j]
+        log[param + '_err'] = perr[:, j]
+    for name in QUALITY:
+        log[name] = quality[name]
+    log['model'] = model.name
+
+    if settings['bootstrap']:
+        lo = np.full((len(Y), n_params), np.nan)
+        hi = np.full((len(Y), n_params), np.nan)
+        if np.any(route == 'fit'):
+            lo[fit], hi[fit], _ = bootstrap_model_batch(x_fit, Y[fit], popt[fit], model=model,
+                                                        n_boot=settings['bootstrap'], block=settings['boot_block'])
+        for j, param in enumerate(model.params):
+            log[param + '_lo'] = lo[:, j]
+            log[param + '_hi'] = hi[:, j]
+
+    failed = (route == 'fit') & ~np.isfinite(popt).all(axis=1)
+    if failed.any():
+        log['error'] = np.where(failed, 'fit did not converge', None)
+    return log
+
+
+def _init_worker(settings, fs=None, samples=None):
+    """Worker initializer: store the analysis settings and build the run's time axis once."""
+    _worker['settings'] = settings
+    _worker['windows'] = {}
+    _worker['background'] = load_background(settings['background']) if settings['background'] else None
+    if fs is not None:
+        _window(fs, samples)
+
+
+def _window(fs, samples):
+    """Fit window for a given sampling, built once per worker and cached."""
+    key = (fs, samples)
+    if key not in _worker['windows']:
+        settings = _worker['settings']
+        _worker['windows'][key] = decay_window(fs, samples, pump=settings['pump'],
+                                               reject_start=settings['reject_start'],
+                                               reject_end=settings['reject_end'])
+    return _worker['windows'][key]
+
+
+def _error_row(file, message, df_file=None):
+    """Result row for a sweep that could not be analysed."""
+    row = {} if df_file is None else df_file.iloc[0].to_dict()
+    row.update({'file': file, 'error': message})
+    return pd.DataFrame(row, index=[0])
+
+
+def _analyse_chunk(files):
+    """Load a chunk of sweep files and batch fit them, capturing per-file errors instead of raising."""
+    results = []
+
+    # Load every readable sweep, grouped by sampling (constant within a run)
+    groups = {}
+    for file in files:
+        try:
+            df_file, y = load_sweep(file)
+            key = (df_file['fs'][0], df_file['sample_no'][0])
+            if len(y) != key[1]:
+                raise ValueError("{} samples, log says {}".format(len(y), key[1]))
+        except Exception as e:
+            results.append(_error_row(file, '{}: {}'.format(type(e).__name__, e)))
+            continue
+        df_file['file'] = file
+        groups.setdefault(key, []).append((df_file, y))
+
+    for key, items in groups.items():
+        log = pd.concat([df_file for df_file, _ in items], ignore_index=True)
+        Y = np.vstack([y for _, y in items])
+        try:
+            results.append(analyse_sweeps(log, Y, _window(*key), _worker['settings'], _worker['background']))
+            continue
+        except Exception:
+            pass
+        # The batch failed: fit its sweeps one by one so only the failing files get an error row
+        for df_file, y in items:
+            try:
+                results.append(analyse_sweeps(df_file.copy(), y[None, :], _window(*key), _worker['settings'],
+                                              _worker['background']))
+            except Exception as e:
+                results.append(_error_row(df_file['file'][0], '{}: {}'.format(type(e).__name__, e), df_file))
+    return results
+
+
+def chunk_files(files, chunksize):
+    """Split a list of files into chunks of chunksize files."""
+    return [files[i:i + chunksize] for i in range(0, len(files), chunksize)]
+
+
+def analyse_files(files, backend='process', workers=None, chunksize=None, progress=True, **options):
+    """
+    Fit every sweep file and yield result dataframes as chunks complete (unordered).
+
+    backend is one of 'serial', 'thread' or 'process'. Files are shipped to workers in chunks
+    of chunksize files; each worker builds the run's time axis once in its initializer and
+    batch fits the sweeps of a chunk (see analyse_sweeps). options are the analysis settings
+    in SETTINGS, e.g. pump, reject_start, reject_end, model and bootstrap; pump and reject_start
+    can be 'auto' to detect them from the run's first sweeps (see detect_window).
+    Files that fail are yielded as rows with NaN fit values and an 'error' message.
+    """
+    if backend not in BACKENDS:
+        raise ValueError("Unknown backend '{}', use one of {}".format(backend, BACKENDS))
+    settings = analysis_settings(**options)
+    files = list(files)
+    if not files:
+        return
+    settings = resolve_window(files, settings)
+
+    # fs and sample_no are constant within a run: read them once from the first file
+    try:
+        df_first, _ = load_sweep(files[0])
+        fs, samples = df_first['fs'][0], df_first['sample_no'][0]
+    except Exception:
+        fs, samples = None, None
+    initargs = (settings, fs, samples)
+    # Settings errors (window outside the sweep, unreadable background) are raised once, here
+    _init_worker(*initargs)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if chunksize is None:
+        chunksize = max(1, min(64, len(files) // (4 * workers)))
+    chunks = chunk_files(files, chunksize)
+
+    bar = tqdm(total=len(files), disable=not progress)
+    try:
+        if backend == 'serial':
+            for chunk in chunks:
+                for result in _analyse_chunk(chunk):
+                    bar.update(len(result))
+                    yield result
+            return
+
+        executor_class = cf.ThreadPoolExecutor if backend == 'thread' else cf.ProcessPoolExecutor
+        with executor_class(max_workers=workers, initializer=_init_worker, initargs=initargs) as executor:
+            futures = {executor.submit(_analyse_chunk, chunk): chunk for chunk in chunks}
+            for future in cf.as_completed(futures):
+                try:
+                    results = future.result()
+                except Exception as e:
+                    # The whole chunk was lost (e.g. a worker died): report each of its files
+                    results = [_error_row(file, '{}: {}'.format(type(e).__name__, e)) for file in futures[future]]
+                for result in results:
+                    bar.update(len(result))
+                    yield result
+    finally:
+        bar.close()
+
+
+def ensemble_average(Y, k, step=None):
+    """
+    Average K consecutive sweeps (rows of Y) using cumulative sums.
+    step is the spacing of window starts: step=k (default) gives disjoint windows,
+    step<k gives sliding/overlapping windows. Returns the window starts and the averages.
+    """
+    step = k if step is None else step
+    starts = np.arange(0, len(Y) - k + 1, step)
+    C = np.zeros((len(Y) + 1,) + Y.shape[1:])
+    np.cumsum(Y, axis=0, out=C[1:])
+    return starts, (C[starts + k] - C[starts]) / k
+
+
+def sweeps_for_snr(x, Y, snr):
+    """Number of sweeps K to average so the averaged decay reaches the given signal-to-noise ratio."""
+    amplitude = np.abs(guess_decay(x, Y)[:, 0])
+    snr_single = np.nanmedian(amplitude / noise_std(Y))
+    return max(1, int(np.ceil((snr / snr_single) ** 2)))
+
+
+def _setpoints(log, by):
+    """Integer label per row that changes whenever any of the `by` columns changes."""
+    columns = [key for key in by if key in log.columns]
+    if not columns or log.empty:
+        return np.zeros(len(log), dtype=int)
+    values = log[columns].astype(str).values
+    changed = np.any(values[1:] != values[:-1], axis=1)
+    return np.concatenate([[0], np.cumsum(changed)])
+
+
+def iter_ensembles(files, k, step=None, by=('current', 'pulse_width'), block=1000):
+    """
+    Yield (log, averaged data) for windows of K consecutive sweeps, in acquisition order.
+
+    Files are read in blocks of `block` sweeps, carrying the unfinished window over to the
+    next block, so memory stays bounded for any run length. Windows never span a change of
+    setpoint (the `by` columns); incomplete windows at the end of a setpoint are dropped.
+    """
+    step = k if step is None else step
+    files = sort_files(files)
+    carry_log, carry_Y = None, None
+
+    for i in range(0, len(files), block):
+        log, Y = load_sweeps(files[i:i + block])
+        if carry_log is not None:
+            log = pd.concat([carry_log, log], ignore_index=True)
+            Y = np.vstack([carry_Y, Y]) if len(Y) else carry_Y
+            carry_log, carry_Y = None, None
+        if log.empty:
+            continue
+        final = i + block >= len(files)
+
+        labels = _setpoints(log, by)
+        bounds = np.flatnonzero(np.diff(labels)) + 1
+        segments = zip(np.concatenate([[0], bounds]), np.concatenate([bounds, [len(Y)]]))
+        for a, b in segments:
+            starts, averages = ensemble_average(Y[a:b], k, step)
+            if len(starts):
+                yield _window_log(log.iloc[a:b], starts, k), averages
+
+            # Keep the part of the last setpoint that has not formed a window yet
+            if b == len(Y) and not final:
+                rest = a + (starts[-1] + step if len(starts) else 0)
+                carry_log, carry_Y = log.iloc[rest:].reset_index(drop=True), Y[rest:]
+
+
+def _window_log(log, starts, k):
+    """One log row per averaging window: the first sweep's log with the window's mean datetime."""
+    rows = log.iloc[starts].reset_index(drop=True)
+    rows['n_avg'] = k
+    if 'sweep_no' in log.columns:
+        sweep_no = log['sweep_no'].values
+        rows['sweep_first'] = sweep_no[starts]
+        rows['sweep_last'] = sweep_no[starts + k - 1]
+    if 'datetime' in log.columns:
+        t = pd.to_datetime(log['datetime']).values.astype('datetime64[ns]').astype(np.int64).astype(float)
+        C = np.concatenate([[0.0], np.cumsum(t - t[0])])
+        mean = t[0] + (C[starts + k] - C[starts]) / k
+        rows['datetime'] = pd.to_datetime(mean.astype(np.int64))
+    return rows
+
+
+def analyse_ensemble(files, k=None, step=None, snr=None, by=('current', 'pulse_width'), block=1000,
+                     progress=True, **options):
+    """
+    Average K consecutive sweeps (sliding windows when step < K) and fit each averaged decay.
+
+    Give either k, or snr to pick the K that brings the averaged decays to that signal-to-noise
+    ratio (estimated from the first block of sweeps). Returns one row per window with the fit,
+    the number of sweeps averaged (n_avg) and the window's mean datetime. options are the
+    analysis settings in SETTINGS, as for analyse_files.
+    """
+    settings = analysis_settings(**options)
+    files = list(files)
+    if not files:
+        return pd.DataFrame([])
+    settings = resolve_window(files, settings)
+
+    # Time axis and fit window are constant within a run
+    df_first, _ = load_sweep(files[0])
+    x_fit, keep = decay_window(df_first['fs'][0], df_first['sample_no'][0], pump=settings['pump'],
+                               reject_start=settings['reject_start'], reject_end=settings['reject_end'])
+
+    if k is None:
+        if snr is None:
+            raise ValueError("Give the number of sweeps to average, k, or a target snr")
+        _, Y = load_sweeps(sort_files(files)[:min(block, len(files))])
+        k = sweeps_for_snr(x_fit, Y[:, keep], snr)
+        print("Averaging {} sweeps for SNR {}".format(k, snr))
+
+    background = load_background(settings['background']) if settings['background'] else None
+
+    results = []
+    for log, averages in tqdm(iter_ensembles(files, k, step=step, by=by, block=block), disable=not progress):
+        if background is not None:
+            averages, log['background'] = subtract_background(log, averages, background)
+        log = analyse_sweeps(log, averages, (x_fit, keep), settings)
+        y = averages[:, keep]
+        log['snr'] = np.abs(y[:, 0] - log['c'].values) / noise_std(y)
+        results.append(log)
+
+    if not results:
+        return pd.DataFrame([])
+    df = pd.concat(results, ignore_index=True)
+    return df.sort_values('datetime', kind='mergesort').reset_index(drop=True) if 'datetime' in df else df
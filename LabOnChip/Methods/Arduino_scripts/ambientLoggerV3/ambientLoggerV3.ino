@@ -4,6 +4,10 @@ SHT15 and 2 K thermocouple sensors connected.
 Get the temperature in C and humidity.
 Get the liquid in and out temperature in C.
 
+Commands (newline terminated): UPDATE, SHT and TK reply in text; BIN switches UPDATE
+to binary frames (see sendFrame), STREAM <ms> streams frames every <ms> ms and TEXT
+returns to text replies.
+
 SHT15 Connections:
 GND  -> A2
 Vcc  -> A3
@@ -47,6 +51,19 @@ float humidity = 0;
 float t_in = 0;
 float t_out = 0;
 
+/* -- Binary frames -- */
+// Frame: sync (0xA5 0x5A), version, payload length, then the payload: sequence number (uint16),
+// millis (uint32) and tempC, humidity, t_in, t_out as int16 in hundredths, all little endian,
+// followed by a CRC16-CCITT (0xFFFF start) of version..payload. 20 bytes per frame.
+#define FRAME_SYNC1 0xA5
+#define FRAME_SYNC2 0x5A
+#define FRAME_VERSION 1
+#define FRAME_PAYLOAD 14
+boolean binaryMode = false;
+uint16_t frameSeq = 0;
+unsigned long streamInterval = 0;  // ms between streamed frames, 0 when not streaming
+unsigned long lastStream = 0;
+
 void setup()
 {
   Serial.begin(115200); // Open serial connection to report values to host
@@ -80,6 +97,13 @@ void loop()
   if(serialStrReady){
     processSerial();
   }
+
+  //stream frames at the requested rate
+  if(streamInterval > 0 && millis() - lastStream >= streamInterval){
+    lastStream = millis();
+    readAll();
+    sendFrame();
+  }
 }
 
 void readSerial(){
@@ -98,10 +122,27 @@ void readSerial(){
 
 void processSerial(){
   //process serial commands as they are read in
-  if(serialStr.equals("UPDATE")){
-    readSHT();
-    t_in = readThermocouple(inThermocouple);
-    t_out = readThermocouple(outThermocouple);
+  if(serialStr.equals("BIN")){
+    binaryMode = true;
+    readAll();
+    sendFrame();
+  }
+  else if(serialStr.equals("TEXT")){
+    binaryMode = false;
+    streamInterval = 0;
+  }
+  else if(serialStr.startsWith("STREAM")){
+    // STREAM <ms>: send a binary frame every <ms> ms, STREAM 0 stops
+    binaryMode = true;
+    streamInterval = serialStr.substring(6).toInt();
+    lastStream = millis();
+  }
+  else if(serialStr.equals("UPDATE") && binaryMode){
+    readAll();
+    sendFrame();
+  }
+  else if(serialStr.equals("UPDATE")){
+    readAll();
     Serial.print("Ambient Temp ");
     Serial.print(tempC);
     Serial.print(" C and humidity ");
@@ -141,6 +182,64 @@ void processSerial(){
   serialStr = "";
 }
 //-------------------------------------------------------------------------------------------
+void readAll()
+{
+  readSHT();
+  t_in = readThermocouple(inThermocouple);
+  t_out = readThermocouple(outThermocouple);
+}
+//-------------------------------------------------------------------------------------------
+void putInt16(uint8_t *buf, int i, int16_t value)
+{
+  buf[i] = value & 0xFF;
+  buf[i + 1] = (value >> 8) & 0xFF;
+}
+
+int16_t toFixed(float value)
+{
+  //hundredths, clamped to the int16 range
+  float scaled = value * 100.0;
+  if (scaled > 32767) return 32767;
+  if (scaled < -32768) return -32768;
+  return (int16_t)(scaled >= 0 ? scaled + 0.5 : scaled - 0.5);
+}
+
+uint16_t crc16(const uint8_t *data, int len)
+{
+  //CRC16-CCITT, polynomial 0x1021, start 0xFFFF
+  uint16_t crc = 0xFFFF;
+  for (int i = 0; i < len; i++) {
+    crc ^= (uint16_t)data[i] << 8;
+    for (uint8_t b = 0; b < 8; b++) {
+      crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : crc << 1;
+    }
+  }
+  return crc;
+}
+
+void sendFrame()
+{
+  uint8_t frame[4 + FRAME_PAYLOAD + 2];
+  unsigned long now = millis();
+  frame[0] = FRAME_SYNC1;
+  frame[1] = FRAME_SYNC2;
+  frame[2] = FRAME_VERSION;
+  frame[3] = FRAME_PAYLOAD;
+  putInt16(frame, 4, (int16_t)frameSeq++);
+  frame[6] = now & 0xFF;
+  frame[7] = (now >> 8) & 0xFF;
+  frame[8] = (now >> 16) & 0xFF;
+  frame[9] = (now >> 24) & 0xFF;
+  putInt16(frame, 10, toFixed(tempC));
+  putInt16(frame, 12, toFixed(humidity));
+  putInt16(frame, 14, toFixed(t_in));
+  putInt16(frame, 16, toFixed(t_out));
+  uint16_t crc = crc16(frame + 2, 2 + FRAME_PAYLOAD);
+  frame[18] = crc & 0xFF;
+  frame[19] = (crc >> 8) & 0xFF;
+  Serial.write(frame, sizeof(frame));
+}
+//-------------------------------------------------------------------------------------------
 void readSHT()
 {
   // Read values from the sensor
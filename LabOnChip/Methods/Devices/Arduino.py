@@ -1,18 +1,104 @@
+import binascii
 import re
+import struct
+import threading
 import time
 
 import serial
 
+# Sensor values in the order the ambientLoggerV3 sketch prints them for each command
+FIELDS = {'UPDATE': ('tempC', 'humidity', 't_in', 't_out'),
+          'SHT': ('tempC', 'humidity'),
+          'TK': ('t_in', 't_out')}
+NUMBER = re.compile(r"-?\d+(?:\.\d+)?")
+
+# Binary frames of the ambientLoggerV3 sketch: sync, version, payload length, payload, CRC16
+FRAME_SYNC = b'\xa5\x5a'
+FRAME_VERSION = 1
+FRAME_PAYLOAD = struct.Struct('<HI4h')  # seq, millis, tempC, humidity, t_in, t_out (hundredths)
+
+
+def parse_line(line):
+    """Sensor values (dict) in a line printed by the ambientLoggerV3 sketch, empty if it holds none."""
+    values = [float(i) for i in NUMBER.findall(line)]
+    if line.startswith('Ambient'):
+        fields = FIELDS['UPDATE'] if len(values) == 4 else FIELDS['SHT']
+    elif line.startswith('Temperature'):
+        fields = FIELDS['TK']
+    else:
+        return {}
+    if len(values) != len(fields):
+        return {}
+    return dict(zip(fields, values))
+
+
+class FrameDecoder:
+    """
+    Incremental decoder of the sketch's binary frames: feed it bytes as they arrive and it
+    returns the complete frames, resynchronising on the sync bytes after noise or a bad CRC.
+    Counts frames rejected for their CRC (crc_errors) and frames lost in between (dropped).
+    """
 
-class Arduino:
     def __init__(self):
+        self.buffer = b''
+        self.crc_errors = 0
+        self.dropped = 0
+        self.last_seq = None
+
+    def feed(self, data):
+        self.buffer += data
+        frames = []
+        while True:
+            start = self.buffer.find(FRAME_SYNC)
+            if start < 0:
+                # Keep a trailing first sync byte, it may be completed by the next read
+                self.buffer = self.buffer[-1:] if self.buffer.endswith(FRAME_SYNC[:1]) else b''
+                return frames
+            self.buffer = self.buffer[start:]
+            if len(self.buffer) < 4:
+                return frames
+            version, length = self.buffer[2], self.buffer[3]
+            end = 4 + length + 2
+            if version != FRAME_VERSION or length != FRAME_PAYLOAD.size:
+                self.buffer = self.buffer[2:]
+                continue
+            if len(self.buffer) < end:
+                return frames
+            body, crc = self.buffer[2:end - 2], struct.unpack('<H', self.buffer[end - 2:end])[0]
+            if binascii.crc_hqx(body, 0xFFFF) != crc:
+                self.crc_errors += 1
+                self.buffer = self.buffer[2:]
+                continue
+            self.buffer = self.buffer[end:]
+            frames.append(self._decode(body[2:]))
+
+    def _decode(self, payload):
+        seq, millis, tempC, humidity, t_in, t_out = FRAME_PAYLOAD.unpack(payload)
+        if self.last_seq is not None:
+            self.dropped += (seq - self.last_seq - 1) % 65536
+        self.last_seq = seq
+        return {'seq': seq, 'millis': millis, 'tempC': tempC / 100, 'humidity': humidity / 100,
+                't_in': t_in / 100, 't_out': t_out / 100}
+
+
+def encode_frame(seq, millis, tempC, humidity, t_in, t_out):
+    """Binary frame as sent by the sketch (for testing the decoder and simulating the logger)."""
+    values = [int(round(v * 100)) for v in (tempC, humidity, t_in, t_out)]
+    body = struct.pack('<BB', FRAME_VERSION, FRAME_PAYLOAD.size) + FRAME_PAYLOAD.pack(seq % 65536, millis, *values)
+    return FRAME_SYNC + body + struct.pack('<H', binascii.crc_hqx(body, 0xFFFF))
+
+
+class Arduino:
+    def __init__(self, binary=False, ser=None):
         super(Arduino, self).__init__()
-        # Setup serial port to communicate with arduino
-        self.ser = serial.Serial(
-            port='COM3',
-            baudrate=115200,
-            timeout=5
-        )
+        # Setup serial port to communicate with arduino (or use the port given, e.g. a simulated one)
+        self.ser = ser
+        if ser is None:
+            self.ser = serial.Serial(
+                port='COM3',
+                baudrate=115200,
+                timeout=5
+            )
 
         # Initialise variables
         self.tempC = 0
@@ -20,55 +106,146 @@ class Arduino:
         self.t_in = 0
         self.t_out = 0
 
-        # Wait for arduino to fire up
-        time.sleep(3)
+        # Latest values with the time (s since epoch) each was read, replaced as a whole on every update
+        self.snapshot = {}
+        self._reader = None
+        self._stop = threading.Event()
+
+        # Binary frames (sketch command BIN) or text replies
+        self.binary = binary
+        self.decoder = FrameDecoder()
+
+        # Wait for arduino to fire up (it resets when the port is opened)
+        if ser is None:
+            time.sleep(3)
+        if binary:
+            self.ser.write(b'BIN\n')
+            self._read_frames()
 
         # Get current variable status
-        self.request_data()
-        time.sleep(3)
-        self.get_data()
-        # self.request_data()
+        self.update()
 
     def request_data(self):
         # Serial request temperature, humidity and thermocouple data (ArduinoV3)
-        self.ser.write(b'UPDATE\n')
+        if not self.running:
+            self.ser.write(b'UPDATE\n')
 
     def get_data(self):
+        # The background reader keeps the values up to date by itself
+        if self.running:
+            return
         buffer_string = ''
         buffer_string += self.ser.read(self.ser.inWaiting()).decode('utf-8')
         if '\n' in buffer_string:
             last_received = buffer_string[:-2]  # Remove \n and \r
-            # print(last_received)
-            # Extract data from string
-            result = re.findall(r"\d+\.\d+", last_received)
-            # Convert to floats
-            result = [float(i) for i in result]
-            # Store results
-            try:
-                [self.tempC, self.humidity, self.t_in, self.t_out] = result
-            except:
-                print(result)
-            # print(self.tempC, self.humidity, self.t_in, self.t_out)
+            values = parse_line(last_received)
+            if values:
+                self._store(values)
+            else:
+                print(last_received)
 
     def update(self):
-        self.request_data()
-        time.sleep(3)
-        self.get_data()
+        # Request data and wait for the reply (at most the serial timeout)
+        if self.running:
+            return
+        self.ser.write(b'UPDATE\n')
+        if self.binary:
+            self._read_frames()
+            return
+        values = parse_line(self.ser.readline().decode('utf-8', errors='replace').strip())
+        if values:
+            self._store(values)
+
+    def _read_frames(self):
+        """Block until at least one byte arrives (or the timeout), then store any complete frames read."""
+        data = self.ser.read(max(1, self.ser.inWaiting()))
+        frames = self.decoder.feed(data)
+        while self.decoder.buffer and not frames:
+            data = self.ser.read(max(1, self.ser.inWaiting()))
+            if not data:
+                break
+            frames = self.decoder.feed(data)
+        for frame in frames:
+            self._store(frame)
+        return frames
+
+    def _store(self, values):
+        """Publish new values: a new snapshot dict is built and swapped in, so readers never see a partial update."""
+        now = time.time()
+        snapshot = dict(self.snapshot)
+        for key, value in values.items():
+            setattr(self, key, value)
+            snapshot[key] = value
+            snapshot[key + '_time'] = now
+        self.snapshot = snapshot
+
+    def latest(self):
+        """Latest sensor values and their read times ('<name>_time'); costs nothing, no serial traffic."""
+        return self.snapshot
+
+    @property
+    def running(self):
+        return self._reader is not None and self._reader.is_alive()
+
+    def start(self, interval=3.0):
+        """
+        Start a background thread that requests an update every `interval` seconds (None when
+        the sketch streams by itself) and parses the replies as they arrive with a blocking readline.
+        In binary mode the sketch is asked to stream frames every `interval` seconds instead.
+        Does nothing if the reader is already running.
+        """
+        if self.running:
+            return
+        if self.binary and interval is not None:
+            self.ser.write('STREAM {:d}\n'.format(int(interval * 1000)).encode())
+            interval = None
+        self._stop.clear()
+        self._reader = threading.Thread(target=self._read_loop, args=(interval,), name='arduino-reader')
+        self._reader.daemon = True
+        self._reader.start()
+
+    def stop(self):
+        """Stop the background reader (and the sketch's streaming in binary mode)."""
+        self._stop.set()
+        if self._reader is not None:
+            self._reader.join(timeout=self.ser.timeout + 1 if self.ser.timeout else None)
+        self._reader = None
+        if self.binary:
+            self.ser.write(b'STREAM 0\n')
+
+    def _read_loop(self, interval):
+        while not self._stop.is_set():
+            start = time.time()
+            try:
+                if interval is not None:
+                    self.ser.write(b'UPDATE\n')
+                if self.binary:
+                    self._read_frames()
+                    continue
+                line = self.ser.readline().decode('utf-8', errors='replace').strip()
+            except serial.SerialException as e:
+                print("Arduino reader stopped: {}".format(e))
+                return
+            values = parse_line(line)
+            if values:
+                self._store(values)
+            if interval is not None:
+                self._stop.wait(max(0.0, interval - (time.time() - start)))
 
     def log_arduino(self):
-        # Used when arduino is constantly pumping out updates (i.e. threading required)
-        buffer_string = ''
+        # Used when arduino is constantly pumping out updates: block on each line instead of spinning
         while True:
-            buffer_string += self.ser.read(self.ser.inWaiting()).decode('utf-8')
-            if '\n' in buffer_string:
-                last_received = buffer_string[:-2]  # Remove \n and \r
-                print(last_received)
-                # Extract data from string
-                [self.tempC, self.humidity, self.t_in, self.t_out] = re.findall(r"\d+\.\d+", last_received)
-                buffer_string = ''  # Reset buffer string
+            last_received = self.ser.readline().decode('utf-8', errors='replace').strip()
+            if not last_received:
+                continue
+            print(last_received)
+            values = parse_line(last_received)
+            if values:
+                self._store(values)
                 print(self.tempC, self.humidity, self.t_in, self.t_out)
 
     def close(self):
+        self.stop()
         self.ser.close()
 
 if __name__ == "__main__":
@@ -0,0 +1,195 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+from labonchip.Methods.HelperFunctions import save_sweep
+
+SENSORS = ('tempC', 'humidity', 't_in', 't_out')
+
+
+class AsyncDevice:
+    """
+    Asynchronous front end for a blocking device (Picoscope, ITC4001, Arduino, SyringePump).
+
+    The device's calls run one at a time in its own worker thread, so while a coroutine waits
+    on one instrument the event loop and the other instruments carry on. Any method can be
+    awaited with call(); the subclasses add the operations the measurements use.
+    """
+
+    def __init__(self, device):
+        self.device = device
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=type(device).__name__)
+
+    async def call(self, fn, *args, **kwargs):
+        """Run fn (a callable or the name of a device method) in the device's thread."""
+        if isinstance(fn, str):
+            fn = getattr(self.device, fn)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+class AsyncPicoscope(AsyncDevice):
+    async def capture(self, poll=0.001):
+        """Capture one block; the trigger is waited for by polling every `poll` s without blocking."""
+        ps = self.device.ps
+        await self.call(self.device.armMeasure)
+        while not await self.call(ps.isReady):
+            await asyncio.sleep(poll)
+        return np.array(await self.call(ps.getDataV, 'A'))
+
+
+class AsyncITC4001(AsyncDevice):
+    async def setpoint(self, current=None, period=None, width=None, on=None, verify=True):
+        """Apply a setpoint transition (any of current, QCW period and width in s, output) as one batch."""
+        if (period is None) != (width is None):
+            raise ValueError("Give both the QCW period and width")
+
+        def apply():
+            laser = self.device
+            with laser.batch(verify=verify):
+                if current is not None:
+                    laser.set_ld_current(current)
+                if period is not None:
+                    laser.set_qcw(period=period, width=width)
+                if on is not None:
+                    (laser.turn_ld_on if on else laser.turn_ld_off)()
+        await self.call(apply)
+
+    async def optical_power(self):
+        return await self.call(self.device.get_optical_power)
+
+    async def settle(self, on=True, reference=None, **kwargs):
+        """Wait for the optical power to settle (Settling.settle_laser), returns (settled, elapsed s)."""
+        from labonchip.Methods.Settling import settle_laser
+        return await self.call(settle_laser, self.device, on=on, reference=reference, **kwargs)
+
+
+class AsyncArduino(AsyncDevice):
+    async def update(self):
+        """Latest sensor values, read now unless the arduino's background reader keeps them up to date."""
+        await self.call(self.device.update)
+        return self.device.latest()
+
+
+class AsyncSyringePump(AsyncDevice):
+    async def set_rates(self, rates, **kwargs):
+        return await self.call(self.device.set_rates, rates, **kwargs)
+
+    async def send_commands(self, commands):
+        return await self.call(self.device.send_commands, commands)
+
+
+class Coordinator:
+    """
+    Runs the instruments of a measurement concurrently on one event loop: setpoint changes of
+    the laser and the pumps are applied together, and sweeps are captured while the previous
+    sweep is saved and the sensors and optical power are polled. Any device may be left out.
+    """
+
+    def __init__(self, scope=None, laserDriver=None, arduino=None, pump=None):
+        self.scope = AsyncPicoscope(scope) if scope is not None else None
+        self.laserDriver = AsyncITC4001(laserDriver) if laserDriver is not None else None
+        self.arduino = AsyncArduino(arduino) if arduino is not None else None
+        self.pump = AsyncSyringePump(pump) if pump is not None else None
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='writer')
+
+    async def transition(self, laser=None, rates=None, settle=False):
+        """
+        Change the laser setpoint (dict of AsyncITC4001.setpoint arguments) and the pump rates
+        ({address: rate}, see SyringePump.set_rates) at the same time, then wait for the laser to
+        settle if asked. Returns the settling (settled, elapsed s), None if not waited for.
+        """
+        changes = []
+        if laser is not None:
+            changes.append(self.laserDriver.setpoint(**laser))
+        if rates is not None:
+            changes.append(self.pump.set_rates(rates))
+        await asyncio.gather(*changes)
+        if settle and laser is not None:
+            return await self.laserDriver.settle(on=laser.get('on', True))
+
+    async def poll(self, log, stop, interval=1.0, sensors=SENSORS):
+        """Copy the sensor values and the optical power into log every `interval` s until stop is set."""
+        while not stop.is_set():
+            readings = []
+            if self.arduino is not None:
+                readings.append(self.arduino.update())
+            if self.laserDriver is not None:
+                readings.append(self.laserDriver.optical_power())
+            results = await asyncio.gather(*readings, return_exceptions=True)
+            for result in results:
+                if isinstance(result, Exception):
+                    print("Polling failed: {}".format(result))
+                elif isinstance(result, dict):
+                    log.update({key: result[key] for key in sensors if key in result})
+                else:
+                    log['optical power'] = result
+            try:
+                await asyncio.wait_for(stop.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def acquire(self, sweeps, log, dataf='../Data/', poll_interval=1.0):
+        """
+        Capture and save `sweeps` sweeps as HelperFunctions.sweeps_number does. Each sweep is
+        written while the next one is captured, and the sensors and optical power are polled
+        into the log meanwhile. Returns the sum of the sweeps.
+        """
+        directory = dataf + str(log['measurementID'])
+        if not os.path.exists(directory + "/raw"):
+            os.makedirs(directory + "/raw")
+        log['sweeps'] = sweeps
+
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        poller = asyncio.ensure_future(self.poll(log, stop, interval=poll_interval))
+        total = 0.0
+        saving = None
+        try:
+            for i in range(sweeps):
+                log['sweep_no'] = i + 1
+                log['datetime'] = datetime.now()
+                row = dict(log)
+                data = await self.scope.capture()
+                total = total + data
+                if saving is not None:
+                    await saving
+                saving = loop.run_in_executor(self._writer, save_sweep, directory, row, data)
+            if saving is not None:
+                await saving
+        finally:
+            stop.set()
+            await poller
+        return total
+
+    def run(self, coroutine):
+        """Run a coroutine of the coordinator (e.g. acquire) to completion from blocking code."""
+        return asyncio.run(coroutine)
+
+    def close(self):
+        for device in (self.scope, self.laserDriver, self.arduino, self.pump):
+            if device is not None:
+                device.close()
+        self._writer.shutdown(wait=True)
+
+
+if __name__ == "__main__":
+    from labonchip.Methods.Devices.Simulated import simulated_rig
+
+    # Laser, pumps and sensors change together, then sweeps are captured on the simulated rig
+    rig = simulated_rig(latency=0.005)
+    rig['scope'].openScope()
+    coordinator = Coordinator(**rig)
+    log = dict(measurementID='async_demo', current=0.3, fs=rig['scope'].res[0], sample_no=rig['scope'].res[1])
+    print(coordinator.run(coordinator.transition(laser=dict(current=0.3, period=0.13, width=0.01, on=True),
+                                                 rates={1: 0.5, 2: 0.5}, settle=True)))
+    coordinator.run(coordinator.acquire(10, log, dataf='/tmp/'))
+    print(log)
+    coordinator.close()
@@ -1,75 +1,275 @@
-import visa
+import threading
+import time
+from contextlib import contextmanager
+
+# Readings sampled by the background monitor: name -> SCPI query
+MONITOR = {'optical power': 'MEAS:POWer2?',
+           'ld_current': 'MEAS:CURRent?',
+           'tec_temp': 'MEAS:TEMPerature?'}
+
+# Commands always sent: the output state can change on the instrument (interlock, protection
+# trip) and the common commands hold no setting
+UNCACHED = ('OUTP', 'OUTP:STAT', 'OUTP2', 'OUTP2:STAT', '*CLS', '*SAV', '*RCL', '*RST', '*TRG')
+# Commands after which the cached settings are no longer known
+RESETS = ('*RCL', '*RST')
+# Longest message (characters) written in one transaction, batches are split beyond it
+MAX_MESSAGE = 200
+# Operation complete and the first error queue entry, appended to a batch to verify it
+VERIFY = '*OPC?;:SYST:ERR?'
+
+
+class InstrumentError(Exception):
+    """Errors the instrument reported in its error queue (SYST:ERR?)."""
+
+    def __init__(self, errors):
+        super(InstrumentError, self).__init__('; '.join('{:d},{}'.format(code, message) for code, message in errors))
+        self.errors = errors
+
+
+def parse_error(response):
+    """(code, message) of a SYST:ERR? reply such as '+0,"No error"'."""
+    code, _, message = response.strip().partition(',')
+    return int(code), message.strip().strip('"')
+
+
+def join_commands(commands):
+    """Join SCPI commands into one message, each from the root of the command tree."""
+    message = ''
+    for command in commands:
+        # Commands already written from the root (':SOUR:CURR 0.1') get a single leading colon
+        command = command.strip().lstrip(':')
+        if message:
+            message += ';' if command.startswith('*') else ';:'
+        message += command
+    return message
 
 
 class ITC4001:
     def __init__(self, *args, **kwargs):
         super(ITC4001, self).__init__()
-        rm = visa.ResourceManager()
-        # rm.list_resources()
-        self.inst = rm.open_resource('USB0::0x1313::0x804A::M00315699::INSTR')
+        # VISA resource given (e.g. a simulated one) or the driver over USB
+        self.inst = kwargs.get('inst')
+        if self.inst is None:
+            import visa
+            rm = visa.ResourceManager()
+            # rm.list_resources()
+            self.inst = rm.open_resource('USB0::0x1313::0x804A::M00315699::INSTR')
         # self.inst = rm.open_resource('USB0::0x1313::0x804A::M00314891::INSTR')
         # print(self.inst.query("*IDN?"))  # What are you?
+        # Serialises VISA traffic when the driver is also polled from another thread (e.g. an EnvironmentLogger)
+        self.lock = threading.RLock()
+
+        # Latest monitor readings with their times (s since epoch), replaced as a whole on every sample
+        self.snapshot = {}
+        self._monitor = None
+        self._stop = threading.Event()
+
+        # Last value written for each SCPI header, so unchanged settings are not sent again
+        self.state = {}
+        # Commands queued by batch(), None when not batching
+        self._pending = None
         # Turn TEC on
-        self.inst.write('OUTP2:STAT ON')
+        self._write('OUTP2:STAT ON')
+
+    def _write(self, command):
+        """
+        Send a command, unless it sets a value the instrument already holds. Inside batch() the
+        command is queued and sent with the rest of the batch.
+        """
+        header, _, value = command.partition(' ')
+        header = header.upper()
+        if header in RESETS:
+            self.state = {}
+        elif header not in UNCACHED:
+            if self.state.get(header) == value:
+                return
+            self.state[header] = value
+        if self._pending is not None:
+            self._pending.append(command)
+            return
+        self.send([command])
+
+    def send(self, commands, verify=False):
+        """
+        Write commands joined into as few messages as possible (bypassing the cache). With verify
+        the instrument is asked, in the same message, to finish the operations and report its
+        first error, so the batch costs a single round trip; InstrumentError is raised with the
+        whole error queue if any command failed.
+        """
+        messages = []
+        for command in commands:
+            if messages and len(messages[-1]) + len(command) + 2 <= MAX_MESSAGE:
+                messages[-1] = join_commands([messages[-1], command])
+            else:
+                messages.append(command)
+        try:
+            with self.lock:
+                if not verify:
+                    for message in messages:
+                        self.inst.write(message)
+                    return
+                for message in messages[:-1]:
+                    self.inst.write(message)
+                response = self.inst.query(join_commands(messages[-1:] + [VERIFY]))
+                code, message = parse_error(response.split(';', 1)[-1])
+                errors = []
+                while code != 0:
+                    errors.append((code, message))
+                    code, message = parse_error(self.inst.query('SYST:ERR?'))
+        except Exception:
+            # Whether the settings were applied is unknown
+            self.invalidate()
+            raise
+        if errors:
+            self.invalidate()
+            raise InstrumentError(errors)
+
+    @contextmanager
+    def batch(self, verify=False):
+        """
+        Queue the commands of the block (e.g. a setpoint transition) and send them as one
+        message when it ends, verified if asked (see send). Unchanged settings are left out,
+        so an empty batch sends nothing (or only the verification). Queries in the block are
+        not delayed and see the settings before it. Nested batches join the outer one.
+        """
+        if self._pending is not None:
+            yield self
+            return
+        self._pending = []
+        try:
+            yield self
+        except BaseException:
+            self._pending = None
+            self.invalidate()
+            raise
+        commands, self._pending = self._pending, None
+        if commands or verify:
+            self.send(commands, verify=verify)
+
+    def sync(self):
+        """Wait for the instrument to finish all commands and raise InstrumentError if any failed."""
+        self.send([], verify=True)
+
+    def invalidate(self):
+        """Forget the cached settings, so the next writes are all sent."""
+        self.state = {}
+
+    def _query(self, command):
+        with self.lock:
+            return self.inst.query(command)
 
     def setup_980nm_ld(self):
         """ Setup parameters for 980nm laser diode. """
         # Set TEC setpoint
-        self.inst.write('SOUR:TEMP 25C')
-        # Set LD current setpoint
-        self.inst.write('SOUR:CURR LIM 0.5')
+        self._write('SOUR:TEMP 25C')
+        # Set LD current limit
+        self._write('SOUR:CURR:LIM 0.5')
 
     def setup_1618nm_ld(self):
         """ Setup parameters for 1618nm laser diode. """
         # Set TEC setpoint
-        self.inst.write('SOUR:TEMP 25C')
+        self._write('SOUR:TEMP 25C')
         # Set LD current setpoint
-        self.inst.write('SOUR:CURR:LIM 0.4')
+        self._write('SOUR:CURR:LIM 0.4')
 
     def set_ld_shape(self, shape='DC'):
         """Set CW(DC) or QCW(PULSe) mode"""
-        self.inst.write('SOUR:FUNC:SHAP {:s}'.format(shape))
+        self._write('SOUR:FUNC:SHAP {:s}'.format(shape))
 
     def set_ld_current(self, current):
         # Set LD current setpoint
-        self.inst.write('SOUR:CURR {:.2f}'.format(current))
+        self._write('SOUR:CURR {:.2f}'.format(current))
 
     def turn_ld_on(self):
         # Turn laser diode on
-        self.inst.write('OUTP ON')
+        self._write('OUTP ON')
 
     def turn_ld_off(self):
         # Turn laser diode off
-        self.inst.write('OUTP OFF')
+        self._write('OUTP OFF')
 
     def get_optical_power(self):
         # Measures laser diode power via PD
-        return float(self.inst.query("MEAS:POWer2?"))
+        return float(self._query("MEAS:POWer2?"))
+
+    def latest(self):
+        """Latest monitored readings and their times ('<name>_time'); no VISA traffic."""
+        return self.snapshot
+
+    @property
+    def monitoring(self):
+        return self._monitor is not None and self._monitor.is_alive()
+
+    def start_monitor(self, interval=0.5, readings=None):
+        """
+        Sample optical power, LD current and TEC temperature (or the names of MONITOR given in
+        readings) every `interval` seconds in a background thread. Each query holds the VISA
+        lock only for its own round trip, so other commands interleave safely.
+        Does nothing if the monitor is already running.
+        """
+        if self.monitoring:
+            return
+        queries = MONITOR if readings is None else {name: MONITOR[name] for name in readings}
+        # First readings before returning, so they are available straight away
+        self._sample(queries)
+        self._stop.clear()
+        self._monitor = threading.Thread(target=self._monitor_loop, args=(interval, queries), name='itc4001-monitor')
+        self._monitor.daemon = True
+        self._monitor.start()
+
+    def stop_monitor(self, timeout=5.0):
+        """Stop the monitor, waiting up to `timeout` s for a query in progress (a hung one is left behind)."""
+        self._stop.set()
+        if self._monitor is not None:
+            self._monitor.join(timeout=timeout)
+            if self._monitor.is_alive():
+                print("ITC4001 monitor still running after {:.1f} s, left as a daemon thread".format(timeout))
+        self._monitor = None
+
+    def _sample(self, queries):
+        snapshot = dict(self.snapshot)
+        for name, query in queries.items():
+            try:
+                value = float(self._query(query))
+            except Exception as e:
+                print("ITC4001 monitor: {} failed: {}".format(query, e))
+                continue
+            snapshot[name] = value
+            snapshot[name + '_time'] = time.time()
+        self.snapshot = snapshot
+
+    def _monitor_loop(self, interval, queries):
+        next_sample = time.time() + interval
+        while not self._stop.wait(max(0.0, next_sample - time.time())):
+            self._sample(queries)
+            next_sample = max(next_sample + interval, time.time())
 
     def set_qcw(self, period=0.2, width=0.05):
         # Set QCW pulse
         # Set source pulse period (s)
-        self.inst.write('SOUR:PULS:PER {:.3f}'.format(period))
+        self._write('SOUR:PULS:PER {:.3f}'.format(period))
         # Set pulse width (s)
-        self.inst.write('SOUR:PULS:WIDT {:.3f}'.format(width))
+        self._write('SOUR:PULS:WIDT {:.3f}'.format(width))
         # Set trigger source to internal
-        self.inst.write('TRIG:SOUR INT')
+        self._write('TRIG:SOUR INT')
 
     def save_config(self, loc=1):
-        self.inst.write('*SAV {:s}'.format(loc))
+        self._write('*SAV {:s}'.format(loc))
 
     def load_config(self, loc=1):
-        self.inst.write('*RCL {:s}'.format(loc))
+        self._write('*RCL {:s}'.format(loc))
 
     def clear(self):
         """Clears the event registers in all register groups. This command also clears the error queue."""
-        self.inst.write('*CLS')
+        self._write('*CLS')
 
     def print_error(self):
-        print(self.inst.query('SYST:ERR?'))
+        print(self._query('SYST:ERR?'))
 
     def user_write(self, string):
-        self.inst.write(string)
+        # May change any setting, sent as is
+        self.invalidate()
+        self.send([string])
 
     def user_query(self, string):
-        self.inst.query(string)
+        self._query(string)
@@ -2,23 +2,29 @@ import time
 
 import matplotlib.pyplot as plt
 import numpy as np
-from picoscope import ps5000a
 
 
 class Picoscope:
     def __init__(self, *args, **kwargs):
         super(Picoscope, self).__init__()
-        self.ps = ps5000a.PS5000a(connect=False)
+        # Scope driver given (e.g. a simulated one) or the Picoscope 5000a
+        self.ps = kwargs.get('ps')
+        if self.ps is None:
+            from picoscope import ps5000a
+            self.ps = ps5000a.PS5000a(connect=False)
 
     def openScope(self, bitRes=16, obsDuration=120e-3, sampleFreq=1E4):
         self.ps.open()
 
         # Set bit resolution
         self.ps.setResolution(str(bitRes))
+        self.bit_res = bitRes
 
         # Set trigger and channels
         self.ps.setSimpleTrigger(trigSrc="External", threshold_V=2.0, direction="Falling", timeout_ms=5000)
-        self.ps.setChannel("A", coupling="DC", VRange=10.0, VOffset=-8.0, enabled=True, BWLimited=1)
+        self.v_offset = -8.0
+        self.v_range = self.ps.setChannel("A", coupling="DC", VRange=10.0, VOffset=self.v_offset, enabled=True,
+                                          BWLimited=1)
         self.ps.setChannel("B", coupling="DC", VRange=5.0, VOffset=0, enabled=False)
 
         # Set capture duration (s) and sampling frequency (Hz)
@@ -42,6 +48,12 @@ class Picoscope:
         # print("Sampling Done")
         return self.ps.getDataV("A")
 
+    def measure_blocks(self, blocks):
+        """Capture `blocks` consecutive blocks, yielding the data of each one as soon as it arrives."""
+        for _ in range(blocks):
+            self.armMeasure()
+            yield self.measure()
+
     def closeScope(self):
         self.ps.close()
 
@@ -0,0 +1,479 @@
+"""
+Simulated instruments speaking the same protocols as the lab rig, to run the device classes,
+measurement helpers and scripts without it: pass them to the devices in place of their port,
+e.g. Arduino(ser=SimulatedArduino()), ITC4001(inst=SimulatedITC4001()),
+SyringePump(ser=SimulatedSyringePump()) and Picoscope(ps=SimulatedPS5000a()), or use simulated_rig().
+
+Every simulator takes a latency (s per reply or VISA transaction) and error injection rates,
+drawn from its own random generator (seed) so a failing run can be repeated.
+"""
+import abc
+import inspect
+import random
+import re
+import threading
+import time
+
+import numpy as np
+
+from labonchip.Methods.Devices.Arduino import encode_frame
+from labonchip.Methods.Devices.SyringePump import ETX, STX
+
+
+class SimulatedSerial(abc.ABC):
+    """
+    In-memory stand-in for serial.Serial answering like a device: every command written (ended by
+    CR or LF) is passed to handle(), whose reply becomes readable `latency` s later. Reads block
+    up to the timeout as on a real port.
+
+    Error injection: drop is the probability a reply is lost, corrupt that one of its bytes is
+    changed and noise that stray bytes arrive before it.
+    """
+
+    def __init__(self, latency=0.0, drop=0.0, corrupt=0.0, noise=0.0, timeout=1.0, seed=None):
+        self.latency = latency
+        self.drop = drop
+        self.corrupt = corrupt
+        self.noise = noise
+        self.timeout = timeout
+        self.random = random.Random(seed)
+        self.is_open = True
+
+        self.commands = []
+        self._input = b''
+        self._pending = []
+        self._buffer = b''
+        self._condition = threading.Condition()
+
+    @abc.abstractmethod
+    def handle(self, command):
+        """Reply (bytes) to a command (str, without its terminator)."""
+
+    def produce(self, now):
+        """Bytes the device sends by itself up to now (e.g. streamed frames)."""
+        return b''
+
+    def _inject(self, reply):
+        if not reply or self.random.random() < self.drop:
+            return b''
+        if self.random.random() < self.corrupt:
+            i = self.random.randrange(len(reply))
+            reply = reply[:i] + bytes([reply[i] ^ (1 << self.random.randrange(8))]) + reply[i + 1:]
+        if self.random.random() < self.noise:
+            reply = bytes(self.random.randrange(256) for _ in range(self.random.randint(1, 4))) + reply
+        return reply
+
+    def write(self, data):
+        with self._condition:
+            self._input += bytes(data)
+            commands = re.split(b'[\r\n]', self._input)
+            self._input = commands.pop()
+            for command in commands:
+                if not command:
+                    continue
+                command = command.decode('ascii', errors='replace')
+                self.commands.append(command)
+                reply = self._inject(self.handle(command))
+                if reply:
+                    self._pending.append((time.time() + self.latency, reply))
+            self._condition.notify_all()
+        return len(data)
+
+    def _collect(self):
+        now = time.time()
+        ready = [reply for t, reply in self._pending if t <= now]
+        self._pending = [(t, reply) for t, reply in self._pending if t > now]
+        self._buffer += b''.join(ready) + self._inject(self.produce(now))
+
+    def _read(self, done):
+        """Block until done(buffer) gives the number of bytes to return, or the timeout."""
+        deadline = None if self.timeout is None else time.time() + self.timeout
+        with self._condition:
+            while True:
+                self._collect()
+                n = done(self._buffer)
+                remaining = None if deadline is None else deadline - time.time()
+                if n or (remaining is not None and remaining <= 0):
+                    n = n or len(self._buffer)
+                    data, self._buffer = self._buffer[:n], self._buffer[n:]
+                    return data
+                wait = 0.005 if remaining is None else min(0.005, remaining)
+                if self._pending:
+                    wait = min(wait, max(0.0, self._pending[0][0] - time.time()))
+                self._condition.wait(wait)
+
+    def read(self, size=1):
+        return self._read(lambda buffer: size if len(buffer) >= size else 0)
+
+    def read_until(self, expected=b'\n', size=None):
+        def done(buffer):
+            i = buffer.find(expected)
+            if i >= 0:
+                return i + len(expected)
+            return size if size is not None and len(buffer) >= size else 0
+        return self._read(done)
+
+    def readline(self):
+        return self.read_until(b'\n')
+
+    @property
+    def in_waiting(self):
+        with self._condition:
+            self._collect()
+            return len(self._buffer)
+
+    def inWaiting(self):
+        return self.in_waiting
+
+    def reset_input_buffer(self):
+        with self._condition:
+            self._collect()
+            self._buffer = b''
+
+    def close(self):
+        self.is_open = False
+
+
+class SimulatedArduino(SimulatedSerial):
+    """
+    ambientLoggerV3 sketch: UPDATE, SHT and TK text replies, BIN/TEXT switching to binary frames
+    and STREAM <ms>. The readings random walk by `drift` per reading.
+    """
+
+    def __init__(self, tempC=22.0, humidity=45.0, t_in=25.0, t_out=24.5, drift=0.01, **kwargs):
+        super(SimulatedArduino, self).__init__(**kwargs)
+        self.values = dict(tempC=tempC, humidity=humidity, t_in=t_in, t_out=t_out)
+        self.drift = drift
+        self.binary = False
+        self.stream = 0
+        self.next_stream = None
+        self.seq = 0
+        self.start = time.time()
+
+    def read_sensors(self):
+        for key in self.values:
+            self.values[key] += self.random.gauss(0, self.drift)
+        return self.values
+
+    def frame(self):
+        v = self.read_sensors()
+        self.seq += 1
+        return encode_frame(self.seq, int((time.time() - self.start) * 1E3), v['tempC'], v['humidity'],
+                            v['t_in'], v['t_out'])
+
+    def handle(self, command):
+        if command == 'BIN':
+            self.binary = True
+            return self.frame()
+        if command == 'TEXT':
+            self.binary, self.stream = False, 0
+            return b''
+        if command.startswith('STREAM'):
+            self.binary = True
+            self.stream = int(command[6:].strip() or 0)
+            self.next_stream = time.time() + self.stream / 1E3
+            return b''
+        if command == 'UPDATE' and self.binary:
+            return self.frame()
+        v = self.read_sensors()
+        if command == 'UPDATE':
+            text = "Ambient Temp {tempC:.2f} C and humidity {humidity:.2f} %. " \
+                   "Temperature in {t_in:.2f} C and temperature out {t_out:.2f} C.".format(**v)
+        elif command == 'SHT':
+            text = "Ambient Temp {tempC:.2f} C and humidity {humidity:.2f} %".format(**v)
+        elif command == 'TK':
+            text = "Temperature in {t_in:.2f} C and temperature out {t_out:.2f} C".format(**v)
+        else:
+            return b''
+        return (text + '\r\n').encode()
+
+    def produce(self, now):
+        frames = b''
+        while self.stream and self.next_stream <= now:
+            frames += self.frame()
+            self.next_stream += self.stream / 1E3
+        return frames
+
+
+class SimulatedSyringePump(SimulatedSerial):
+    """
+    Network of Aladdin pumps (addresses) in basic mode: DIA, RAT (set and query), RUN, STP, CLD,
+    VER, replies framed by STX/ETX. Pumps not in `addresses` do not reply. error_rate is the
+    probability a command is answered with a '?COM' error.
+    """
+
+    def __init__(self, addresses=(1, 2), error_rate=0.0, **kwargs):
+        super(SimulatedSyringePump, self).__init__(**kwargs)
+        self.error_rate = error_rate
+        self.pumps = {address: dict(diameter=26.59, rate=0.0, units='MM', status='S') for address in addresses}
+
+    def handle(self, command):
+        match = re.match(r'^(\d{0,2})\s*([A-Z]*)\s*(.*)$', command.strip())
+        address = int(match.group(1) or 0)
+        name, args = match.group(2), match.group(3).split()
+        if address not in self.pumps:
+            return b''
+        pump = self.pumps[address]
+        msg = ''
+        if self.random.random() < self.error_rate:
+            msg = '?COM'
+        elif name == 'DIA':
+            if args:
+                pump['diameter'] = float(args[0])
+            else:
+                msg = '{:.2f}'.format(pump['diameter'])
+        elif name == 'RAT':
+            if not args:
+                msg = '{:.3f}{}'.format(pump['rate'], pump['units'])
+            elif float(args[0]) <= 0:
+                msg = '?OOR'
+            else:
+                pump['rate'] = float(args[0])
+                pump['units'] = args[1] if len(args) > 1 else pump['units']
+        elif name == 'RUN':
+            if pump['rate'] > 0:
+                pump['status'] = 'I'
+            else:
+                msg = '?NA'
+        elif name == 'STP':
+            pump['status'] = 'S'
+        elif name == 'CLD':
+            pass
+        elif name == 'VER':
+            msg = 'NE1000V3.928'
+        else:
+            msg = '?'
+        return STX + '{:02d}{}{}'.format(address, pump['status'], msg).encode() + ETX
+
+
+def short_form(header):
+    """Short form of a SCPI header, e.g. SOURCE:CURRENT:LIMIT -> SOUR:CURR:LIM, MEAS:POWer2? -> MEAS:POW2?."""
+    nodes = []
+    for node in header.upper().strip(':').split(':'):
+        match = re.match(r'^(\*?[A-Z]+)(\d*)(\??)$', node)
+        if match is None:
+            return header.upper()
+        name, suffix, query = match.groups()
+        if len(name) > 4 and not name.startswith('*'):
+            name = name[:3] if name[3] in 'AEIOU' else name[:4]
+        nodes.append(name + suffix + query)
+    return ':'.join(nodes)
+
+
+class SimulatedITC4001:
+    """
+    ITC4001 laser diode and TEC driver as a VISA resource: SCPI settings, queries and error queue
+    for the commands the ITC4001 class uses, messages joined with ';'. The photodiode power rises
+    and falls towards slope * (current - threshold) (times the duty cycle in pulsed mode) with the
+    time constant `rise` (s) when the output changes.
+
+    error_rate is the probability a command is rejected with a device specific error (-300) and
+    timeout_rate that a transaction raises IOError as a VISA timeout would.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, timeout_rate=0.0, slope=0.5, threshold=0.05, rise=0.2,
+                 noise=0.002, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.slope = slope
+        self.threshold = threshold
+        self.rise = rise
+        self.noise = noise
+        self.random = random.Random(seed)
+
+        self.settings = {'SOUR:CURR': 0.0, 'SOUR:CURR:LIM': 0.5, 'SOUR:TEMP': 25.0, 'SOUR:FUNC:SHAP': 'DC',
+                         'SOUR:PULS:PER': 0.2, 'SOUR:PULS:WIDT': 0.05, 'TRIG:SOUR': 'INT', 'OUTP': 'OFF',
+                         'OUTP2:STAT': 'OFF'}
+        self.errors = []
+        self.messages = []
+        self._power = (0.0, 0.0, time.time())
+        self._lock = threading.Lock()
+
+    def target_power(self):
+        s = self.settings
+        if s['OUTP'] != 'ON':
+            return 0.0
+        power = self.slope * max(s['SOUR:CURR'] - self.threshold, 0.0)
+        if s['SOUR:FUNC:SHAP'] == 'PULS':
+            power *= s['SOUR:PULS:WIDT'] / s['SOUR:PULS:PER']
+        return power
+
+    def power(self):
+        """Photodiode power (W) now, without noise."""
+        start, target, t = self._power
+        return target + (start - target) * np.exp(-(time.time() - t) / self.rise)
+
+    def _transaction(self, message):
+        time.sleep(self.latency)
+        if self.random.random() < self.timeout_rate:
+            raise IOError('VI_ERROR_TMO: Timeout expired before operation completed (simulated)')
+        self.messages.append(message)
+        replies = []
+        with self._lock:
+            for command in message.strip().split(';'):
+                if command.strip():
+                    reply = self._execute(command.strip())
+                    if reply is not None:
+                        replies.append(reply)
+        return ';'.join(replies)
+
+    def _execute(self, command):
+        header, _, value = command.partition(' ')
+        header, value = short_form(header), value.strip()
+        if header in ('OUTP:STAT', 'OUTP1:STAT', 'OUTP1'):
+            header = 'OUTP'
+        if header.endswith('?'):
+            return self._query(header)
+        if self.random.random() < self.error_rate:
+            self.errors.append('-300,"Device-specific error"')
+            return None
+        if header in ('*CLS',):
+            self.errors = []
+        elif header in ('*RST', '*SAV', '*RCL', '*TRG'):
+            pass
+        elif header not in self.settings:
+            self.errors.append('-113,"Undefined header"')
+        elif isinstance(self.settings[header], float):
+            try:
+                number = float(re.sub(r'[A-Za-z]+$', '', value))
+            except ValueError:
+                self.errors.append('-224,"Illegal parameter value"')
+                return None
+            if header == 'SOUR:CURR' and number > self.settings['SOUR:CURR:LIM']:
+                self.errors.append('-222,"Data out of range"')
+            elif header == 'SOUR:PULS:WIDT' and number >= self.settings['SOUR:PULS:PER']:
+                self.errors.append('-221,"Settings conflict"')
+            else:
+                self._set(header, number)
+        else:
+            value = {'1': 'ON', '0': 'OFF'}.get(value.upper(), short_form(value))
+            self._set(header, value)
+        return None
+
+    def _set(self, header, value):
+        power = self.power()
+        self.settings[header] = value
+        self._power = (power, self.target_power(), time.time())
+
+    def _query(self, header):
+        s = self.settings
+        if header == '*IDN?':
+            return 'Thorlabs,ITC4001,M00000000,1.0.0 (simulated)'
+        if header == '*OPC?':
+            return '1'
+        if header == 'SYST:ERR?':
+            return self.errors.pop(0) if self.errors else '+0,"No error"'
+        if header == 'MEAS:POW2?':
+            return '{:.6E}'.format(self.power() * (1 + self.random.gauss(0, self.noise)))
+        if header == 'MEAS:CURR?':
+            return '{:.6E}'.format(s['SOUR:CURR'] if s['OUTP'] == 'ON' else 0.0)
+        if header == 'MEAS:TEMP?':
+            return '{:.6E}'.format(s['SOUR:TEMP'] + self.random.gauss(0, 0.005))
+        if header[:-1] in s:
+            value = s[header[:-1]]
+            return '{:.6E}'.format(value) if isinstance(value, float) else value
+        self.errors.append('-113,"Undefined header"')
+        return ''
+
+    def write(self, message):
+        self._transaction(message)
+        return len(message)
+
+    def query(self, message):
+        return self._transaction(message)
+
+    def read(self):
+        return ''
+
+    def close(self):
+        pass
+
+
+class SimulatedPS5000a:
+    """
+    Picoscope 5000a (picoscope.ps5000a.PS5000a) capturing the photodiode signal of a pumped decay:
+    flat while pumping for `pump` ms, then A exp(-t / tau) + offset plus noise. A follows the laser
+    power when a SimulatedITC4001 is given (`gain` V/W), else it is `gain` V. Each capture takes
+    its duration plus `latency` s; timeout_rate is the probability that isReady never succeeds
+    until the trigger timeout.
+    """
+
+    def __init__(self, laser=None, tau=1.0, pump=10.0, gain=100.0, offset=0.0, noise=0.01, latency=0.0,
+                 timeout_rate=0.0, seed=None):
+        self.laser = laser
+        self.tau = tau
+        self.pump = pump
+        self.gain = gain
+        self.offset = offset
+        self.noise = noise
+        self.latency = latency
+        self.timeout_rate = timeout_rate
+        self.random = np.random.RandomState(seed)
+        self.interval = 1E-4
+        self.samples = 1200
+        self.timeout = 5.0
+        self.ready_at = None
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def setResolution(self, resolution):
+        self.resolution = resolution
+
+    def setSimpleTrigger(self, trigSrc=None, threshold_V=0.0, direction=None, timeout_ms=5000, **kwargs):
+        self.timeout = timeout_ms / 1E3
+
+    def setChannel(self, channel='A', coupling='DC', VRange=10.0, VOffset=0.0, enabled=True, BWLimited=0):
+        return VRange
+
+    def setSamplingInterval(self, sampleInterval, duration):
+        self.interval = sampleInterval
+        self.samples = int(round(duration / sampleInterval))
+        return self.interval, self.samples, 2 ** 27
+
+    def runBlock(self):
+        delay = self.samples * self.interval + self.latency
+        if self.random.rand() < self.timeout_rate:
+            delay += self.timeout
+        self.ready_at = time.time() + delay
+
+    def isReady(self):
+        return self.ready_at is not None and time.time() >= self.ready_at
+
+    def getDataV(self, channel='A'):
+        A = self.gain * (self.laser.power() if self.laser is not None else 1.0)
+        x = np.arange(self.samples) * self.interval * 1E3
+        y = np.where(x < self.pump, A, A * np.exp(-(x - self.pump) / self.tau)) + self.offset
+        return y + self.random.normal(0, self.noise, self.samples)
+
+
+def simulated_rig(latency=0.0, seed=None, **kwargs):
+    """
+    Device classes connected to simulated instruments sharing one laser, as a dict with the names
+    the scripts use: laserDriver (ITC4001), arduino, scope (Picoscope) and pump (SyringePump).
+    kwargs are passed to every simulator (e.g. error rates), latency and seed to all of them.
+    """
+    from labonchip.Methods.Devices.Arduino import Arduino
+    from labonchip.Methods.Devices.ITC4001 import ITC4001
+    from labonchip.Methods.Devices.Picoscope import Picoscope
+    from labonchip.Methods.Devices.SyringePump import SyringePump
+
+    def options(cls):
+        # Only the keyword arguments each simulator accepts
+        parameters = list(inspect.signature(cls).parameters.values())
+        if issubclass(cls, SimulatedSerial):
+            parameters += list(inspect.signature(SimulatedSerial).parameters.values())
+        names = {p.name for p in parameters if p.kind in (p.POSITIONAL_OR_KEYWORD, p.KEYWORD_ONLY)}
+        return {key: value for key, value in kwargs.items() if key in names}
+
+    laser = SimulatedITC4001(latency=latency, seed=seed, **options(SimulatedITC4001))
+    return dict(laserDriver=ITC4001(inst=laser),
+                arduino=Arduino(ser=SimulatedArduino(latency=latency, seed=seed, **options(SimulatedArduino))),
+                scope=Picoscope(ps=SimulatedPS5000a(laser=laser, latency=latency, seed=seed,
+                                                    **options(SimulatedPS5000a))),
+                pump=SyringePump(ser=SimulatedSyringePump(latency=latency, seed=seed,
+                                                          **options(SimulatedSyringePump))))
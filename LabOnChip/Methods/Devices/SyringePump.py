@@ -1,6 +1,14 @@
-import serial
+import re
 import time
 
+import serial
+
+# Replies are framed by start and end of text characters
+STX = b'\x02'
+ETX = b'\x03'
+# Value and units of a query reply, e.g. '1.000MM' to RAT
+VALUE = re.compile(r"^\s*(-?\d*\.?\d+)\s*([A-Z]*)")
+
 
 def format_command(address, command):
     """
@@ -12,7 +20,7 @@ def format_command(address, command):
     """
 
     # Confirm address parameter
-    if address > 99:
+    if address is not None and address > 99:
         raise SyntaxError("Invalid Address: %s" % address)
     if address is not None:
         command = "{:02d}{:s}\r\n".format(address, command)
@@ -35,7 +43,7 @@ def interpret_response(response):
 
     # Basic mode response in format:
     # <address, 2 chars><status, one char><message>
-    address = int(response[0:2])
+    address = reply_address(response)
     status = response[2]
     msg = response[3:]
 
@@ -46,6 +54,13 @@ def interpret_response(response):
     return address, status, msg
 
 
+def reply_address(response):
+    """Address of the pump a reply comes from, Error if the reply is corrupted."""
+    if len(response) < 3 or not response[0:2].isdigit():
+        raise Error("Corrupted response from syringe pump: {!r}".format(response))
+    return int(response[0:2])
+
+
 class Error(Exception):
     pass
 
@@ -64,30 +79,133 @@ class CommandError(Error):
             self.type = "Invalid command packet"
         elif msg == "?O":
             self.type = "Command ignored (simultaneous phase start)"
+        else:
+            self.type = "Pump error " + msg
+        # Set by SyringePump to the pump and command that failed
+        self.address = None
+        self.command = None
 
         Error.__init__(self, self.type)
 
 
+def parse_value(msg):
+    """(value, units) of a query reply, e.g. (1.0, 'MM') for '1.000MM'."""
+    match = VALUE.match(msg)
+    if match is None:
+        raise SyntaxError("No value in response: %s" % msg)
+    return float(match.group(1)), match.group(2)
+
+
 class SyringePump:
-    def __init__(self):
+    def __init__(self, ser=None):
         super(SyringePump, self).__init__()
-        # Setup serial port to communicate with Aladdin Syringe Pump
-        self.syringe_pump = serial.Serial(
-            port='COM5',
-            baudrate=19200,
-            timeout=3
-        )
-        # Allow serial connection time to setup
-        time.sleep(2)  # Could make shorter?
+        # Setup serial port to communicate with Aladdin Syringe Pump (or use the port given, e.g. a simulated one)
+        self.syringe_pump = ser
+        if ser is None:
+            self.syringe_pump = serial.Serial(
+                port='COM5',
+                baudrate=19200,
+                timeout=3
+            )
+            # Allow serial connection time to setup
+            time.sleep(2)  # Could make shorter?
+        # Status of every pump from its last reply (e.g. 'I' infusing, 'S' stopped)
+        self.status = {}
 
     def send_command(self, address, command):
-        command = format_command(address, command)
-        self.syringe_pump.write(str.encode(command))
-        # Delay between sending commands to allow pump to receive and process
-        time.sleep(0.1)
+        """Send a command and wait for its reply, returns (address, status, message); see send_commands."""
+        return self.send_commands([(address, command)])[0]
+
+    def send_commands(self, commands):
+        """
+        Send (address, command) pairs and return their replies, (address, status, message) in order.
+
+        Every pump on the network holds one command at a time, so the next command of each
+        address is written together with those of the other pumps and all their replies are
+        read, each up to its ETX, before the next round. Replies are matched to the pumps by
+        address. CommandError (with the address and command) is raised for the first command
+        the pumps rejected, once all the replies have been read.
+        """
+        replies = [None] * len(commands)
+        pending = list(enumerate(commands))
+        error = None
+        while pending:
+            # Next command of every address
+            round_, rest, addresses = [], [], set()
+            for i, (address, command) in pending:
+                if address in addresses:
+                    rest.append((i, (address, command)))
+                else:
+                    round_.append((i, (address, command)))
+                    addresses.add(address)
+            pending = rest
+            self.syringe_pump.write(b''.join(str.encode(format_command(address, command))
+                                             for i, (address, command) in round_))
+
+            waiting = {address: (i, command) for i, (address, command) in round_}
+            while waiting:
+                response = self.read_response()
+                try:
+                    address = reply_address(response)
+                except Error:
+                    # Read the rest of this round's replies so the next exchange starts aligned
+                    self.drain(len(waiting) - 1)
+                    raise
+                if address not in waiting:
+                    continue
+                i, command = waiting.pop(address)
+                try:
+                    replies[i] = interpret_response(response)
+                except CommandError as e:
+                    e.address, e.command = address, command
+                    replies[i] = (address, response[2], response[3:])
+                    error = error or e
+                self.status[address] = replies[i][1]
+        if error is not None:
+            raise error
+        return replies
+
+    def read_response(self):
+        """Read one reply up to its ETX and return it without the STX/ETX."""
+        data = self.syringe_pump.read_until(ETX)
+        if not data.endswith(ETX):
+            raise Error("No response from syringe pump (received {!r})".format(data))
+        return data[data.rfind(STX) + 1:-1].decode('ascii', errors='replace')
+
+    def drain(self, replies):
+        """Read and discard up to `replies` replies, each up to its ETX, stopping at the first missing one."""
+        for _ in range(replies):
+            if not self.syringe_pump.read_until(ETX).endswith(ETX):
+                break
 
     def get_response(self):
-        buffer_string = ''
-        buffer_string += self.syringe_pump.read(self.syringe_pump.inWaiting()).decode('utf-8')
-        last_received = buffer_string  # [:-2]  # Remove \n and \r
-        print(last_received)
+        """Read and interpret one reply, (address, status, message)."""
+        return interpret_response(self.read_response())
+
+    def set_rates(self, rates, units='MM', run=True, verify=True):
+        """
+        Set the pumping rate of several pumps at once, {address: rate}, and start them (run), a rate
+        of zero stops the pump. With verify the rates are read back in the same exchange and an
+        Error is raised if any differs from the one set. Returns the time taken (s).
+        """
+        start = time.time()
+        commands = []
+        for address, rate in rates.items():
+            if rate > 0:
+                commands.append((address, 'RAT {:.2f} {:s}'.format(rate, units)))
+                if run:
+                    commands.append((address, 'RUN'))
+            elif self.status.get(address) != 'S':
+                commands.append((address, 'STP'))
+        if verify:
+            commands += [(address, 'RAT') for address, rate in rates.items() if rate > 0]
+        replies = self.send_commands(commands)
+
+        if verify:
+            read = {address: parse_value(msg) for (address, command), (_, status, msg) in zip(commands, replies)
+                    if command == 'RAT'}
+            for address, (value, unit) in read.items():
+                if abs(value - round(rates[address], 2)) > 1E-6 or (unit and unit != units):
+                    raise Error("Pump {:02d} rate is {}{}, set {:.2f}{}".format(address, value, unit,
+                                                                                 rates[address], units))
+        return time.time() - start
@@ -0,0 +1,166 @@
+import os
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+
+class EnvironmentLogger:
+    """
+    Log environmental readings (temperatures, humidity, laser optical power, ...) of a run as
+    their own append-only time series, independently of the sweeps.
+
+    sources maps a name to a callable returning either a value, stored under that name, or a
+    dict of values (e.g. Arduino.latest). Every `interval` seconds a background thread reads
+    all sources into one timestamped row; rows are appended to the csv `file` every
+    `flush_interval` seconds, so a crash loses at most that much. Analysis joins the series
+    to the sweeps on datetime (see attach_environment).
+    """
+
+    def __init__(self, file, sources, interval=1.0, flush_interval=10.0):
+        self.file = file
+        self.sources = dict(sources)
+        self.interval = interval
+        self.flush_interval = flush_interval
+
+        self.columns = None
+        self.errors = 0
+        self.failed = set()
+        self._rows = []
+        self._thread = None
+        self._stop = threading.Event()
+
+    def sample(self):
+        """Read every source once into a row (sources that fail are left out of the row)."""
+        row = {'datetime': datetime.now()}
+        for name, source in self.sources.items():
+            try:
+                value = source()
+            except Exception as e:
+                # Report the first failure of each source, count the rest
+                if name not in self.failed:
+                    print("Environment source '{}' failed: {}".format(name, e))
+                self.failed.add(name)
+                self.errors += 1
+                continue
+            if isinstance(value, dict):
+                row.update({key: v for key, v in value.items() if not key.endswith('_time')})
+            else:
+                row[name] = value
+        self._rows.append(row)
+        return row
+
+    def flush(self):
+        """Append the buffered rows to the file."""
+        rows, self._rows = self._rows, []
+        if not rows:
+            return
+        df = pd.DataFrame(rows)
+        if self.columns is None and os.path.exists(self.file):
+            self.columns = list(pd.read_csv(self.file, nrows=0).columns)
+        if self.columns is None:
+            self.columns = list(df.columns)
+            df.to_csv(self.file, index=False, columns=self.columns)
+            return
+        new = [c for c in df.columns if c not in self.columns]
+        if new:
+            # A source or field seen for the first time (e.g. a sensor that had no reading yet):
+            # rewrite the file with the extra columns, empty for the earlier rows
+            self.columns += new
+            written = pd.read_csv(self.file)
+            pd.concat([written, df], ignore_index=True, sort=False).to_csv(self.file, index=False,
+                                                                            columns=self.columns)
+            return
+        df.reindex(columns=self.columns).to_csv(self.file, mode='a', header=False, index=False)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start logging in a background thread (does nothing if already running)."""
+        if self.running:
+            return self
+        directory = os.path.dirname(self.file)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='environment-logger')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop logging and write any buffered rows."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._thread = None
+        self.flush()
+
+    def _run(self):
+        last_flush = time.time()
+        while not self._stop.is_set():
+            start = time.time()
+            self.sample()
+            if start - last_flush >= self.flush_interval:
+                self.flush()
+                last_flush = start
+            self._stop.wait(max(0.0, self.interval - (time.time() - start)))
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def load_environment(file):
+    """Environmental time series of a run (environment.csv), sorted by datetime."""
+    env = pd.read_csv(file, parse_dates=['datetime'])
+    return env.sort_values('datetime', kind='mergesort').reset_index(drop=True)
+
+
+def attach_environment(df, env, columns=None, method='interp', tolerance=None):
+    """
+    Attach environmental readings to every sweep (row of df) by its datetime.
+
+    method='interp' linearly interpolates each numeric column between the readings either side
+    of the sweep (NaN outside the logged span); method='asof' takes the last reading at or
+    before the sweep, within tolerance (a pd.Timedelta) if given. Columns already in df are
+    replaced, and keep their values for the sweeps with no reading (e.g. the last sweeps of a
+    run, after the final reading). Returns a new dataframe in the original row order.
+    """
+    if df.empty or env.empty:
+        return df
+    if columns is None:
+        columns = [c for c in env.columns if c != 'datetime' and np.issubdtype(env[c].dtype, np.number)]
+    if method not in ('interp', 'asof'):
+        raise ValueError("Unknown method '{}', use 'interp' or 'asof'".format(method))
+    old = df[[c for c in columns if c in df.columns]]
+    df = df.drop(columns=old.columns)
+
+    if method == 'asof':
+        order = np.argsort(df['datetime'].values, kind='mergesort')
+        # merge_asof needs the same time resolution on both sides (csv and HDF times may differ)
+        left = df.iloc[order].reset_index().astype({'datetime': 'datetime64[ns]'})
+        right = env[['datetime'] + list(columns)].astype({'datetime': 'datetime64[ns]'})
+        joined = pd.merge_asof(left, right, on='datetime', direction='backward', tolerance=tolerance)
+        df = joined.set_index('index').loc[df.index]
+    else:
+        t = pd.to_datetime(df['datetime']).values.astype('datetime64[ns]').astype(np.int64).astype(float)
+        t_env = env['datetime'].values.astype('datetime64[ns]').astype(np.int64).astype(float)
+        df = df.copy()
+        for column in columns:
+            values = env[column].values.astype(float)
+            ok = np.isfinite(values)
+            if ok.sum() == 0:
+                df[column] = np.nan
+                continue
+            df[column] = np.interp(t, t_env[ok], values[ok], left=np.nan, right=np.nan)
+
+    for column in old.columns:
+        df[column] = df[column].where(df[column].notna(), old[column])
+    return df
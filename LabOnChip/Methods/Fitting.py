@@ -0,0 +1,610 @@
+import numpy as np
+
+
+def decay_fn(t, a, tau, c):
+    """ Mono-exponential fitting function. t is the time."""
+    return a * np.exp(-t / tau) + c
+
+
+def noise_std(Y, tail=0.2):
+    """
+    Estimate the noise standard deviation of each sweep (row of Y) from the last `tail`
+    fraction of samples. Uses first differences so a residual slow decay does not count as noise.
+    """
+    Y = np.atleast_2d(Y)
+    n = Y.shape[1]
+    start = min(int(n * (1 - tail)), n - 3)
+    return np.std(np.diff(Y[:, start:], axis=1), axis=1, ddof=1) / np.sqrt(2)
+
+
+def noise_variance(Y, source='tail', fraction=0.2, pretrigger=0, quantum=None):
+    """
+    Noise variance of each sweep (row of Y) in one vectorised pass.
+
+    source='tail' uses the last `fraction` of the samples (after the decay has died away) and
+    source='pretrigger' the first `pretrigger` samples (before the pump pulse). First differences
+    are used so a residual slow decay or baseline drift does not count as noise. quantum is the
+    ADC step (channel range / 2**bits); the variance is floored at its quantisation noise, quantum**2/12.
+    """
+    Y = np.atleast_2d(Y)
+    n = Y.shape[1]
+    if source == 'tail':
+        segment = Y[:, min(int(n * (1 - fraction)), n - 3):]
+    elif source == 'pretrigger':
+        if pretrigger < 3:
+            raise ValueError("Need at least 3 pretrigger samples to estimate the noise")
+        segment = Y[:, :pretrigger]
+    else:
+        raise ValueError("Unknown noise source '{}', use 'tail' or 'pretrigger'".format(source))
+    var = np.var(np.diff(segment, axis=1), axis=1, ddof=1) / 2
+    if quantum is not None:
+        var = np.maximum(var, np.asarray(quantum, dtype=float) ** 2 / 12)
+    return var
+
+
+def shot_noise_variance(Y, f, c, var_floor, blocks=16):
+    """
+    Signal dependent noise model, var(t) = var_floor + gain * (f(t) - c), for every sweep.
+
+    The gain is found per sweep by regressing the residual variance in `blocks` blocks of the
+    decay against the fitted signal above the baseline, f - c. Returns a (sweeps, samples) array.
+    """
+    N, n = Y.shape
+    size = n // blocks
+    r2 = ((Y - f)[:, :size * blocks] ** 2).reshape(N, blocks, size).mean(axis=2)
+    signal = np.clip(f - c[:, None], 0, None)
+    s = signal[:, :size * blocks].reshape(N, blocks, size).mean(axis=2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gain = np.sum((r2 - var_floor[:, None]) * s, axis=1) / np.sum(s ** 2, axis=1)
+    gain = np.where(np.isfinite(gain), np.clip(gain, 0, None), 0)
+    return var_floor[:, None] + gain[:, None] * signal
+
+
+def guess_decay(x, Y):
+    """Vectorised initial guess of (a, tau, c) for every sweep (row of Y)."""
+    Y = np.atleast_2d(Y)
+    n = Y.shape[1]
+
+    # Offset from the tail, amplitude from the start of the decay
+    c = Y[:, -max(n // 20, 1):].mean(axis=1)
+    a = Y[:, :max(n // 100, 1)].mean(axis=1) - c
+
+    # Lifetime from the first 1/e crossing
+    with np.errstate(divide='ignore', invalid='ignore'):
+        y_norm = (Y - c[:, None]) / a[:, None]
+    below = y_norm <= 1 / np.e
+    crossed = below.any(axis=1)
+    tau = np.where(crossed, x[np.argmax(below, axis=1)] - x[0], (x[-1] - x[0]) / 2)
+    tau = np.where(tau > 0, tau, (x[-1] - x[0]) / 2)
+    return np.column_stack([a, tau, c])
+
+
+def fit_decay_batch(x, Y, p0=None, sigma=None, absolute_sigma=False, max_iter=50, tol=1E-10, full_output=False):
+    """
+    Fit a single exp. decay, a*exp(-t/tau) + c, to every sweep (row of Y) at once.
+
+    Runs a Levenberg-Marquardt iteration vectorised over sweeps, solving the 3x3 normal
+    equations of all sweeps in one call per iteration. Sweeps stop iterating individually
+    once converged. Returns popt and perr arrays of shape (sweeps, 3); sweeps that fail give NaN.
+
+    sigma is the noise standard deviation per sweep (sweeps,) or per sample (sweeps, samples),
+    giving a weighted least squares fit. As for curve_fit, perr is scaled by the residual
+    variance unless absolute_sigma is True. With full_output the goodness of fit of every
+    sweep (see fit_quality), computed from the fitter's final residuals, is returned as well.
+    """
+    x = np.asarray(x, dtype=float)
+    Y = np.atleast_2d(np.asarray(Y, dtype=float))
+    N, n = Y.shape
+    sw = _sqrt_weights(sigma, N, n)
+
+    p = guess_decay(x, Y) if p0 is None else np.broadcast_to(np.asarray(p0, dtype=float), (N, 3)).copy()
+    lam = np.full(N, 1E-3)
+    cost, e, r = _evaluate(x, Y, p, sw)
+    active = np.isfinite(cost)
+
+    for _ in range(max_iter):
+        idx = np.flatnonzero(active)
+        if idx.size == 0:
+            break
+        JTJ, g = _normal_equations(x, p[idx], e[idx], r[idx], _rows(sw, idx))
+
+        # Damped step for every active sweep
+        A = JTJ + lam[idx, None, None] * np.einsum('nii->ni', JTJ)[:, :, None] * np.eye(3)
+        step = _solve(A, g)
+        p_new = p[idx] + step
+        cost_new, e_new, r_new = _evaluate(x, Y[idx], p_new, _rows(sw, idx))
+
+        # Accept improving steps, adapt the damping per sweep
+        better = cost_new < cost[idx]
+        rel = np.abs(cost[idx] - cost_new) / np.maximum(cost[idx], np.finfo(float).tiny)
+        accepted = idx[better]
+        p[accepted] = p_new[better]
+        cost[accepted] = cost_new[better]
+        e[accepted] = e_new[better]
+        r[accepted] = r_new[better]
+        lam[idx] = np.where(better, lam[idx] / 10, lam[idx] * 10)
+
+        # Stop sweeps that have converged or whose damping has blown up
+        done = (rel < tol) | (lam[idx] > 1E10) | ~np.isfinite(step).all(axis=1)
+        active[idx[done]] = False
+
+    # Parameter errors from the final Jacobian
+    JTJ, _ = _normal_equations(x, p, e, r, sw)
+    s_sq = np.ones(N) if absolute_sigma else cost / max(n - 3, 1)
+    perr = np.full((N, 3), np.nan)
+    ok = np.isfinite(JTJ).all(axis=(1, 2)) & (np.abs(np.linalg.det(JTJ)) > 0)
+    if ok.any():
+        cov = np.linalg.inv(JTJ[ok]) * s_sq[ok, None, None]
+        perr[ok] = np.sqrt(np.abs(np.einsum('nii->ni', cov)))
+
+    failed = ~np.isfinite(cost) | ~(p[:, 1] > 0)
+    p[failed] = np.nan
+    perr[failed] = np.nan
+    if full_output:
+        return p, perr, fit_quality(Y, r, cost, 3, sw, failed)
+    return p, perr
+
+
+def fit_quality(Y, r, cost, n_params, sw=None, failed=None):
+    """
+    Goodness of fit of every sweep from the fitted (weighted) residuals r and their sum of squares:
+    residual RMS (unweighted), reduced chi-square (cost / degrees of freedom, ~1 for a good
+    weighted fit), R^2 and the lag-1 autocorrelation of the residuals (near 0 unless the
+    model misses structure in the decay). Returns a dict of (sweeps,) arrays.
+    """
+    n = Y.shape[1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        u = r if sw is None else r / sw
+        ss_res = np.einsum('nk,nk->n', u, u)
+        d = Y - Y.mean(axis=1, keepdims=True)
+        u = u - u.mean(axis=1, keepdims=True)
+        quality = {'rms': np.sqrt(ss_res / n),
+                   'chi2_red': cost / max(n - n_params, 1),
+                   'r2': 1 - ss_res / np.einsum('nk,nk->n', d, d),
+                   'resid_acf1': np.einsum('nk,nk->n', u[:, 1:], u[:, :-1]) / np.einsum('nk,nk->n', u, u)}
+    if failed is not None:
+        for value in quality.values():
+            value[failed] = np.nan
+    return quality
+
+
+def _sqrt_weights(sigma, N, n):
+    """Square root of the least squares weights, 1/sigma, as a (sweeps, samples) array (or None)."""
+    if sigma is None:
+        return None
+    sigma = np.asarray(sigma, dtype=float)
+    if sigma.ndim == 1:
+        sigma = sigma[:, None]
+    return np.broadcast_to(1 / sigma, (N, n))
+
+
+def _rows(sw, idx):
+    return None if sw is None else sw[idx]
+
+
+def _evaluate(x, Y, p, sw=None):
+    """Sum of squared (weighted) residuals, exp(-t/tau) and (weighted) residuals for every sweep."""
+    with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+        e = np.exp(-x[None, :] / p[:, 1, None])
+        r = Y - (p[:, 0, None] * e + p[:, 2, None])
+        if sw is not None:
+            r *= sw
+        cost = np.einsum('nk,nk->n', r, r)
+    cost[~(p[:, 1] > 0) | ~np.isfinite(cost)] = np.inf
+    return cost, e, r
+
+
+def _normal_equations(x, p, e, r, sw=None):
+    """J^T J and J^T r for the mono-exponential model, built from the cached exp(-t/tau) and residuals."""
+    n = e.shape[1]
+    with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+        # Jacobian columns: d/da = e, d/dtau = a*t*e/tau^2, d/dc = 1 (each times the sqrt weights)
+        d_tau = (p[:, 0] / p[:, 1] ** 2)[:, None] * (x[None, :] * e)
+        if sw is not None:
+            e = e * sw
+            d_tau = d_tau * sw
+        JTJ = np.empty((len(p), 3, 3))
+        JTJ[:, 0, 0] = np.einsum('nk,nk->n', e, e)
+        JTJ[:, 0, 1] = JTJ[:, 1, 0] = np.einsum('nk,nk->n', e, d_tau)
+        JTJ[:, 1, 1] = np.einsum('nk,nk->n', d_tau, d_tau)
+        if sw is None:
+            JTJ[:, 0, 2] = JTJ[:, 2, 0] = e.sum(axis=1)
+            JTJ[:, 1, 2] = JTJ[:, 2, 1] = d_tau.sum(axis=1)
+            JTJ[:, 2, 2] = n
+            g_c = r.sum(axis=1)
+        else:
+            JTJ[:, 0, 2] = JTJ[:, 2, 0] = np.einsum('nk,nk->n', e, sw)
+            JTJ[:, 1, 2] = JTJ[:, 2, 1] = np.einsum('nk,nk->n', d_tau, sw)
+            JTJ[:, 2, 2] = np.einsum('nk,nk->n', sw, sw)
+            g_c = np.einsum('nk,nk->n', sw, r)
+        g = np.column_stack([np.einsum('nk,nk->n', e, r), np.einsum('nk,nk->n', d_tau, r), g_c])
+    return JTJ, g
+
+
+def _solve(A, b):
+    """Solve the batch of small linear systems A x = b, giving NaN for singular ones."""
+    try:
+        return np.linalg.solve(A, b[:, :, None])[:, :, 0]
+    except np.linalg.LinAlgError:
+        return np.stack([_solve_or_nan(a, v) for a, v in zip(A, b)])
+
+
+def _solve_or_nan(A, b):
+    try:
+        return np.linalg.solve(A, b)
+    except np.linalg.LinAlgError:
+        return np.full_like(b, np.nan)
+
+
+class DecayModel:
+    """
+    A decay model that is linear in its amplitudes (and offset) for fixed nonlinear parameters.
+
+    basis(x, theta) returns the (sweeps, samples, linear) matrix of basis functions for the
+    nonlinear parameters theta (sweeps, nonlinear). guess(x, Y) gives starting values of theta.
+    Nonlinear parameters are optimised in log space, so they stay positive.
+    """
+
+    def __init__(self, name, nonlinear, linear, basis, guess, bounds=None):
+        self.name = name
+        self.nonlinear = list(nonlinear)
+        self.linear = list(linear)
+        self.basis = basis
+        self.guess = guess
+        self.bounds = bounds or {}
+
+    @property
+    def params(self):
+        return self.linear[:-1] + self.nonlinear + self.linear[-1:]
+
+    def clip(self, theta):
+        """Clip nonlinear parameters to their bounds."""
+        for j, key in enumerate(self.nonlinear):
+            if key in self.bounds:
+                theta[:, j] = np.clip(theta[:, j], *self.bounds[key])
+        return theta
+
+
+MODELS = {}
+
+
+def register_model(model):
+    """Add a DecayModel to the registry of models available to fit_model_batch."""
+    MODELS[model.name] = model
+    return model
+
+
+def _mono_basis(x, theta):
+    e = np.exp(-x[None, :] / theta[:, 0, None])
+    return np.stack([e, np.ones_like(e)], axis=2)
+
+
+def _biexp_basis(x, theta):
+    e1 = np.exp(-x[None, :] / theta[:, 0, None])
+    e2 = np.exp(-x[None, :] / theta[:, 1, None])
+    return np.stack([e1, e2, np.ones_like(e1)], axis=2)
+
+
+def _stretched_basis(x, theta):
+    t = np.clip(x, 0, None)[None, :]
+    e = np.exp(-(t / theta[:, 0, None]) ** theta[:, 1, None])
+    return np.stack([e, np.ones_like(e)], axis=2)
+
+
+def _mono_guess(x, Y):
+    return guess_decay(x, Y)[:, 1:2]
+
+
+def _biexp_guess(x, Y):
+    tau = guess_decay(x, Y)[:, 1]
+    return np.column_stack([tau / 3, tau * 2])
+
+
+def _stretched_guess(x, Y):
+    tau = guess_decay(x, Y)[:, 1]
+    return np.column_stack([tau, np.full_like(tau, 0.8)])
+
+
+register_model(DecayModel('mono', nonlinear=['tau'], linear=['A', 'c'],
+                          basis=_mono_basis, guess=_mono_guess))
+register_model(DecayModel('biexp', nonlinear=['tau1', 'tau2'], linear=['A1', 'A2', 'c'],
+                          basis=_biexp_basis, guess=_biexp_guess))
+register_model(DecayModel('stretched', nonlinear=['tau', 'beta'], linear=['A', 'c'],
+                          basis=_stretched_basis, guess=_stretched_guess, bounds={'beta': (0.05, 1.0)}))
+
+
+def _project(model, x, Y, theta, sw=None):
+    """Solve the linear amplitudes exactly for fixed nonlinear parameters (variable projection)."""
+    with np.errstate(over='ignore', invalid='ignore', divide='ignore', under='ignore'):
+        Phi = model.basis(x, theta)
+        if sw is not None:
+            Phi = Phi * sw[:, :, None]
+            Y = Y * sw
+        PhiT = Phi.transpose(0, 2, 1)
+        lin = _solve(PhiT @ Phi, (PhiT @ Y[:, :, None])[:, :, 0])
+        r = Y - (Phi @ lin[:, :, None])[:, :, 0]
+        cost = np.einsum('nk,nk->n', r, r)
+    cost[~np.isfinite(cost)] = np.inf
+    return cost, r, lin
+
+
+def fit_model_batch(x, Y, model='mono', theta0=None, sigma=None, absolute_sigma=False, max_iter=100,
+                    tol=1E-10, h=1E-6, full_output=False):
+    """
+    Fit a registered decay model to every sweep (row of Y) at once by variable projection.
+
+    For any trial value of the nonlinear parameters (lifetimes, stretching exponent) the
+    amplitudes and offset are solved exactly by linear least squares, so Levenberg-Marquardt
+    only searches over one or two nonlinear parameters per sweep, vectorised over sweeps.
+    Returns popt and perr arrays of shape (sweeps, params) in the order of MODELS[model].params.
+    sigma, absolute_sigma and full_output are as for fit_decay_batch.
+    """
+    model = MODELS[model] if isinstance(model, str) else model
+    x = np.asarray(x, dtype=float)
+    Y = np.atleast_2d(np.asarray(Y, dtype=float))
+    N, n = Y.shape
+    q = len(model.nonlinear)
+    sw = _sqrt_weights(sigma, N, n)
+
+    theta = model.guess(x, Y) if theta0 is None else np.broadcast_to(theta0, (N, q)).astype(float)
+    u = np.log(model.clip(theta.copy()))
+    lam = np.full(N, 1E-3)
+    cost, r, _ = _project(model, x, Y, np.exp(u), sw)
+    active = np.isfinite(cost)
+
+    for _ in range(max_iter):
+        idx = np.flatnonzero(active)
+        if idx.size == 0:
+            break
+
+        # Finite difference Jacobian of the projected residual w.r.t. the log parameters
+        J = np.empty((idx.size, n, q))
+        for j in range(q):
+            u_h = u[idx].copy()
+            u_h[:, j] += h
+            _, r_h, _ = _project(model, x, Y[idx], model.clip(np.exp(u_h)), _rows(sw, idx))
+            J[:, :, j] = -(r_h - r[idx]) / h
+        JT = J.transpose(0, 2, 1)
+        JTJ = JT @ J
+        g = (JT @ r[idx][:, :, None])[:, :, 0]
+
+        A = JTJ + lam[idx, None, None] * (np.einsum('nii->ni', JTJ)[:, :, None] * np.eye(q) + 1E-12 * np.eye(q))
+        step = _solve(A, g)
+        with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+            u_new = np.log(model.clip(np.exp(u[idx] + step)))
+        cost_new, r_new, _ = _project(model, x, Y[idx], np.exp(u_new), _rows(sw, idx))
+
+        better = cost_new < cost[idx]
+        rel = np.abs(cost[idx] - cost_new) / np.maximum(cost[idx], np.finfo(float).tiny)
+        accepted = idx[better]
+        u[accepted] = u_new[better]
+        cost[accepted] = cost_new[better]
+        r[accepted] = r_new[better]
+        lam[idx] = np.where(better, lam[idx] / 10, lam[idx] * 10)
+
+        done = (rel < tol) | (lam[idx] > 1E10) | ~np.isfinite(step).all(axis=1)
+        active[idx[done]] = False
+
+    theta = np.exp(u)
+    _, _, lin = _project(model, x, Y, theta, sw)
+    popt = np.column_stack([lin[:, :-1], theta, lin[:, -1:]])
+    s_sq = np.ones(N) if absolute_sigma else cost / max(n - len(model.params), 1)
+    perr = _model_errors(model, x, theta, lin, s_sq, h, sw)
+
+    failed = ~np.isfinite(cost) | ~np.isfinite(popt).all(axis=1)
+    popt[failed] = np.nan
+    perr[failed] = np.nan
+    if full_output:
+        return popt, perr, fit_quality(Y, r, cost, len(model.params), sw, failed)
+    return popt, perr
+
+
+def model_fn(model, x, popt):
+    """Evaluate a registered model for each row of popt (ordered as MODELS[model].params)."""
+    model = MODELS[model] if isinstance(model, str) else model
+    popt = np.atleast_2d(popt)
+    m = len(model.linear)
+    q = len(model.nonlinear)
+    theta = popt[:, m - 1:m - 1 + q]
+    lin = np.column_stack([popt[:, :m - 1], popt[:, -1:]])
+    return np.einsum('nki,ni->nk', model.basis(np.asarray(x, dtype=float), theta), lin)
+
+
+def _model_errors(model, x, theta, lin, s_sq, h, sw=None):
+    """Standard errors of all parameters from the full Jacobian, scaled by the residual variance s_sq."""
+    N, q = theta.shape
+    m = lin.shape[1]
+    n = len(x)
+    with np.errstate(over='ignore', invalid='ignore', divide='ignore', under='ignore'):
+        Phi = model.basis(x, theta)
+        f = np.einsum('nki,ni->nk', Phi, lin)
+        J = np.empty((N, n, m + q))
+        J[:, :, :m - 1] = Phi[:, :, :m - 1]
+        for j in range(q):
+            theta_h = theta.copy()
+            dt = h * np.abs(theta[:, j]) + h
+            theta_h[:, j] += dt
+            J[:, :, m - 1 + j] = (np.einsum('nki,ni->nk', model.basis(x, theta_h), lin) - f) / dt[:, None]
+        J[:, :, -1] = Phi[:, :, -1]
+        if sw is not None:
+            J *= sw[:, :, None]
+        JTJ = J.transpose(0, 2, 1) @ J
+    perr = np.full((N, m + q), np.nan)
+    ok = np.isfinite(JTJ).all(axis=(1, 2)) & (np.abs(np.linalg.det(JTJ)) > 0)
+    if ok.any():
+        cov = np.linalg.inv(JTJ[ok]) * s_sq[ok, None, None]
+        perr[ok] = np.sqrt(np.abs(np.einsum('nii->ni', cov)))
+    return perr
+
+
+def residual_block_length(R):
+    """
+    Block length for resampling residuals R (sweeps, samples): twice the lag at which their
+    mean autocorrelation first drops below 1/e, so correlated noise is kept within blocks.
+    """
+    R = np.atleast_2d(R)
+    n = R.shape[1]
+    R = R - R.mean(axis=1, keepdims=True)
+    F = np.fft.rfft(R, n=2 * n, axis=1)
+    acf = np.fft.irfft(F * np.conj(F), axis=1)[:, :n].mean(axis=0)
+    if not acf[0] > 0:
+        return 1
+    below = np.flatnonzero(acf / acf[0] < 1 / np.e)
+    return int(max(1, 2 * (below[0] if below.size else n // 10)))
+
+
+# Arrays of the resampled decays' shape held at once by a bootstrap group: the resample indices
+# and decays, and in the batch fitter the residuals, model, Jacobian columns and trial step
+BOOT_ARRAYS = 10
+
+
+def bootstrap_model_batch(x, Y, popt=None, model='mono', n_boot=200, block=None, ci=0.95,
+                          seed=None, max_bytes=1E8):
+    """
+    Residual bootstrap confidence intervals for every sweep (row of Y).
+
+    Each sweep's fit residuals are resampled in blocks (moving block bootstrap, so correlated
+    noise is preserved) and added back onto the fitted decay, giving n_boot resampled decays
+    per sweep that are refitted in one batch starting from the original fit. Sweeps are
+    bootstrapped in groups whose working arrays (BOOT_ARRAYS times the resampled decays, see
+    below) take at most max_bytes, per worker when run by Analysis.analyse_files.
+    Returns (lo, hi, std) arrays of shape (sweeps, params), params ordered as MODELS[model].params.
+    """
+    model_obj = MODELS[model] if isinstance(model, str) else model
+    x = np.asarray(x, dtype=float)
+    Y = np.atleast_2d(np.asarray(Y, dtype=float))
+    N, n = Y.shape
+    P = len(model_obj.params)
+    rng = np.random.default_rng(seed)
+
+    if popt is None:
+        popt = fit_decay_batch(x, Y)[0] if model_obj.name == 'mono' else fit_model_batch(x, Y, model_obj)[0]
+    f = model_fn(model_obj, x, popt)
+    R = Y - f
+    if block is None:
+        block = residual_block_length(R[np.isfinite(R).all(axis=1)])
+    block = int(min(max(block, 1), n))
+    n_blocks = -(-n // block)
+
+    lo = np.full((N, P), np.nan)
+    hi = np.full((N, P), np.nan)
+    std = np.full((N, P), np.nan)
+    q = [(1 - ci) / 2 * 100, (1 + ci) / 2 * 100]
+
+    # Process sweeps in groups so that the working arrays stay within max_bytes
+    group = max(1, int(max_bytes // (BOOT_ARRAYS * 8 * n_boot * n)))
+    for g in range(0, N, group):
+        s = np.arange(g, min(g + group, N))
+        s = s[np.isfinite(popt[s]).all(axis=1)]
+        if s.size == 0:
+            continue
+
+        # Random block starts -> sample indices, (sweeps, n_boot, n)
+        starts = rng.integers(0, n - block + 1, size=(s.size, n_boot, n_blocks))
+        idx = (starts[:, :, :, None] + np.arange(block)).reshape(s.size, n_boot, -1)[:, :, :n]
+        Y_boot = f[s, None, :] + np.take_along_axis(R[s, None, :], idx, axis=2)
+
+        # Refit all resampled decays at once, starting from the original fit
+        p0 = np.repeat(popt[s], n_boot, axis=0)
+        Y_boot = Y_boot.reshape(-1, n)
+        if model_obj.name == 'mono':
+            p_boot = fit_decay_batch(x, Y_boot, p0=p0)[0]
+        else:
+            m = len(model_obj.linear)
+            theta0 = p0[:, m - 1:m - 1 + len(model_obj.nonlinear)]
+            p_boot = fit_model_batch(x, Y_boot, model_obj, theta0=theta0)[0]
+        p_boot = p_boot.reshape(s.size, n_boot, P)
+
+        with np.errstate(invalid='ignore'):
+            lo[s], hi[s] = np.nanpercentile(p_boot, q, axis=1)
+            std[s] = np.nanstd(p_boot, axis=1, ddof=1)
+    return lo, hi, std
+
+
+def fast_decay(x, Y, c=None):
+    """
+    Rapid lifetime determination: tau from the ratio of the signal integrated over two
+    consecutive equal gates, tau = dt / ln(D0 / D1), vectorised over sweeps (rows of Y).
+
+    The gate width is set from the 1/e crossing (about 2.5 tau, the low noise optimum) and
+    the baseline c is the tail mean unless given (e.g. c=0 after background subtraction; NaN
+    entries are still estimated). Returns popt (sweeps, 3) as (A, tau, c), with no nonlinear fitting.
+    """
+    x = np.asarray(x, dtype=float)
+    Y = np.atleast_2d(np.asarray(Y, dtype=float))
+    N, n = Y.shape
+    guess = guess_decay(x, Y)
+    if c is None:
+        c = guess[:, 2]
+    else:
+        c = np.broadcast_to(np.asarray(c, dtype=float), (N,))
+        c = np.where(np.isnan(c), guess[:, 2], c)
+    dx = np.mean(np.diff(x))
+
+    # Gate width in samples, limited to half the window
+    gate = np.clip(np.round(2.5 * guess[:, 1] / dx), 1, n // 2).astype(int)
+    S = np.concatenate([np.zeros((N, 1)), np.cumsum(Y - c[:, None], axis=1)], axis=1) * dx
+    rows = np.arange(N)
+    D0 = S[rows, gate]
+    D1 = S[rows, 2 * gate] - D0
+    width = gate * dx
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tau = width / np.log(D0 / D1)
+        A = D0 / (tau * (1 - np.exp(-width / tau)))
+    tau = np.where(tau > 0, tau, np.nan)
+    return np.column_stack([A, tau, c])
+
+
+def prescreen(x, Y, limits=None, noise=None, min_snr=3.0, fit_snr=0.0, clip_fraction=0.01,
+              rise_tolerance=5.0, blocks=32):
+    """
+    Vectorised quality gate run before fitting a batch of sweeps (rows of Y over the fit window x).
+
+    Checks for non-finite data, clipping at the channel limits (or, without limits, samples stuck
+    at the sweep's own max/min), signal-to-noise ratio, a significant rise in the block-averaged
+    decay (missed trigger, pump pulse in the window) and the 1/e crossing inside the window.
+    Returns (route, reason): route is 'fit', 'fast' (SNR below fit_snr, use fast_decay) or
+    'reject', and reason says why a sweep was rejected ('' otherwise).
+    """
+    Y = np.atleast_2d(np.asarray(Y, dtype=float))
+    N, n = Y.shape
+    reason = np.full(N, '', dtype=object)
+
+    def flag(mask, why):
+        reason[mask & (reason == '')] = why
+
+    finite = np.isfinite(Y).all(axis=1)
+    flag(~finite, 'non-finite data')
+    Y = np.where(np.isfinite(Y), Y, 0.0)
+
+    # Clipping at the channel range, or samples stuck at the extremes of the sweep
+    if limits is not None:
+        lo, hi = (np.broadcast_to(np.asarray(v, dtype=float), (N,))[:, None] for v in limits)
+        eps = 1E-3 * (hi - lo)
+        clipped = np.mean((Y <= lo + eps) | (Y >= hi - eps), axis=1)
+    else:
+        clipped = np.maximum(np.mean(Y == Y.max(axis=1, keepdims=True), axis=1),
+                             np.mean(Y == Y.min(axis=1, keepdims=True), axis=1))
+        clipped = np.where(clipped * n > 2, clipped, 0)
+    flag(clipped >= clip_fraction, 'clipped')
+
+    # Signal to noise ratio of the decay amplitude
+    guess = guess_decay(x, Y)
+    sigma = noise_std(Y) if noise is None else np.asarray(noise, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        snr = np.abs(guess[:, 0]) / sigma
+    flag(~(snr >= min_snr), 'low snr')
+
+    # The decay should not rise significantly between block averages (decay sign taken from A)
+    size = max(n // blocks, 1)
+    means = Y[:, :size * (n // size)].reshape(N, -1, size).mean(axis=2)
+    rise = np.diff(means, axis=1) * np.sign(guess[:, 0])[:, None]
+    flag((rise > rise_tolerance * sigma[:, None] * np.sqrt(2 / size)).any(axis=1), 'not monotonic')
+
+    # The decay must reach 1/e of its amplitude within the window
+    with np.errstate(divide='ignore', invalid='ignore'):
+        below = (means - guess[:, 2, None]) / guess[:, 0, None] <= 1 / np.e
+    flag(~below.any(axis=1), 'no 1/e crossing')
+
+    route = np.where(reason != '', 'reject', np.where(snr < fit_snr, 'fast', 'fit')).astype(object)
+    return route, reason
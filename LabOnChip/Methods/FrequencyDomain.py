@@ -0,0 +1,83 @@
+import numpy as np
+
+
+def fourier_coefficients(Y, fs, period, n_harmonics=5):
+    """
+    Complex Fourier coefficients c_n = <y exp(-i 2 pi n t / period)> of each sweep (row of Y)
+    at the harmonics n = 0..n_harmonics of a periodic excitation, over the whole periods in the capture.
+
+    fs is the sample interval (s) and period the excitation period (s), t = 0 at the first sample.
+    When a period is a whole number of samples the periods are averaged (folded) first and a
+    single rfft of the folded period gives every harmonic; otherwise the coefficients are
+    projected onto the harmonics with one matrix product. Returns (sweeps, n_harmonics + 1).
+    """
+    Y = np.atleast_2d(np.asarray(Y, dtype=float))
+    N, n = Y.shape
+    samples = period / fs
+    periods = int(np.floor(n / samples + 1E-9))
+    if periods < 1:
+        raise ValueError("A capture of {} samples is shorter than one period ({:.1f} samples)".format(n, samples))
+
+    P = int(round(samples))
+    if abs(samples - P) < 1E-6 * samples and P > 2 * n_harmonics:
+        folded = Y[:, :periods * P].reshape(N, periods, P).mean(axis=1)
+        return np.fft.rfft(folded, axis=1)[:, :n_harmonics + 1] / P
+
+    K = int(round(periods * samples))
+    t = np.arange(K) * fs
+    w = 2 * np.pi * np.arange(n_harmonics + 1) / period
+    basis = np.exp(-1j * np.outer(t, w)) / K
+    return Y[:, :K] @ basis
+
+
+def pulse_train_spectrum(period, width, n_harmonics=5, delay=0.0):
+    """
+    Normalised spectrum, E_n / E_0, of a rectangular pulse train (e.g. ITC4001.set_qcw) of the
+    given period and pulse width (s), whose pulses start `delay` s after the first sample.
+    """
+    w = 2 * np.pi * np.arange(n_harmonics + 1) / period
+    return np.exp(-1j * w * (delay + width / 2)) * np.sinc(w * width / (2 * np.pi))
+
+
+def lifetime_from_harmonics(C, E, period):
+    """
+    Lifetimes from the transfer function H_n = (C_n / C_0) / (E_n / E_0) of a single exponential
+    decay, H = 1 / (1 + i w tau): tau from the phase lag, tan(phi) = w tau, and from the
+    modulation, |H| = 1 / sqrt(1 + (w tau)^2), at every harmonic n >= 1.
+
+    C are the Fourier coefficients of the signal (sweeps, harmonics), E those of the excitation,
+    (harmonics,) or per sweep. Returns (tau_phase, tau_mod) in ms, (sweeps, harmonics - 1); NaN
+    where the excitation has no power at a harmonic.
+    """
+    C = np.atleast_2d(C)
+    E = np.broadcast_to(E, C.shape)
+    w = 2 * np.pi * np.arange(1, C.shape[1]) / period
+    with np.errstate(divide='ignore', invalid='ignore'):
+        E_n = E[:, 1:] / E[:, :1]
+        E_n = np.where(np.abs(E_n) > 1E-6, E_n, np.nan)
+        H = (C[:, 1:] / C[:, :1]) / E_n
+        tau_phase = -H.imag / (w * H.real)
+        tau_mod = np.sqrt(1 / np.abs(H) ** 2 - 1) / w
+    return tau_phase * 1E3, tau_mod * 1E3
+
+
+def phase_lifetime(Y, fs, period, width=None, delay=0.0, reference=None, n_harmonics=3, background=0.0):
+    """
+    Lifetime of sweeps (rows of Y) captured under periodic (QCW) excitation, from the phase and
+    modulation of the fundamental and harmonics, without any nonlinear fitting.
+
+    The excitation is either a rectangular pulse train (period, width and the delay of the first
+    pulse after the first sample, all in s) or a reference signal recorded with the sweeps (e.g.
+    the drive on scope channel B), one row or one row per sweep. The phase lifetime does not
+    depend on a constant offset; the modulation lifetime needs the background (V) removed.
+    Returns (tau_phase, tau_mod) in ms, one column per harmonic 1..n_harmonics.
+    """
+    C = fourier_coefficients(np.asarray(Y, dtype=float) - background, fs, period, n_harmonics)
+    if reference is not None:
+        E = fourier_coefficients(reference, fs, period, n_harmonics)
+    elif width is not None:
+        E = pulse_train_spectrum(period, width, n_harmonics, delay=delay)
+    else:
+        raise ValueError("Give the pulse width or a reference signal of the excitation")
+    return lifetime_from_harmonics(C, E, period)
+
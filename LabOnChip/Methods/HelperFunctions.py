@@ -4,63 +4,60 @@ import os
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-import photonics.photodiode as fl
 from tqdm import tqdm
 
+from labonchip.Methods.Accumulator import ResultsAccumulator
+from labonchip.Methods.Analysis import BACKGROUND_KEYS, analyse_ensemble, analyse_files, background_index, decay_window, \
+    detect_window, fit_file, load_background
+from labonchip.Methods.Environment import attach_environment, load_environment
+from labonchip.Methods.Fitting import fit_decay_batch
+from labonchip.Methods.Statistics import StreamingStats, stability_analysis
 
-def analysis(file, pump=0.0, reject_start=0.0, reject_end=0.0):
-    # Load HDF file
-    store = pd.HDFStore(file)
-    df_file = store['log']
-
-    # Create time axis in ms
-    fs = store['log']['fs'][0]
-    samples = store['log']['sample_no'][0]
-    x = np.arange(samples) * fs * 1E3
-
-    # Load fitting data
-    y = np.array(store['data'])
-
-    # Close hdf5 file
-    store.close()
-
-    # Shift time axis to account for the pump and lamp delay. I.e. decay starts at t=0
-    x = fl.shift_time(x, dt=pump)
-
-    # Reject data while pump is on
-    x, y = fl.reject_time(x, y, reject_start=reject_start, reject_end=reject_end)
 
-    # Fit a single exp. decay function
-    popt, perr = fl.fit_decay(x, y, p0=[max(y), 10, min(y)], print_out=False)
-
-    # Append lifetime to individual measurement dataframe
-    df_file['A'] = popt[0]
-    df_file['tau'] = popt[1]
-    df_file['c'] = popt[2]
-
-    df_file['A_err'] = perr[0]
-    df_file['tau_err'] = perr[1]
-    df_file['c_err'] = perr[2]
-
-    return df_file
+def analysis(file, pump=0.0, reject_start=0.0, reject_end=0.0, window=None):
+    """
+    Fit a single exp. decay to one sweep file and return its log dataframe with the fit appended.
+    Pass the run's window from Analysis.decay_window when fitting many files of the same run.
+    """
+    return fit_file(file, pump=pump, reject_start=reject_start, reject_end=reject_end, window=window)
 
 
-def folder_analysis(folder, savename='analysis'):
-    """Use single thread to analyse data (h5) files inside: folder/raw"""
+def folder_analysis(folder, savename='analysis', backend='process', workers=None, chunksize=None,
+                    pump=0.0, reject_start=0.4, **options):
+    """
+    Analyse data (h5) files inside: folder/raw
+
+    The run's laser-off background (folder/background.h5, see record_background) is subtracted when present,
+    and its environmental time series (folder/environment.csv) is interpolated onto the sweeps.
+    backend selects 'serial', 'thread' or 'process' workers and options are passed on as analysis
+    settings (see Analysis.SETTINGS), e.g. reject_end, model='biexp' or bootstrap=200.
+    Pass pump='auto' and/or reject_start='auto' to detect the end of the pump and the start of the
+    clean decay from the data (see Analysis.detect_window).
+    For captures spanning whole QCW periods, pass harmonics=n to add the phase and modulation
+    lifetimes of the first n harmonics (see Analysis.qcw_lifetimes; the log needs the period and pulse_width).
+    Files that fail to fit are kept as rows with NaN fit values and an 'error' message.
+    """
     # Get raw data files list
     directory = "../Data/" + str(folder)
     files = gb.glob(directory + "/raw/*.h5")
 
-    df = pd.DataFrame([])
+    # Subtract the laser-off background if one was recorded with the run
+    if os.path.exists(directory + "/background.h5"):
+        options.setdefault('background', directory + "/background.h5")
 
-    # Do fitting
-    for file in tqdm(files):
-        data = analysis(file, reject_start=0.4)
-        df = df.append(data)
+    # Do fitting, collecting results into columnar chunks (sorted by datetime once at the end)
+    results = ResultsAccumulator(sort_by='datetime')
+    for data in analyse_files(files, backend=backend, workers=workers, chunksize=chunksize,
+                              pump=pump, reject_start=reject_start, **options):
+        results.append(data)
+    df = results.to_frame()
 
-    # Sort rows in measurement dataframe by datetime
-    df = df.set_index('datetime').sort_index()
-    df = df.reset_index()
+    if 'error' in df.columns:
+        print("{} of {} files failed to fit".format(df['error'].notnull().sum(), len(files)))
+
+    # Join the run's environmental time series to the sweeps by time
+    if os.path.exists(directory + "/environment.csv") and 'datetime' in df.columns:
+        df = attach_environment(df, load_environment(directory + "/environment.csv"))
 
     # Save dataframe
     df.to_csv(directory + "/" + savename + ".csv")
@@ -72,38 +69,37 @@ def folder_analysis(folder, savename='analysis'):
     return df
 
 
-def folder_analysis_pool(folder):
-    """Use multiprocessing to analysise raw files inside the timestamp folder"""
-    from multiprocessing import Pool
-
+def folder_ensemble_analysis(folder, k=None, step=None, snr=None, savename='analysis_ensemble',
+                             pump=0.0, reject_start=0.4, **options):
+    """
+    Average K consecutive sweeps inside: folder/raw and fit each averaged decay.
+    Use step < k for sliding windows, or snr instead of k to average up to that signal-to-noise ratio.
+    """
     # Get raw data files list
     directory = "../Data/" + str(folder)
-    files = gb.glob( directory + "/raw/*.h5")
-
-    # Do fitting
-    pool = Pool()
-    results = pool.map(analysis, files)
-    # close the pool and wait for the work to finish
-    pool.close()
-    pool.join()
-
-    # merging parts processed by different processes
-    df = pd.concat(results, axis=0)
+    files = gb.glob(directory + "/raw/*.h5")
+    if os.path.exists(directory + "/background.h5"):
+        options.setdefault('background', directory + "/background.h5")
 
-    # Sort rows in measurement dataframe by datetime
-    df = df.set_index('datetime').sort_index()
-    df = df.reset_index()
+    df = analyse_ensemble(files, k=k, step=step, snr=snr, pump=pump, reject_start=reject_start, **options)
+    if os.path.exists(directory + "/environment.csv") and 'datetime' in df.columns:
+        df = attach_environment(df, load_environment(directory + "/environment.csv"))
 
     # Save dataframe
-    df.to_csv(directory + "/analysis.csv")
+    df.to_csv(directory + "/" + savename + ".csv")
 
-    store = pd.HDFStore(directory + "/analysis.h5")
+    store = pd.HDFStore(directory + "/" + savename + ".h5")
     store['df'] = df  # save it
     store.close()
 
     return df
 
 
+def folder_analysis_pool(folder):
+    """Use multiprocessing to analysise raw files inside the timestamp folder"""
+    return folder_analysis(folder, backend='process', reject_start=0.0)
+
+
 def plot_analysis(folder, dir='../Data/', save=True, hist=False):
     # Load HDF file
     df = pd.HDFStore(dir + str(folder) + '/analysis.h5')['df']
@@ -134,6 +130,28 @@ def plot_analysis(folder, dir='../Data/', save=True, hist=False):
     plt.show()
 
 
+def plot_stability(folder, dir='../Data/', columns=('tau', 'A'), save=True):
+    """Plot the Allan and modified Allan deviation of the per-sweep results in folder/analysis.h5"""
+    df = pd.HDFStore(dir + str(folder) + '/analysis.h5')['df']
+    deviations, drifts = stability_analysis(df, columns=columns)
+    print(drifts)
+
+    fig, axes = plt.subplots(len(columns), 1, sharex=True, squeeze=False)
+    for ax, (column, group) in zip(axes[:, 0], deviations.groupby('column', sort=False)):
+        ax.loglog(group['tau'], group['adev'], 'o-', label='Allan deviation')
+        ax.loglog(group['tau'], group['mdev'], 's-', label='Modified Allan deviation')
+        ax.set_ylabel(column)
+        ax.grid(True, which="both")
+    axes[0, 0].legend(loc='best')
+    axes[-1, 0].set_xlabel('Averaging time (s)')
+    plt.tight_layout()
+    if save:
+        plt.savefig(dir + str(folder) + '/stability')
+        deviations.to_csv(dir + str(folder) + '/stability.csv')
+    plt.show()
+    return deviations, drifts
+
+
 def dilution(conc_out, conc_stock, vol_out=1):
     # Volume of stock required
     vol_stock = vol_out * conc_out / conc_stock
@@ -142,8 +160,26 @@ def dilution(conc_out, conc_stock, vol_out=1):
     return vol_dilute, vol_stock
 
 
-def sweeps_number(sweeps, log, scope, laserDriver, dataf='../Data/', arduino=None, thermocouple=True):
-    """Measure and save single sweeps for a given number of sweeps."""
+def save_sweep(directory, log, data):
+    """Save a single sweep and its log as directory/raw/<timestamp>.h5."""
+    storeRaw = pd.HDFStore(directory + "/raw/" + str(log['datetime'].timestamp()) + ".h5")
+    storeRaw.put('log/', pd.DataFrame(log, index=[0]))
+    storeRaw.put('data/', pd.Series(data))
+    storeRaw.close()
+
+
+def sweeps_number(sweeps, log, scope, laserDriver, dataf='../Data/', arduino=None, thermocouple=True, tracker=None,
+                  environment=None):
+    """
+    Measure and save single sweeps for a given number of sweeps.
+    Pass a Statistics.GroupedRollingStats as tracker to fit every sweep as it arrives and keep
+    live rolling lifetime statistics per setpoint. The live fits use the decay window of the
+    offline analysis: the log's pump, reject_start and reject_end (ms, defaults as folder_analysis),
+    'auto' being detected on the first sweep.
+    Pass the run's running Environment.EnvironmentLogger as environment to leave the sensors and
+    the laser's optical power to it: the sweep loop then only captures, and analysis joins
+    the readings to the sweeps by time.
+    """
     import time
     from datetime import datetime
 
@@ -155,26 +191,50 @@ def sweeps_number(sweeps, log, scope, laserDriver, dataf='../Data/', arduino=Non
     # array to store total data
     d = np.zeros(log['sample_no'])
 
+    # Create time axis in ms
+    fs = log['fs']
+    samples = log['sample_no']
+    x = np.arange(samples) * fs * 1E3
+    window = dict(pump=log.get('pump', 0.0), reject_start=log.get('reject_start', 0.4),
+                  reject_end=log.get('reject_end', 0.0))
+    keep = None
+
+    # Channel range and resolution set the quantisation noise floor used by weighted fits,
+    # range and offset the clipping limits checked by the prescreen
+    if hasattr(scope, 'v_range'):
+        log['v_range'] = scope.v_range
+        log['bit_res'] = scope.bit_res
+        log['v_offset'] = getattr(scope, 'v_offset', 0.0)
+
+    # Sensors are read by the arduino's background reader, the sweep loop only copies its latest values
+    sensors = ['tempC', 'humidity'] + (['t_in', 't_out'] if thermocouple else [])
+    if environment is not None:
+        arduino = None
+    elif arduino is not None:
+        arduino.start()
+
+    # Optical power is sampled by the laser driver's monitor thread, if it has one
+    monitor = environment is None and hasattr(laserDriver, 'start_monitor')
+    if monitor:
+        laserDriver.start_monitor()
+
     # Collect and save data for each sweep
     log['sweeps'] = sweeps
-    start = time.time()
     for i in tqdm(range(sweeps)):
         time.sleep(np.random.rand()*(1/60))
         log['sweep_no'] = i + 1
         log['datetime'] = datetime.now()
         # Update laser measured optical power (by internal photodiode)
-        log['optical power'] = laserDriver.get_optical_power()
+        if monitor:
+            log['optical power'] = laserDriver.latest().get('optical power', np.nan)
+        elif environment is None:
+            log['optical power'] = laserDriver.get_optical_power()
         # Update arduino data if passed to function
         if arduino is not None:
-            if time.time() - start > 3:
-                arduino.get_data()
-                log['tempC'] = arduino.tempC
-                log['humidity'] = arduino.humidity
-                if thermocouple:
-                    log['t_in'] = arduino.t_in
-                    log['t_out'] = arduino.t_out
-                arduino.request_data()
-            start = time.time()
+            snapshot = arduino.latest()
+            for key in sensors:
+                if key in snapshot:
+                    log[key] = snapshot[key]
 
         # Collect data from picoscope (detector)
         scope.armMeasure()
@@ -183,16 +243,19 @@ def sweeps_number(sweeps, log, scope, laserDriver, dataf='../Data/', arduino=Non
         # Add to total array
         d += np.array(data)
 
-        # Save individual data sweep as h5 file
-        storeRaw = pd.HDFStore(directory + "/raw/" + str(log['datetime'].timestamp()) + ".h5")
-        storeRaw.put('log/', pd.DataFrame(log, index=[0]))
-        storeRaw.put('data/', pd.Series(data))
-        storeRaw.close()
+        # Quick fit of this sweep for the live rolling statistics
+        if tracker is not None:
+            if keep is None:
+                auto = [key for key in ('pump', 'reject_start') if window[key] == 'auto']
+                if auto:
+                    detected = detect_window(x, data, pump=None if window['pump'] == 'auto' else window['pump'])
+                    window.update({key: detected[key] for key in auto})
+                x_fit, keep = decay_window(fs, samples, **window)
+            popt, _ = fit_decay_batch(x_fit, np.asarray(data)[keep])
+            tracker.update(dict(log, A=popt[0, 0], tau=popt[0, 1]))
 
-    # Create time axis in ms
-    fs = log['fs']
-    samples = log['sample_no']
-    x = np.arange(samples) * fs * 1E3
+        # Save individual data sweep as h5 file
+        save_sweep(directory, log, data)
 
     # Save total data array
     fname = directory + '/Plots/{0:.4f}'.format(log['current'])
@@ -203,6 +266,49 @@ def sweeps_number(sweeps, log, scope, laserDriver, dataf='../Data/', arduino=Non
     ax.plot(x, d)
     fig.savefig(directory + '/Plots/current{0:.4f}.png'.format(log['current']))
 
+    # Rolling lifetime statistics at the end of this setpoint
+    if tracker is not None and tracker.key(log) in tracker.groups:
+        print("Lifetime (ms): {}".format(tracker[tracker.key(log)]['tau'].summary()))
+
+
+def record_background(sweeps, log, scope, dataf='../Data/', keys=BACKGROUND_KEYS):
+    """
+    Capture `sweeps` sweeps with the laser off at the current setpoint (the `keys` entries of log)
+    and store their average in folder/background.h5, one row per setpoint, for analysis to subtract.
+    """
+    from datetime import datetime
+
+    directory = dataf + str(log['measurementID'])
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    # Average the background sweeps as they arrive
+    d = np.zeros(log['sample_no'])
+    stats = StreamingStats()
+    for data in scope.measure_blocks(sweeps):
+        d += np.array(data)
+        stats.update(data)
+    d /= sweeps
+
+    row = {key: log[key] for key in keys if key in log}
+    row.update(measurementID=log['measurementID'], datetime=datetime.now(), n_avg=sweeps,
+               level=stats.mean, noise_std=stats.std)
+
+    # Replace any earlier background of this setpoint
+    fname = directory + '/background.h5'
+    bg_log, B = load_background(fname) if os.path.exists(fname) else (pd.DataFrame([]), np.empty((0, len(d))))
+    if len(bg_log):
+        keep = background_index(bg_log, pd.DataFrame(row, index=[0])) < 0
+        bg_log, B = bg_log[keep], B[keep]
+    bg_log = pd.concat([bg_log, pd.DataFrame(row, index=[0])], ignore_index=True)
+    B = np.vstack([B, d])
+
+    store = pd.HDFStore(fname, mode='w')
+    store.put('log/', bg_log)
+    store.put('data/', pd.DataFrame(B))
+    store.close()
+    return d
+
 
 def sweeps_time(mins, log, arduino, scope, laserDriver, dir='../Data/'):
     """Measure and save single sweeps over a given time."""
@@ -218,6 +324,9 @@ def sweeps_time(mins, log, arduino, scope, laserDriver, dir='../Data/'):
     timeout = time.time() + 60 * mins
     print("Finished at: {end}".format(end=time.asctime(time.localtime(timeout))))
 
+    # Sensors are read by the arduino's background reader
+    arduino.start()
+
     # Begin
     start = time.time()
     sweep = 0
@@ -225,15 +334,10 @@ def sweeps_time(mins, log, arduino, scope, laserDriver, dir='../Data/'):
         sweep += 1
         log['sweep_no'] = sweep
         log['datetime'] = datetime.now()
+        log.update({key: value for key, value in arduino.latest().items() if not key.endswith('_time')})
 
-        # Arduino and laser power update every 3 seconds (delay is 3 seconds due to calling method)
+        # Laser power update every 3 seconds
         if time.time() - start > 3:
-            arduino.get_data()
-            log['t_in'] = arduino.t_in
-            log['t_out'] = arduino.t_out
-            log['tempC'] = arduino.tempC
-            log['humidity'] = arduino.humidity
-            arduino.request_data()
             start = time.time()
             # Update laser measured optical power (by internal photodiode)
             log['optical power'] = laserDriver.get_optical_power()
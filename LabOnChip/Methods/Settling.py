@@ -0,0 +1,169 @@
+import time
+from collections import deque
+
+import numpy as np
+
+from labonchip.Methods.Fitting import fast_decay
+
+
+class SettleDetector:
+    """
+    Decides when a slowly varying reading (laser optical power, mean scope signal, ...) has settled:
+    the last `window` readings must span (max - min) no more than `tolerance` of their mean, or the
+    absolute `floor` when that is larger (readings around zero).
+
+    level='above' additionally requires the mean above the floor (e.g. laser on, not still dark),
+    level='below' requires it at or below the floor (laser off); None accepts any level.
+    """
+
+    def __init__(self, tolerance=0.01, floor=0.0, window=5, level=None):
+        self.tolerance = tolerance
+        self.floor = floor
+        self.level = level
+        self.values = deque(maxlen=window)
+
+    def update(self, value):
+        """Add a reading, returns whether the reading has settled."""
+        self.values.append(float(value))
+        return self.settled
+
+    @property
+    def settled(self):
+        if len(self.values) < self.values.maxlen:
+            return False
+        values = np.array(self.values)
+        if not np.all(np.isfinite(values)):
+            return False
+        mean = values.mean()
+        if self.level == 'above' and mean <= self.floor:
+            return False
+        if self.level == 'below' and abs(mean) > self.floor:
+            return False
+        return bool(np.ptp(values) <= max(self.tolerance * abs(mean), self.floor))
+
+    @property
+    def value(self):
+        return np.mean(self.values) if self.values else np.nan
+
+
+def wait_settled(sources, timeout=10.0, interval=0.1):
+    """
+    Poll every source until all have settled or `timeout` s have passed.
+
+    sources maps a name to (read, detector), read being a callable returning the next reading.
+    Polls are `interval` s apart (less the time taken by the reads, e.g. a scope capture).
+    Returns (settled, elapsed s, {name: mean of the last readings}).
+    """
+    start = time.time()
+    while True:
+        t = time.time()
+        settled = True
+        for read, detector in sources.values():
+            settled &= detector.update(read())
+        elapsed = time.time() - start
+        if settled or elapsed >= timeout:
+            return settled, elapsed, {name: detector.value for name, (read, detector) in sources.items()}
+        time.sleep(max(0.0, interval - (time.time() - t)))
+
+
+def scope_level(scope):
+    """Mean signal (V) of one capture, a reading for wait_settled."""
+    scope.armMeasure()
+    return np.mean(scope.measure())
+
+
+def settle_laser(laserDriver, scope=None, on=True, reference=None, tolerance=0.01, dark=1E-4, window=5, interval=0.1,
+                 timeout=10.0):
+    """
+    Wait after turn_ld_on/turn_ld_off until the laser optical power (and with a scope, when the laser
+    is on, the mean signal of quick captures) has settled to within `tolerance`, or `timeout` s.
+
+    reference is the optical power with the laser on (e.g. of the previous setpoint): with it the
+    power must also read above `tolerance` of it when on, and below when off. Without it a laser
+    turned off has settled once the power reads below `dark` (W, the photodiode's dark reading),
+    as the relative spread of a power decaying to zero never settles. Returns (settled, elapsed s).
+    """
+    if reference:
+        floor, level = tolerance * abs(reference), 'above' if on else 'below'
+    elif not on:
+        floor, level = dark, 'below'
+    else:
+        floor, level = 0.0, None
+    sources = {'optical power': (laserDriver.get_optical_power, SettleDetector(tolerance, floor, window, level=level))}
+    if scope is not None and on:
+        sources['signal'] = (lambda: scope_level(scope), SettleDetector(tolerance, window=window))
+
+    settled, elapsed, values = wait_settled(sources, timeout=timeout, interval=interval)
+    if not settled:
+        print("Laser not settled after {:.1f} s: {}".format(
+            elapsed, ', '.join('{} {:.4g}'.format(name, value) for name, value in values.items())))
+    return settled, elapsed
+
+
+class LifetimeProbe:
+    """
+    Quick lifetime reading for wait_settled/wait_equilibrated: the fast (RLD) lifetime in ms of the
+    mean of `blocks` captures, with no fitting. The decay window (pump and reject_start, ms) is
+    detected on the first reading unless given, then kept.
+    """
+
+    def __init__(self, scope, blocks=5, window=None):
+        self.scope = scope
+        self.blocks = blocks
+        self.window = window
+        self.keep = None
+
+    def __call__(self):
+        from labonchip.Methods.Analysis import decay_window, detect_window
+
+        y = np.mean(list(self.scope.measure_blocks(self.blocks)), axis=0)
+        if self.keep is None:
+            if self.window is None:
+                self.window = detect_window(self.scope.get_time(), y[None, :])
+            self.x, self.keep = decay_window(self.scope.res[0], self.scope.res[1], **self.window)
+        return fast_decay(self.x, y[self.keep][None, :])[0, 1]
+
+
+def wait_equilibrated(read, tolerance=0.02, window=5, threshold=3.0, max_transit=None, max_wait=120.0,
+                      interval=1.0):
+    """
+    After the pump rates change, poll read() (e.g. a LifetimeProbe) until the new mixture has
+    reached the chip and the reading has reached a plateau.
+
+    The first `window` readings are the baseline (the old mixture still on the chip). The mixture
+    has arrived once a reading leaves the baseline by more than `threshold` baseline standard
+    deviations and `tolerance` of its mean; that time is the transit time. From then, or from
+    max_transit s if no change is seen (a step too small to detect), the reading has equilibrated
+    once its last `window` values settle within `tolerance` (see SettleDetector). Gives up after
+    max_wait s. Returns dict(equilibrated, transit_time, equilibration_time, value), times in s
+    (transit_time NaN if no change was seen).
+    """
+    if max_transit is None:
+        max_transit = max_wait
+    detector = SettleDetector(tolerance, window=window)
+    baseline = []
+    transit = np.nan
+    start = time.time()
+    while True:
+        t = time.time()
+        value = read()
+        elapsed = time.time() - start
+        settled = detector.update(value)
+
+        if len(baseline) < window:
+            if np.isfinite(value):
+                baseline.append(value)
+        elif np.isnan(transit) and np.isfinite(value):
+            mean, std = np.mean(baseline), np.std(baseline, ddof=1)
+            if abs(value - mean) > max(threshold * std, tolerance * abs(mean)):
+                transit = elapsed
+                # The plateau is judged on readings of the new mixture only
+                detector.values.clear()
+                detector.update(value)
+                settled = False
+
+        arrived = np.isfinite(transit) or elapsed >= max_transit
+        if (arrived and settled) or elapsed >= max_wait:
+            return dict(equilibrated=bool(arrived and settled), transit_time=transit, equilibration_time=elapsed,
+                        value=detector.value)
+        time.sleep(max(0.0, interval - (time.time() - t)))
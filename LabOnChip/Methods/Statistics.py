@@ -0,0 +1,328 @@
+import bisect
+from collections import deque
+
+import numpy as np
+
+
+class StreamingStats:
+    """
+    Running mean, variance, min/max and histogram of a signal that arrives in chunks.
+
+    Each chunk is reduced with numpy and merged into the running totals with Chan's parallel
+    form of Welford's algorithm, so only the summary is kept however long the capture is.
+    Pass hist_range=(low, high) to also accumulate a histogram with `bins` fixed bins.
+    """
+
+    def __init__(self, bins=100, hist_range=None):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+        self.edges = None
+        self.hist = None
+        if hist_range is not None:
+            self.edges = np.linspace(hist_range[0], hist_range[1], bins + 1)
+            self.hist = np.zeros(bins, dtype=np.int64)
+
+    def update(self, chunk):
+        """Add a chunk of samples."""
+        chunk = np.asarray(chunk, dtype=float).ravel()
+        n = chunk.size
+        if n == 0:
+            return
+
+        # Reduce the chunk, then merge with the running totals
+        mean = chunk.mean()
+        m2 = np.sum((chunk - mean) ** 2)
+        total = self.count + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta ** 2 * self.count * n / total
+        self.count = total
+
+        self.min = min(self.min, chunk.min())
+        self.max = max(self.max, chunk.max())
+        if self.hist is not None:
+            self.hist += np.histogram(chunk, bins=self.edges)[0]
+
+    def merge(self, other):
+        """Merge the totals of another StreamingStats (e.g. from another capture) into this one."""
+        if other.count == 0:
+            return
+        total = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / total
+        self.m2 += other.m2 + delta ** 2 * self.count * other.count / total
+        self.count = total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        if self.hist is not None and other.hist is not None:
+            self.hist += other.hist
+
+    @property
+    def var(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else np.nan
+
+    @property
+    def std(self):
+        return np.sqrt(self.var)
+
+    def summary(self):
+        """Dictionary of the summary statistics."""
+        return {'count': self.count, 'mean': float(self.mean), 'std': float(self.std), 'var': float(self.var),
+                'min': float(self.min), 'max': float(self.max)}
+
+
+def regular_series(datetime, values, tau0=None):
+    """
+    Put an irregularly sampled series onto a regular time grid of spacing tau0 (s).
+
+    tau0 defaults to the median spacing of the datetimes. Samples falling in the same bin are
+    averaged and bins without samples (gaps in the run) are NaN. Returns (y, tau0).
+    """
+    t = np.asarray(datetime, dtype='datetime64[ns]').astype(np.int64) / 1E9
+    values = np.asarray(values, dtype=float)
+    ok = np.isfinite(t) & np.isfinite(values)
+    t, values = t[ok], values[ok]
+    order = np.argsort(t, kind='mergesort')
+    t, values = t[order] - t[order][0], values[order]
+    if tau0 is None:
+        tau0 = np.median(np.diff(t))
+
+    idx = np.floor(t / tau0 + 0.5).astype(np.int64)
+    counts = np.bincount(idx)
+    with np.errstate(invalid='ignore'):
+        y = np.bincount(idx, weights=values) / counts
+    return y, tau0
+
+
+def averaging_factors(N, points=50, max_fraction=1 / 3):
+    """Log spaced averaging factors m from 1 up to max_fraction of the series length."""
+    return np.unique(np.logspace(0, np.log10(max(N * max_fraction, 1)), points).astype(int))
+
+
+def allan_deviation(y, tau0=1.0, m=None):
+    """
+    Overlapping Allan deviation and modified Allan deviation of a regularly sampled series y.
+
+    All window averages for an averaging factor m come from one cumulative sum, so each m
+    costs O(N) and the log spaced set of m costs O(N log N). NaN samples (gaps) are allowed:
+    any difference involving a window with a gap is left out, and the number of terms used
+    is returned. Returns a dict of arrays: tau (s), m, adev, mdev, n_adev, n_mdev.
+    """
+    y = np.asarray(y, dtype=float)
+    N = len(y)
+    m = averaging_factors(N) if m is None else np.asarray(m, dtype=int)
+
+    valid = np.isfinite(y)
+    S = np.concatenate([[0.0], np.cumsum(np.where(valid, y, 0.0))])
+    C = np.concatenate([[0], np.cumsum(valid)])
+
+    adev = np.full(len(m), np.nan)
+    mdev = np.full(len(m), np.nan)
+    n_adev = np.zeros(len(m), dtype=int)
+    n_mdev = np.zeros(len(m), dtype=int)
+    for i, mi in enumerate(m):
+        if 2 * mi >= N:
+            continue
+        # Window averages of mi samples and whether each window is complete
+        avg = (S[mi:] - S[:-mi]) / mi
+        full = (C[mi:] - C[:-mi]) == mi
+
+        # Overlapping Allan variance: differences of adjacent window averages
+        d = avg[mi:] - avg[:-mi]
+        ok = full[mi:] & full[:-mi]
+        n_adev[i] = ok.sum()
+        if n_adev[i]:
+            adev[i] = np.sqrt(0.5 * np.mean(d[ok] ** 2))
+
+        # Modified Allan variance: average mi consecutive differences before squaring
+        if len(d) < mi:
+            continue
+        D = np.concatenate([[0.0], np.cumsum(np.where(ok, d, 0.0))])
+        K = np.concatenate([[0], np.cumsum(ok)])
+        inner = (D[mi:] - D[:-mi]) / mi
+        inner_ok = (K[mi:] - K[:-mi]) == mi
+        n_mdev[i] = inner_ok.sum()
+        if n_mdev[i]:
+            mdev[i] = np.sqrt(0.5 * np.mean(inner[inner_ok] ** 2))
+
+    return {'tau': m * tau0, 'm': m, 'adev': adev, 'mdev': mdev, 'n_adev': n_adev, 'n_mdev': n_mdev}
+
+
+def drift_rate(datetime, values):
+    """Linear drift of a series per hour and its standard error, from a least squares line."""
+    t = np.asarray(datetime, dtype='datetime64[ns]').astype(np.int64) / 3.6E12
+    values = np.asarray(values, dtype=float)
+    ok = np.isfinite(values)
+    t, values = t[ok] - t[ok].min(), values[ok]
+    if len(t) < 3:
+        return np.nan, np.nan
+    (slope, intercept), cov = np.polyfit(t, values, 1, cov=True)
+    return slope, np.sqrt(cov[0, 0])
+
+
+def stability_analysis(df, columns=('tau', 'A'), tau0=None):
+    """
+    Allan/modified Allan deviation and drift of per-sweep results (e.g. analysis.h5) against time.
+
+    Each column is put on a regular grid by its 'datetime' (gaps become NaN) before computing the
+    deviations. Returns (deviations dataframe, drift dataframe), the deviations also given
+    relative to the column mean (fractional).
+    """
+    import pandas as pd
+
+    deviations, drifts = [], []
+    for column in columns:
+        y, step = regular_series(df['datetime'], df[column], tau0=tau0)
+        result = pd.DataFrame(allan_deviation(y, step))
+        result['column'] = column
+        mean = np.nanmean(y)
+        result['adev_frac'] = result['adev'] / mean
+        result['mdev_frac'] = result['mdev'] / mean
+        deviations.append(result)
+
+        slope, slope_err = drift_rate(df['datetime'], df[column])
+        drifts.append({'column': column, 'drift_per_hour': slope, 'drift_per_hour_err': slope_err,
+                       'mean': mean, 'tau0': step})
+    return pd.concat(deviations, ignore_index=True), pd.DataFrame(drifts)
+
+
+class RollingStats:
+    """
+    Rolling mean, std and median over the last `window` values plus an EWMA. The mean, std and
+    EWMA are updated in O(1) per new value; the median keeps a sorted copy of the window, so
+    an update costs O(log window) comparisons plus an O(window) list insert and removal.
+
+    Statistics are NaN until min_periods values (default: window) have arrived. Unlike pandas
+    rolling, NaN values (failed fits) are skipped rather than held in the window: the window is
+    always the last `window` finite values, however many NaNs came in between, and a NaN leaves
+    the statistics unchanged. With keep_history the statistics after every update are kept for
+    plotting (see history), NaN updates included, so the history stays aligned with the sweeps.
+    """
+
+    def __init__(self, window=20, alpha=None, min_periods=None, keep_history=True):
+        self.window = window
+        self.alpha = 2 / (window + 1) if alpha is None else alpha
+        self.min_periods = window if min_periods is None else min_periods
+
+        self.values = deque()
+        self.sorted = []
+        self.mean_ = 0.0
+        self.m2 = 0.0
+        self.ewma = np.nan
+        self.count = 0
+
+        self.keep_history = keep_history
+        self._history = []
+
+    def update(self, value, timestamp=None):
+        """Add a new value (e.g. the tau of the latest sweep)."""
+        if value is None or not np.isfinite(value):
+            # Keep the history aligned with the sweeps, but leave the window unchanged
+            if self.keep_history:
+                self._history.append((timestamp, np.nan, self.mean, self.std, self.median, self.ewma))
+            return
+        value = float(value)
+        self.count += 1
+
+        if len(self.values) == self.window:
+            # Slide the window: replace the oldest value (windowed Welford update)
+            old = self.values.popleft()
+            self.sorted.pop(bisect.bisect_left(self.sorted, old))
+            mean = self.mean_ + (value - old) / self.window
+            self.m2 += (value - old) * (value - mean + old - self.mean_)
+            self.mean_ = mean
+        else:
+            n = len(self.values) + 1
+            delta = value - self.mean_
+            self.mean_ += delta / n
+            self.m2 += delta * (value - self.mean_)
+        self.values.append(value)
+        bisect.insort(self.sorted, value)
+
+        self.ewma = value if np.isnan(self.ewma) else self.ewma + self.alpha * (value - self.ewma)
+
+        if self.keep_history:
+            self._history.append((timestamp, value, self.mean, self.std, self.median, self.ewma))
+
+    @property
+    def ready(self):
+        return len(self.values) >= self.min_periods
+
+    @property
+    def mean(self):
+        return self.mean_ if self.ready else np.nan
+
+    @property
+    def std(self):
+        n = len(self.values)
+        return np.sqrt(max(self.m2, 0.0) / (n - 1)) if self.ready and n > 1 else np.nan
+
+    @property
+    def median(self):
+        if not self.ready:
+            return np.nan
+        n = len(self.sorted)
+        return self.sorted[n // 2] if n % 2 else 0.5 * (self.sorted[n // 2 - 1] + self.sorted[n // 2])
+
+    def summary(self):
+        return {'count': self.count, 'mean': self.mean, 'std': self.std, 'median': self.median, 'ewma': self.ewma}
+
+    def history(self):
+        """Dataframe of the value and statistics after every update."""
+        import pandas as pd
+        return pd.DataFrame(self._history, columns=['datetime', 'value', 'mean', 'std', 'median', 'ewma'])
+
+
+class GroupedRollingStats:
+    """
+    RollingStats for several columns (e.g. tau, A), kept separately for every setpoint,
+    i.e. every combination of the `keys` columns (e.g. current, pulse_width).
+    """
+
+    def __init__(self, keys=('current', 'pulse_width'), columns=('tau', 'A'), window=20, **kwargs):
+        self.keys = list(keys)
+        self.columns = list(columns)
+        self.window = window
+        self.kwargs = kwargs
+        self.groups = {}
+
+    def key(self, row):
+        """Setpoint key of a row of results."""
+        key = tuple(row.get(k) for k in self.keys)
+        return key[0] if len(key) == 1 else key
+
+    def update(self, row):
+        """Add the results of one sweep: a dict (or log row) holding the key and value columns."""
+        key = self.key(row)
+        if key not in self.groups:
+            self.groups[key] = {c: RollingStats(self.window, **self.kwargs) for c in self.columns}
+        for column, stats in self.groups[key].items():
+            if column in row:
+                stats.update(row[column], timestamp=row.get('datetime'))
+
+    def update_frame(self, df):
+        """Add every row of a results dataframe, in order."""
+        for row in df.to_dict('records'):
+            self.update(row)
+
+    def __getitem__(self, key):
+        return self.groups[key]
+
+    def history(self, key, column):
+        return self.groups[key][column].history()
+
+    def summary(self):
+        """Latest statistics of every setpoint and column, one row per setpoint."""
+        import pandas as pd
+        rows = []
+        for key, group in self.groups.items():
+            row = dict(zip(self.keys, key if isinstance(key, tuple) else (key,)))
+            for column, stats in group.items():
+                for name, value in stats.summary().items():
+                    row[column + '_' + name] = value
+            rows.append(row)
+        return pd.DataFrame(rows)
@@ -0,0 +1,27 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from labonchip.Methods.Accumulator import ResultsAccumulator
+
+
+def test_to_frame_sorts_chunks_and_keeps_dtypes():
+    start = datetime(2026, 1, 1)
+    results = ResultsAccumulator(chunk_rows=4)
+    # Results arrive unordered, as from the pool backends, and an error row has no fit values
+    for i in [5, 1, 7, 0, 3, 9, 2, 8, 6]:
+        results.append({'datetime': start + timedelta(seconds=i), 'tau': 1.0 + i, 'model': 'mono'})
+    results.append(pd.DataFrame({'datetime': [start + timedelta(seconds=4)], 'file': ['bad.h5'],
+                                 'error': ['OSError: unreadable']}))
+    assert len(results) == 10
+
+    df = results.to_frame()
+    assert len(results) == 0
+    assert list(df['datetime']) == [start + timedelta(seconds=i) for i in range(10)]
+    assert list(df.index) == list(range(10))
+    assert df['datetime'].dtype.kind == 'M'
+    assert df['tau'].dtype == np.float64
+    assert np.isnan(df['tau'][4]) and df['tau'][5] == 6.0
+    assert df['error'][4] == 'OSError: unreadable'
+    assert df['error'].isna().sum() == 9
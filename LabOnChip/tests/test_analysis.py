@@ -0,0 +1,110 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('photonics')
+
+from labonchip.Methods import Analysis
+from labonchip.Methods.Analysis import analyse_files, analyse_sweeps, analysis_settings, decay_window, \
+    detect_window
+from labonchip.Methods.Devices.Simulated import SimulatedPS5000a
+from labonchip.Methods.Fitting import fit_decay_batch
+from labonchip.Methods.HelperFunctions import save_sweep
+from labonchip.tests.test_frequency_domain import pulse_train_response
+
+
+def simulated_sweeps(sweeps=50, **kwargs):
+    ps = SimulatedPS5000a(seed=0, **kwargs)
+    fs, samples, _ = ps.setSamplingInterval(1E-4, 120E-3)
+    Y = np.array([ps.getDataV('A') for _ in range(sweeps)])
+    return fs, samples, Y
+
+
+@pytest.mark.parametrize('gain, noise', [(100.0, 0.01), (9.0, 0.05), (2.0, 0.05)])
+def test_detect_window_flat_pump(gain, noise):
+    # 10 ms flat pump then a 1 ms decay
+    fs, samples, Y = simulated_sweeps(pump=10.0, tau=1.0, gain=gain, noise=noise)
+    window = detect_window(np.arange(samples) * fs * 1E3, Y)
+    assert window['pump'] == pytest.approx(10.0, abs=0.15)
+    assert window['reject_start'] < 0.5
+
+    # The amplitude is referenced to the end of the pump
+    x, keep = decay_window(fs, samples, **window)
+    popt, _ = fit_decay_batch(x, Y.mean(axis=0)[keep])
+    assert popt[0, 0] == pytest.approx(gain * np.exp(-(window['pump'] - 10.0)), rel=0.05)
+    assert popt[0, 1] == pytest.approx(1.0, rel=0.02)
+
+
+def test_detect_window_saturated_pump():
+    # Plateau clipped by the scope range: the pump still ends at the falling edge
+    fs, samples, Y = simulated_sweeps(pump=10.0, tau=1.0, gain=10.0, noise=0.05)
+    window = detect_window(np.arange(samples) * fs * 1E3, np.minimum(Y, 8.0))
+    assert window['pump'] == pytest.approx(10.0, abs=0.4)
+
+
+def saved_sweeps(directory, sweeps=6, **kwargs):
+    fs, samples, Y = simulated_sweeps(sweeps=sweeps, **kwargs)
+    (directory / 'raw').mkdir()
+    start = datetime(2026, 1, 1)
+    for i, y in enumerate(Y):
+        save_sweep(str(directory), dict(measurementID='run', fs=fs, sample_no=samples,
+                                        datetime=start + timedelta(seconds=i)), y)
+    return sorted(str(file) for file in (directory / 'raw').iterdir())
+
+
+def test_analyse_files_backends_agree(tmp_path):
+    files = saved_sweeps(tmp_path, sweeps=10, pump=10.0, tau=1.0)
+    results = {}
+    for backend in ('serial', 'thread', 'process'):
+        df = pd.concat(analyse_files(files, backend=backend, workers=2, chunksize=3, progress=False, pump=10.0,
+                                     reject_start=0.0), ignore_index=True)
+        results[backend] = df.sort_values('file').reset_index(drop=True)
+    assert len(results['serial']) == len(files)
+    assert np.allclose(results['serial']['tau'], 1.0, rtol=0.05)
+    for backend in ('thread', 'process'):
+        pd.testing.assert_frame_equal(results[backend], results['serial'])
+
+
+@pytest.mark.parametrize('backend', ['serial', 'thread'])
+def test_analyse_files_isolates_failing_file(tmp_path, monkeypatch, backend):
+    files = saved_sweeps(tmp_path, pump=10.0, tau=1.0)
+
+    # One file makes the fit raise: only that file gets an error row
+    analyse_sweeps = Analysis.analyse_sweeps
+
+    def failing(log, *args):
+        if files[2] in set(log['file']):
+            raise RuntimeError('bad sweep')
+        return analyse_sweeps(log, *args)
+    monkeypatch.setattr(Analysis, 'analyse_sweeps', failing)
+
+    df = pd.concat(analyse_files(files, backend=backend, chunksize=3, progress=False, pump=10.0, reject_start=0.0),
+                   ignore_index=True).set_index('file')
+    assert len(df) == len(files)
+    assert df.loc[files[2], 'error'] == 'RuntimeError: bad sweep'
+    assert np.isnan(df.loc[files[2], 'tau'])
+    others = df.drop(index=files[2])
+    assert others['error'].isna().all()
+    assert np.allclose(others['tau'], 1.0, rtol=0.05)
+
+
+def test_analyse_files_raises_settings_errors():
+    with pytest.raises(TypeError):
+        list(analyse_files([], backend='serial', pupm=10.0))
+
+
+def test_analyse_sweeps_qcw_harmonics():
+    fs, period, width = 1E-5, 10E-3, 3E-3
+    Y = np.array([pulse_train_response(tau, period, width, fs) for tau in (1E-3, 2E-3)])
+    log = pd.DataFrame({'fs': fs, 'sample_no': Y.shape[1], 'period': 10.0, 'pulse_width': 3.0}, index=[0, 1])
+    settings = analysis_settings(harmonics=2)
+    log = analyse_sweeps(log, Y, decay_window(fs, Y.shape[1]), settings)
+    for n in (1, 2):
+        assert log['tau_phase_{}'.format(n)].tolist() == pytest.approx([1.0, 2.0], rel=0.02)
+        # No background subtracted: no modulation lifetime
+        assert log['tau_mod_{}'.format(n)].isna().all()
+
+    with pytest.raises(ValueError, match='period'):
+        analyse_sweeps(log.drop(columns=['period']), Y, decay_window(fs, Y.shape[1]), settings)
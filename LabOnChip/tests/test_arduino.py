@@ -0,0 +1,56 @@
+import time
+
+import pytest
+
+pytest.importorskip('serial')
+
+from labonchip.Methods.Devices.Arduino import Arduino, FrameDecoder, encode_frame
+from labonchip.Methods.Devices.Simulated import SimulatedArduino
+
+
+def wait_for(condition, timeout=2.0):
+    start = time.time()
+    while not condition() and time.time() - start < timeout:
+        time.sleep(0.005)
+    return condition()
+
+
+def test_background_reader_keeps_snapshot_current():
+    ser = SimulatedArduino(seed=0, timeout=0.2)
+    arduino = Arduino(ser=ser)
+    assert arduino.tempC == pytest.approx(22.0, abs=0.1)
+
+    arduino.start(interval=0.02)
+    assert arduino.running
+    first = arduino.latest()['tempC_time']
+    assert wait_for(lambda: arduino.latest()['tempC_time'] > first)
+    assert set(arduino.latest()) >= {'tempC', 'humidity', 't_in', 't_out'}
+    arduino.close()
+    assert not arduino.running
+
+
+def test_frame_decoder_resynchronises():
+    frames = [encode_frame(seq, 1000 * seq, 22.0 + seq / 100, 45.0, 25.0, -1.5) for seq in (1, 2, 3, 5)]
+    corrupted = bytearray(frames[1])
+    corrupted[8] ^= 0x01
+    stream = b'noise\xa5' + frames[0] + bytes(corrupted) + b'\x00' + frames[2] + frames[3]
+
+    # Fed one byte at a time, as a slow port would deliver it
+    decoder = FrameDecoder()
+    decoded = []
+    for i in range(len(stream)):
+        decoded += decoder.feed(stream[i:i + 1])
+    assert [frame['seq'] for frame in decoded] == [1, 3, 5]
+    assert decoded[1]['tempC'] == 22.03 and decoded[1]['t_out'] == -1.5 and decoded[1]['millis'] == 3000
+    assert decoder.crc_errors == 1
+    assert decoder.dropped == 2
+
+
+def test_binary_stream():
+    arduino = Arduino(binary=True, ser=SimulatedArduino(seed=0, timeout=0.2))
+    assert arduino.latest()['tempC'] == pytest.approx(22.0, abs=0.1)
+    arduino.start(interval=0.02)
+    first = arduino.decoder.last_seq
+    assert wait_for(lambda: arduino.decoder.last_seq >= first + 3)
+    arduino.close()
+    assert arduino.decoder.crc_errors == arduino.decoder.dropped == 0
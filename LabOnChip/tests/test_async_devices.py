@@ -0,0 +1,43 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('photonics')
+
+from labonchip.Methods.Devices.AsyncDevices import AsyncITC4001, Coordinator
+from labonchip.Methods.Devices.ITC4001 import ITC4001
+from labonchip.Methods.Devices.Simulated import SimulatedITC4001, simulated_rig
+
+
+def test_setpoint_needs_period_and_width():
+    inst = SimulatedITC4001(seed=0)
+    laser = AsyncITC4001(ITC4001(inst=inst))
+    with pytest.raises(ValueError):
+        asyncio.run(laser.setpoint(period=0.13))
+    asyncio.run(laser.setpoint(current=0.2, period=0.13, width=0.01))
+    laser.close()
+    assert inst.settings['SOUR:PULS:PER'] == 0.13
+    assert inst.settings['SOUR:PULS:WIDT'] == 0.01
+    assert inst.settings['SOUR:CURR'] == 0.2
+
+
+def test_coordinator_transition_and_acquire(tmp_path):
+    rig = simulated_rig(seed=0)
+    rig['scope'].openScope()
+    coordinator = Coordinator(**rig)
+    log = dict(measurementID='async', current=0.3, fs=rig['scope'].res[0], sample_no=rig['scope'].res[1])
+    try:
+        settled, elapsed = coordinator.run(coordinator.transition(
+            laser=dict(current=0.3, period=0.13, width=0.01, on=True), rates={1: 0.5, 2: 0.25}, settle=True))
+        assert settled
+        assert rig['pump'].status == {1: 'I', 2: 'I'}
+
+        total = coordinator.run(coordinator.acquire(5, log, dataf=str(tmp_path) + '/', poll_interval=0.01))
+    finally:
+        coordinator.close()
+    assert total.shape == (log['sample_no'],)
+    assert len(list((tmp_path / 'async' / 'raw').iterdir())) == 5
+    assert log['sweep_no'] == 5
+    # Sensors and optical power were polled into the log while capturing
+    assert log['optical power'] > 0
+    assert 'tempC' in log
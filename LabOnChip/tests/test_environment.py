@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from labonchip.Methods.Environment import EnvironmentLogger, attach_environment, load_environment
+
+
+def test_flush_keeps_fields_that_appear_later(tmp_path):
+    file = str(tmp_path / 'environment.csv')
+    readings = iter([{}, {'tempC': 21.5}, {'tempC': 21.6, 'humidity': 40.0}])
+    logger = EnvironmentLogger(file, sources={'arduino': lambda: next(readings), 'laser': lambda: 0.1})
+    for _ in range(3):
+        logger.sample()
+        logger.flush()
+
+    env = load_environment(file)
+    assert list(env.columns) == ['datetime', 'laser', 'tempC', 'humidity']
+    assert env['tempC'].isna().tolist() == [True, False, False]
+    assert env['humidity'].tolist()[-1] == 40.0
+
+
+def test_attach_empty_environment_keeps_columns():
+    df = pd.DataFrame({'datetime': pd.to_datetime(['2020-01-01']), 'tempC': [20.0]})
+    env = pd.DataFrame({'datetime': pd.to_datetime([]), 'tempC': []})
+    assert attach_environment(df, env)['tempC'].tolist() == [20.0]
+
+
+@pytest.mark.parametrize('method', ['interp', 'asof'])
+def test_attach_keeps_values_outside_logged_span(method):
+    start = pd.Timestamp('2020-01-01')
+    df = pd.DataFrame({'datetime': start + pd.to_timedelta([0.5, 1.5, 3.0], unit='s'),
+                       'tempC': [20.0, 20.0, 20.5], 'optical power': [0.1, 0.1, 0.12]})
+    env = pd.DataFrame({'datetime': start + pd.to_timedelta([1.0, 2.0], unit='s'),
+                        'tempC': [21.0, 22.0], 'optical power': [np.nan, np.nan]})
+    joined = attach_environment(df, env, method=method)
+    # Before the first reading: kept as logged; inside the span: from the readings; after it: kept
+    # (asof carries the last reading forward); no power readings at all: kept
+    assert joined['tempC'].tolist() == [20.0, 21.5 if method == 'interp' else 21.0,
+                                        20.5 if method == 'interp' else 22.0]
+    assert joined['optical power'].tolist() == [0.1, 0.1, 0.12]
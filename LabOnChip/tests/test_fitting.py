@@ -0,0 +1,31 @@
+import tracemalloc
+
+import numpy as np
+
+from labonchip.Methods.Fitting import bootstrap_model_batch, fit_decay_batch
+
+
+def decays(sweeps=40, n=500, tau=1.0, noise=0.02, seed=0):
+    x = np.arange(n) * 0.01
+    rng = np.random.default_rng(seed)
+    return x, 2 * np.exp(-x / tau)[None, :] + 0.1 + rng.normal(0, noise, (sweeps, n))
+
+
+def test_bootstrap_intervals_cover_tau():
+    x, Y = decays()
+    popt, perr = fit_decay_batch(x, Y)
+    lo, hi, std = bootstrap_model_batch(x, Y, popt, n_boot=200, seed=0)
+    assert lo.shape == hi.shape == std.shape == (40, 3)
+    # White noise: the bootstrap spread matches the covariance errors, the 95% intervals cover tau
+    assert 0.8 < np.median(std[:, 1] / perr[:, 1]) < 1.2
+    assert np.mean((lo[:, 1] < 1.0) & (1.0 < hi[:, 1])) > 0.85
+
+
+def test_bootstrap_groups_stay_within_max_bytes():
+    x, Y = decays(sweeps=20, n=1000)
+    tracemalloc.start()
+    lo, hi, std = bootstrap_model_batch(x, Y, n_boot=100, seed=0, max_bytes=2E7)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert peak < 2E7
+    assert np.isfinite(std).all()
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from labonchip.Methods.FrequencyDomain import phase_lifetime
+
+
+def pulse_train_response(tau, period, width, fs, periods=5, delay=0.0):
+    """Steady state response of a single exponential decay to a rectangular pulse train."""
+    n = int(round(periods * period / fs))
+    t = (np.arange(-5 * n, n) + 0.5) * fs
+    e = ((t - delay) % period < width).astype(float)
+    # First order response, exact for an excitation constant over each sample
+    decay = np.exp(-fs / tau)
+    y = np.empty_like(e)
+    y[0] = 0.0
+    for k in range(1, len(e)):
+        y[k] = y[k - 1] * decay + e[k - 1] * (1 - decay)
+    return y[-n:]
+
+
+@pytest.mark.parametrize('delay', [0.0, 4E-3])
+def test_phase_lifetime_per_harmonic(delay):
+    fs, period, width = 1E-5, 10E-3, 3E-3
+    Y = np.array([pulse_train_response(tau, period, width, fs, delay=delay) for tau in (0.5E-3, 1E-3, 2E-3)])
+    tau_phase, tau_mod = phase_lifetime(Y, fs, period, width=width, delay=delay, n_harmonics=3)
+    assert tau_phase.shape == tau_mod.shape == (3, 3)
+    expected = np.array([[0.5], [1.0], [2.0]])
+    assert np.allclose(tau_phase, expected, rtol=0.02)
+    assert np.allclose(tau_mod, expected, rtol=0.02)
@@ -0,0 +1,33 @@
+import glob
+
+import numpy as np
+import pytest
+
+pytest.importorskip('photonics')
+
+from labonchip.Methods.Analysis import analyse_files
+from labonchip.Methods.Devices.Simulated import simulated_rig
+from labonchip.Methods.HelperFunctions import sweeps_number
+from labonchip.Methods.Statistics import GroupedRollingStats
+
+
+def test_live_tracker_matches_offline_analysis(tmp_path):
+    rig = simulated_rig(seed=0)
+    scope, laserDriver = rig['scope'], rig['laserDriver']
+    scope.openScope()
+    laserDriver.set_ld_current(0.3)
+    laserDriver.turn_ld_on()
+    log = dict(measurementID='live', current=0.3, fs=scope.res[0], sample_no=scope.res[1],
+               pump=10.0, reject_start=0.0)
+
+    tracker = GroupedRollingStats(keys=['current'], columns=['tau'], window=20)
+    dataf = str(tmp_path) + '/'
+    for folder in ('raw', 'Plots'):
+        (tmp_path / 'live' / folder).mkdir(parents=True)
+    sweeps_number(20, log, scope, laserDriver, dataf=dataf, thermocouple=False, tracker=tracker)
+
+    offline = np.concatenate([np.asarray(df['tau']) for df in analyse_files(
+        glob.glob(dataf + 'live/raw/*.h5'), backend='serial', progress=False, pump=10.0, reject_start=0.0)])
+    live = tracker[0.3]['tau'].summary()['mean']
+    assert offline.mean() == pytest.approx(1.0, rel=0.02)
+    assert live == pytest.approx(offline.mean(), rel=0.01)
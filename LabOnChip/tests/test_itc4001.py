@@ -0,0 +1,73 @@
+import threading
+import time
+
+import pytest
+
+from labonchip.Methods.Devices.ITC4001 import ITC4001, InstrumentError, join_commands
+from labonchip.Methods.Devices.Simulated import SimulatedITC4001
+
+
+def test_join_commands_from_root():
+    assert join_commands(['SOUR:CURR 0.1', ':OUTP ON', '*OPC?', ':SYST:ERR?']) == \
+        'SOUR:CURR 0.1;:OUTP ON;*OPC?;:SYST:ERR?'
+    assert join_commands([':SOUR:CURR 0.1']) == 'SOUR:CURR 0.1'
+
+
+def test_batch_with_absolute_commands():
+    inst = SimulatedITC4001(seed=0)
+    laserDriver = ITC4001(inst=inst)
+    laserDriver.send([':SOUR:CURR 0.2', ':OUTP ON'], verify=True)
+    assert inst.settings['SOUR:CURR'] == 0.2
+    assert inst.settings['OUTP'] == 'ON'
+
+
+def test_batch_sends_one_verified_message_and_skips_unchanged_settings():
+    inst = SimulatedITC4001(seed=0)
+    laserDriver = ITC4001(inst=inst)
+    del inst.messages[:]
+    with laserDriver.batch(verify=True):
+        laserDriver.set_ld_current(0.3)
+        laserDriver.set_qcw(period=0.13, width=0.01)
+        laserDriver.turn_ld_on()
+    assert inst.messages == ['SOUR:CURR 0.30;:SOUR:PULS:PER 0.130;:SOUR:PULS:WIDT 0.010;:TRIG:SOUR INT;:OUTP ON;'
+                             '*OPC?;:SYST:ERR?']
+    assert inst.settings['SOUR:CURR'] == 0.3 and inst.settings['OUTP'] == 'ON'
+
+    # Only the change and the (uncached) output state are sent again
+    with laserDriver.batch(verify=True):
+        laserDriver.set_ld_current(0.3)
+        laserDriver.set_qcw(period=0.13, width=0.02)
+        laserDriver.turn_ld_on()
+    assert inst.messages[-1] == 'SOUR:PULS:WIDT 0.020;:OUTP ON;*OPC?;:SYST:ERR?'
+
+
+def test_batch_reports_errors_and_forgets_the_cache():
+    inst = SimulatedITC4001(seed=0)
+    laserDriver = ITC4001(inst=inst)
+    with pytest.raises(InstrumentError) as error:
+        with laserDriver.batch(verify=True):
+            laserDriver.set_ld_current(0.9)
+            laserDriver.set_qcw(period=0.1, width=0.2)
+    assert [code for code, message in error.value.errors] == [-222, -221]
+    assert laserDriver.state == {}
+    laserDriver.sync()
+
+
+def test_stop_monitor_does_not_wait_on_a_hung_query(capsys):
+    inst = SimulatedITC4001(seed=0)
+    laserDriver = ITC4001(inst=inst)
+    laserDriver.start_monitor(interval=0.01)
+    assert laserDriver.monitoring
+    assert 'optical power' in laserDriver.snapshot
+
+    # The next VISA transaction hangs
+    hang = threading.Event()
+    query = inst.query
+    inst.query = lambda message: hang.wait() and query(message)
+    time.sleep(0.05)
+    start = time.time()
+    laserDriver.stop_monitor(timeout=0.1)
+    assert time.time() - start < 1.0
+    assert not laserDriver.monitoring
+    assert 'still running' in capsys.readouterr().out
+    hang.set()
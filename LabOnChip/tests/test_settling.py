@@ -0,0 +1,17 @@
+from labonchip.Methods.Devices.ITC4001 import ITC4001
+from labonchip.Methods.Devices.Simulated import SimulatedITC4001
+from labonchip.Methods.Settling import settle_laser
+
+
+def test_settle_laser_off_without_reference():
+    laserDriver = ITC4001(inst=SimulatedITC4001(rise=0.05, seed=0))
+    laserDriver.set_ld_current(0.3)
+    laserDriver.turn_ld_on()
+    assert settle_laser(laserDriver, on=True, interval=0.02, timeout=2.0)[0]
+
+    # The power decays towards zero: settled once it is dark, well before the timeout
+    laserDriver.turn_ld_off()
+    settled, elapsed = settle_laser(laserDriver, on=False, interval=0.02, timeout=2.0)
+    assert settled
+    assert elapsed < 1.0
+    assert laserDriver.get_optical_power() < 1E-4
@@ -0,0 +1,31 @@
+import pytest
+
+pytest.importorskip('serial')
+
+from labonchip.Methods.Devices.Simulated import simulated_rig
+from labonchip.Methods.Devices.SyringePump import Error
+
+
+def test_simulated_rig_passes_each_simulator_its_options():
+    # kwargs (also a local name of the simulators' __init__) is not an option
+    rig = simulated_rig(seed=0, drop=0.5, error_rate=0.1, gain=50.0, kwargs=1)
+    assert rig['arduino'].ser.drop == rig['pump'].syringe_pump.drop == 0.5
+    assert rig['pump'].syringe_pump.error_rate == rig['laserDriver'].inst.error_rate == 0.1
+    assert rig['scope'].ps.gain == 50.0
+
+
+def test_error_injection_repeats_with_the_seed():
+    def exchange(seed):
+        rig = simulated_rig(seed=seed, drop=0.3, timeout=0.05)
+        pump = rig['pump']
+        replies = []
+        for _ in range(20):
+            try:
+                replies.append(pump.send_command(1, 'VER'))
+            except Error:
+                replies.append(None)
+        return replies
+
+    first = exchange(3)
+    assert first == exchange(3)
+    assert None in first and (1, 'S', 'NE1000V3.928') in first
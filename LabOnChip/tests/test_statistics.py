@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from labonchip.Methods.Statistics import StreamingStats, allan_deviation, drift_rate, regular_series, \
+    stability_analysis
+
+
+def test_streaming_stats_match_numpy():
+    rng = np.random.default_rng(0)
+    x = rng.normal(2.0, 0.5, 100000)
+    stats = StreamingStats(bins=20, hist_range=(0.0, 4.0))
+    for chunk in np.array_split(x, 37):
+        stats.update(chunk)
+    summary = stats.summary()
+    assert summary['count'] == x.size
+    assert summary['mean'] == pytest.approx(x.mean(), rel=1E-12)
+    assert summary['var'] == pytest.approx(x.var(ddof=1), rel=1E-10)
+    assert (summary['min'], summary['max']) == (x.min(), x.max())
+    assert np.array_equal(stats.hist, np.histogram(x, bins=20, range=(0.0, 4.0))[0])
+
+
+def test_streaming_stats_merge():
+    rng = np.random.default_rng(1)
+    x, y = rng.normal(0.0, 1.0, 1000), rng.normal(5.0, 2.0, 3000)
+    a, b = StreamingStats(), StreamingStats()
+    a.update(x)
+    b.update(y)
+    a.merge(b)
+    a.merge(StreamingStats())
+    both = np.concatenate([x, y])
+    assert a.count == both.size
+    assert a.mean == pytest.approx(both.mean(), rel=1E-12)
+    assert a.var == pytest.approx(both.var(ddof=1), rel=1E-10)
+
+
+def naive_allan(y, m):
+    """Overlapping and modified Allan deviations straight from their definitions."""
+    avg = np.array([y[i:i + m].mean() for i in range(len(y) - m + 1)])
+    d = avg[m:] - avg[:-m]
+    inner = np.array([d[j:j + m].mean() for j in range(len(d) - m + 1)])
+    return np.sqrt(0.5 * np.mean(d ** 2)), np.sqrt(0.5 * np.mean(inner ** 2))
+
+
+def test_allan_deviation_matches_definition():
+    rng = np.random.default_rng(0)
+    y = rng.normal(1.0, 0.1, 600)
+    result = allan_deviation(y, tau0=2.0, m=[1, 3, 10, 50])
+    assert np.array_equal(result['tau'], [2.0, 6.0, 20.0, 100.0])
+    for i, m in enumerate([1, 3, 10, 50]):
+        adev, mdev = naive_allan(y, m)
+        assert result['adev'][i] == pytest.approx(adev, rel=1E-9)
+        assert result['mdev'][i] == pytest.approx(mdev, rel=1E-9)
+    # White noise averages down as 1/sqrt(m)
+    assert result['adev'][2] == pytest.approx(0.1 / np.sqrt(10), rel=0.2)
+
+
+def test_allan_deviation_leaves_out_gaps():
+    rng = np.random.default_rng(1)
+    y = rng.normal(0.0, 1.0, 200)
+    y[100] = np.nan
+    result = allan_deviation(y, m=[1, 5])
+    # A gap removes every difference whose windows contain it
+    assert result['n_adev'].tolist() == [199 - 2, 191 - 10]
+    assert np.isfinite(result['adev']).all()
+
+
+def test_regular_series_and_drift():
+    datetime = pd.Timestamp('2026-01-01') + pd.to_timedelta([0, 10, 20, 40, 50, 60], unit='s')
+    values = 1.0 + 0.36 * np.array([0, 10, 20, 40, 50, 60]) / 3600
+    y, tau0 = regular_series(datetime, values)
+    assert tau0 == 10.0
+    assert np.isnan(y[3]) and y[4] == values[3]
+    slope, slope_err = drift_rate(datetime, values)
+    assert slope == pytest.approx(0.36)
+
+    df = pd.DataFrame({'datetime': datetime, 'tau': values})
+    deviations, drifts = stability_analysis(df, columns=['tau'])
+    assert set(deviations['column']) == {'tau'}
+    assert drifts['drift_per_hour'][0] == pytest.approx(0.36)
@@ -0,0 +1,22 @@
+import pytest
+
+pytest.importorskip('serial')
+
+from labonchip.Methods.Devices.Simulated import SimulatedSyringePump
+from labonchip.Methods.Devices.SyringePump import ETX, STX, Error, SyringePump
+
+
+def test_corrupted_reply_keeps_replies_aligned():
+    ser = SimulatedSyringePump(addresses=(1, 2), timeout=0.2)
+    pump = SyringePump(ser=ser)
+    handle = ser.handle
+
+    def corrupt_first(command):
+        ser.handle = handle
+        return STX + b'0\xb1S' + ETX
+    ser.handle = corrupt_first
+
+    with pytest.raises(Error, match='Corrupted response'):
+        pump.send_commands([(1, 'VER'), (2, 'VER')])
+    # The other pump's reply was read with the corrupted one: the next exchange is not shifted
+    assert pump.send_commands([(2, 'RAT 1.00 MM'), (1, 'VER')]) == [(2, 'S', ''), (1, 'S', 'NE1000V3.928')]